@@ -0,0 +1,131 @@
+"""
+Extractor Fuzz Benchmark
+Feeds pathological OCR-like text to every regex extractor and reports how long each document takes,
+which fields were skipped by the extraction budget and which patterns were slow.
+
+Usage:
+    python benchmarks/extractor_fuzz.py --size 200000
+    python benchmarks/extractor_fuzz.py --size 20000 --compare-re
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ocr_services.pos_ocr import PoSOCRService
+from ocr_services.pos_ocr2 import PoSOCRServiceTwo
+from ocr_services.invoice_ocr import InvoiceOCRService
+from ocr_services.ppa_ocr import PPAOCRService
+from ocr_services.termsheet_ocr import TermSheetOCRService
+
+
+def _repeat(unit: str, size: int) -> str:
+    return (unit * (size // len(unit) + 1))[:size]
+
+
+def label_flood(anchors, size: int, rng: random.Random) -> str:
+    """Every label repeated with no value after it (worst case for lazy '.*?' patterns)"""
+    return _repeat(" ".join(anchors) + " ", size)
+
+
+def single_line(anchors, size: int, rng: random.Random) -> str:
+    """One huge line of labels and digits without a newline or unit"""
+    words = list(anchors) + ["1", "2.5", "1,000", "=", ":", "|", "■"]
+    return " ".join(rng.choice(words) for _ in range(size // 4))[:size]
+
+
+def digit_soup(anchors, size: int, rng: random.Random) -> str:
+    """Digits and separators after a few labels (backtracking in number groups)"""
+    return " ".join(anchors[:3]) + " " + _repeat("1 2,3.4 ", size)
+
+
+def whitespace_run(anchors, size: int, rng: random.Random) -> str:
+    """Labels followed by long runs of spaces and colons"""
+    return "".join(anchor + _repeat(" :", size // max(len(anchors), 1)) for anchor in anchors)[:size]
+
+
+def label_soup(anchors, size: int, rng: random.Random) -> str:
+    """Random labels, values and line breaks"""
+    tokens = list(anchors) + [": ", " ", "\n", "2024-01-05", "Yes", "No", "-51.2 gCO2e/MJ", "100 t/yr", "€1,000.00"]
+    return "".join(rng.choice(tokens) for _ in range(size // 6))[:size]
+
+
+GENERATORS = {
+    "label_flood": label_flood,
+    "single_line": single_line,
+    "digit_soup": digit_soup,
+    "whitespace_run": whitespace_run,
+    "label_soup": label_soup,
+}
+
+
+def run_fields(service, text: str) -> dict:
+    """Time the extractor's full regex pass and every field separately"""
+    started = time.perf_counter()
+    service._extract_fields(text)
+    total = time.perf_counter() - started
+
+    fields = service.field_specs.scan(text, slow_pattern_seconds=float("inf"))
+    slowest_name, slowest = None, 0.0
+    for name in service.field_specs.specs:
+        started = time.perf_counter()
+        fields.search(name)
+        elapsed = time.perf_counter() - started
+        if elapsed > slowest:
+            slowest_name, slowest = name, elapsed
+    return {"total": total, "slowest": slowest_name, "slowest_time": slowest, "skipped": len(fields.skipped)}
+
+
+def run_unbounded(service, text: str) -> float:
+    """Time plain re.search over the whole text for every field (the pre-field-spec behaviour)"""
+    started = time.perf_counter()
+    for spec in service.field_specs.specs.values():
+        spec.pattern.search(text)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fuzz the regex extractors with pathological text")
+    parser.add_argument("--size", type=int, default=200_000, help="Characters per generated document")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compare-re", action="store_true",
+                        help="Also time unbounded re.search per field (can be very slow on large sizes)")
+    args = parser.parse_args()
+
+    # Keep the run offline
+    os.environ['USE_LLM_REFINEMENT'] = 'false'
+    services = [PoSOCRService(), PoSOCRServiceTwo(), InvoiceOCRService(), PPAOCRService(), TermSheetOCRService()]
+    budget = float(os.getenv('OCR_EXTRACTION_BUDGET_MS', '2000'))
+
+    header = f"{'extractor':<22} {'input':<15} {'total':>10} {'slowest field':<42} {'skipped':>7}"
+    if args.compare_re:
+        header += f" {'re.search':>10}"
+    print(f"{args.size} chars per document, budget {budget:.0f}ms\n")
+    print(header)
+
+    over_budget = 0
+    for service in services:
+        anchors = list(service.field_specs.anchors)
+        for generator_name, generator in GENERATORS.items():
+            text = generator(anchors, args.size, random.Random(args.seed))
+            result = run_fields(service, text)
+            line = (f"{type(service).__name__:<22} {generator_name:<15} {result['total'] * 1000:>8.1f}ms "
+                    f"{(result['slowest'] or '-')[:34]:<34} {result['slowest_time'] * 1000:>5.1f}ms "
+                    f"{result['skipped']:>7}")
+            if args.compare_re:
+                line += f" {run_unbounded(service, text) * 1000:>8.1f}ms"
+            print(line)
+            if result["total"] * 1000 > budget * 1.5:
+                over_budget += 1
+
+    if over_budget:
+        print(f"\n{over_budget} document(s) ran well past the extraction budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+OCR Backend Benchmark
+Compares per-page OCR time of the pytesseract (subprocess per page) and tesserocr (warm in-process engine) backends.
+
+Usage:
+    python benchmarks/ocr_backends.py test_pdfs/PoS_A.pdf --iterations 5
+"""
+
+import argparse
+import importlib.util
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pdf2image import convert_from_path
+
+from ocr_services.ocr_backends import PytesseractBackend, TesserocrBackend
+
+
+def benchmark_backend(backend, images, iterations: int) -> dict:
+    """Time every page over several iterations; the first call is reported separately as warm-up"""
+    started = time.perf_counter()
+    backend.image_to_data(images[0])
+    warmup = time.perf_counter() - started
+
+    page_times = []
+    words = 0
+    for _ in range(iterations):
+        for image in images:
+            started = time.perf_counter()
+            data = backend.image_to_data(image)
+            page_times.append(time.perf_counter() - started)
+            words = sum(1 for text in data['text'] if str(text).strip())
+    return {
+        "warmup": warmup,
+        "mean": statistics.mean(page_times),
+        "median": statistics.median(page_times),
+        "words_last_page": words
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OCR backends on a PDF")
+    parser.add_argument("pdf", help="PDF to rasterize and OCR")
+    parser.add_argument("--iterations", type=int, default=3, help="Passes over all pages per backend")
+    parser.add_argument("--dpi", type=int, default=200, help="Rasterization DPI (pdf2image default is 200)")
+    parser.add_argument("--max-pages", type=int, default=5, help="Pages of the PDF to use")
+    parser.add_argument("--lang", default=os.getenv('OCR_TESSERACT_LANG', 'eng'))
+    args = parser.parse_args()
+
+    # Rasterize once so only OCR time is measured
+    images = convert_from_path(args.pdf, dpi=args.dpi, first_page=1, last_page=args.max_pages)
+    print(f"{len(images)} page(s) at {args.dpi} DPI, {args.iterations} iteration(s)\n")
+
+    backends = [PytesseractBackend(args.lang)]
+    if importlib.util.find_spec('tesserocr') is not None:
+        backends.append(TesserocrBackend(args.lang, os.getenv('OCR_TESSDATA_PATH') or None))
+    else:
+        print("tesserocr is not installed; only benchmarking pytesseract\n")
+
+    print(f"{'backend':<12} {'warm-up':>10} {'mean/page':>10} {'median/page':>12} {'words':>7}")
+    results = {}
+    for backend in backends:
+        result = benchmark_backend(backend, images, args.iterations)
+        results[backend.name] = result
+        print(f"{backend.name:<12} {result['warmup'] * 1000:>8.1f}ms {result['mean'] * 1000:>8.1f}ms "
+              f"{result['median'] * 1000:>10.1f}ms {result['words_last_page']:>7}")
+
+    if len(results) == 2:
+        saved = results['pytesseract']['mean'] - results['tesserocr']['mean']
+        print(f"\ntesserocr saves {saved * 1000:.1f}ms per page "
+              f"({saved / results['pytesseract']['mean'] * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+OCR Profile Benchmark
+Compares per-page OCR time and field-level accuracy of the OCR profiles on the test PDFs.
+The test PDFs have a text layer, so the fields extracted from it serve as ground truth; every page is
+rasterized and OCR'd with each profile and the same extractor is run on the OCR result.
+--preprocess runs the given image preprocessing stages first, to measure their effect on accuracy.
+
+Usage:
+    python benchmarks/ocr_profiles.py
+    python benchmarks/ocr_profiles.py test_pdfs/Invoice_test.pdf --profiles default table --dpi 150
+    python benchmarks/ocr_profiles.py --preprocess grayscale deskew binarize
+"""
+
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pdf2image import convert_from_bytes
+
+from ocr_services.field_gap import get_field
+from ocr_services.invoice_ocr import InvoiceOCRService
+from ocr_services.layout import structure_text_by_spatial_layout
+from ocr_services.ocr_backends import get_ocr_backend
+from ocr_services.ocr_profiles import get_ocr_profiles
+from ocr_services.page_router import classify_pdf_pages
+from ocr_services.pos_ocr import PoSOCRService
+from ocr_services.preprocessing import PreprocessSettings, preprocess_image
+from ocr_services.ppa_ocr import PPAOCRService
+from ocr_services.termsheet_ocr import TermSheetOCRService
+from ocr_services.word_boxes import WordBoxes
+
+
+# Document type by file name prefix
+SERVICES = {
+    "pos": PoSOCRService,
+    "invoice": InvoiceOCRService,
+    "ppa": PPAOCRService,
+    "termsheet": TermSheetOCRService,
+}
+
+# Profiles meant for single field regions, not whole pages
+REGION_PROFILES = ("line", "numeric_line")
+
+PREPROCESS_STAGES = ("grayscale", "downscale", "deskew", "binarize")
+
+
+def doc_type_of(path: str) -> str:
+    name = os.path.basename(path).lower()
+    for doc_type in SERVICES:
+        if name.startswith(doc_type):
+            return doc_type
+    raise ValueError(f"Can't tell the document type of {path} from its name")
+
+
+def _normalize(value) -> str:
+    return " ".join(str(value).split()).lower()
+
+
+def field_accuracy(service, reference: dict, extracted: dict) -> tuple[int, int]:
+    """Fields read like the text layer did, out of the fields the text layer has"""
+    correct = total = 0
+    for path in service.field_anchors:
+        expected = get_field(reference, path)
+        if expected is None:
+            continue
+        total += 1
+        actual = get_field(extracted, path)
+        if actual is not None and _normalize(actual) == _normalize(expected):
+            correct += 1
+    return correct, total
+
+
+def preprocess_pages(images, settings: PreprocessSettings) -> tuple[list, list, dict]:
+    """Run the preprocessing stages on every page; returns the images, their transforms and mean ms per stage"""
+    processed, transforms, timings = [], [], {}
+    for image in images:
+        image, transform, stage_timings = preprocess_image(image, settings)
+        processed.append(image)
+        transforms.append(transform)
+        for name, seconds in stage_timings.items():
+            timings.setdefault(name, []).append(seconds * 1000)
+    return processed, transforms, {name: statistics.mean(values) for name, values in timings.items()}
+
+
+def benchmark_profile(service, profile, images, transforms=None) -> dict:
+    """OCR every page with the profile and run the service's extractors on the laid-out text"""
+    backend = get_ocr_backend(None, profile.lang, profile.oem)
+    # Warm up the engine for this language / engine mode
+    backend.image_to_data(images[0], profile.psm, profile.whitelist)
+
+    page_times = []
+    pages = []
+    for page_num, image in enumerate(images):
+        started = time.perf_counter()
+        data = backend.image_to_data(image, profile.psm, profile.whitelist)
+        page_times.append(time.perf_counter() - started)
+        page_boxes = WordBoxes.from_tesseract(data, page_num)
+        pages.append(transforms[page_num].restore(page_boxes) if transforms else page_boxes)
+
+    boxes = WordBoxes.concat(pages)
+    extracted = service._extract_fields(structure_text_by_spatial_layout(boxes))
+    return {"mean": statistics.mean(page_times), "words": len(boxes), "extracted": extracted}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OCR profiles on PDFs with a text layer")
+    parser.add_argument("pdfs", nargs="*", help="PDFs named like the document type (default: test_pdfs/*.pdf)")
+    parser.add_argument("--profiles", nargs="*", help="Profiles to compare (default: all page profiles)")
+    parser.add_argument("--dpi", type=int, default=int(os.getenv('OCR_DPI', '200')), help="Rasterization DPI")
+    parser.add_argument("--max-pages", type=int, default=5, help="Pages of each PDF to use")
+    parser.add_argument("--preprocess", nargs="*", choices=PREPROCESS_STAGES, default=[],
+                        help="Image preprocessing stages to run before OCR (default: none)")
+    args = parser.parse_args()
+
+    # Keep the run offline
+    os.environ['USE_LLM_REFINEMENT'] = 'false'
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    pdfs = args.pdfs or sorted(glob.glob(os.path.join(root, 'test_pdfs', '*.pdf')))
+    registry = get_ocr_profiles()
+    names = args.profiles or [name for name in registry.names() if name not in REGION_PROFILES]
+
+    settings = PreprocessSettings(*[stage in args.preprocess for stage in PREPROCESS_STAGES])
+
+    print(f"{len(pdfs)} PDF(s) at {args.dpi} DPI, profiles: {', '.join(names)}, "
+          f"preprocessing: {', '.join(args.preprocess) or 'none'}\n")
+    print(f"{'document':<22} {'profile':<14} {'mean/page':>10} {'words':>7} {'fields':>9} {'accuracy':>9}")
+    totals = {name: {"seconds": [], "correct": 0, "total": 0} for name in names}
+    for path in pdfs:
+        service = SERVICES[doc_type_of(path)]()
+        with open(path, 'rb') as f:
+            content = f.read()
+
+        reference = service._extract_fields("".join(page["text"] + "\n" for page in classify_pdf_pages(content)))
+        # Rasterize once so only OCR time is measured
+        images = convert_from_bytes(content, dpi=args.dpi, first_page=1, last_page=args.max_pages)
+        transforms = None
+        if settings.enabled:
+            images, transforms, stage_ms = preprocess_pages(images, settings)
+            print(f"{os.path.basename(path)[:22]:<22} preprocessing/page: "
+                  + ", ".join(f"{name} {ms:.1f}ms" for name, ms in stage_ms.items()))
+
+        for name in names:
+            result = benchmark_profile(service, registry.get(name), images, transforms)
+            correct, total = field_accuracy(service, reference, result["extracted"])
+            totals[name]["seconds"].append(result["mean"])
+            totals[name]["correct"] += correct
+            totals[name]["total"] += total
+            accuracy = f"{correct / total * 100:.0f}%" if total else "-"
+            print(f"{os.path.basename(path)[:22]:<22} {name:<14} {result['mean'] * 1000:>8.1f}ms "
+                  f"{result['words']:>7} {f'{correct}/{total}':>9} {accuracy:>9}")
+
+    print(f"\n{'profile':<14} {'mean/page':>10} {'accuracy':>9}")
+    for name, total in totals.items():
+        accuracy = f"{total['correct'] / total['total'] * 100:.0f}%" if total["total"] else "-"
+        print(f"{name:<14} {statistics.mean(total['seconds']) * 1000:>8.1f}ms {accuracy:>9}")
+
+
+if __name__ == "__main__":
+    main()
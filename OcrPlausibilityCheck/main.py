@@ -1,19 +1,49 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 import uvicorn
-from typing import Optional
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any
 import os
+import hashlib
+import json
+import time
 
 from ocr_services.pos_ocr import PoSOCRService
 from ocr_services.invoice_ocr import InvoiceOCRService  # To be implemented
 from ocr_services.ppa_ocr import PPAOCRService  # To be implemented
 from ocr_services.termsheet_ocr import TermSheetOCRService  # To be implemented
+from ocr_services.ocr_executor import get_ocr_executor
+from ocr_services.result_cache import get_extraction_cache, extraction_code_digest
+from ocr_services.single_flight import get_single_flight
+from ocr_services.templates import get_template_store, learn_template
+from ocr_services.ocr_profiles import get_ocr_profiles
+from ocr_services.roi_ocr import roi_settings
+from ocr_services.llm_client import get_llm_client
+from ocr_services.llm_cache import get_llm_response_cache
+from ocr_services.job_queue import get_job_queue, JobQueueFull, InvalidCallbackURL
+from ocr_services.plausibility import build_plausibility_request, run_plausibility_check
+from ocr_services.metrics import collect_timings, stage, observe_extraction, format_server_timing
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and stop shared resources"""
+    await get_llm_client().start()
+    await get_job_queue().start()
+    yield
+    await get_job_queue().stop()
+    await get_llm_client().aclose()
+    get_ocr_executor().shutdown()
+
 
 app = FastAPI(
     title="Multi-Document OCR API",
     description="OCR API for processing PPA, Invoices, and Proof of Sustainability documents",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -25,12 +55,84 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def add_server_timing(request: Request, call_next):
+    """Report the pipeline stage timings of the request in a Server-Timing header"""
+    with collect_timings() as timings:
+        started = time.perf_counter()
+        response = await call_next(request)
+        timings["total"] = time.perf_counter() - started
+    if len(timings) > 1:
+        response.headers["Server-Timing"] = format_server_timing(timings)
+    return response
+
 # Initialize OCR services
 pos_ocr_service = PoSOCRService()
 invoice_ocr_service = InvoiceOCRService()  # To be implemented
 ppa_ocr_service = PPAOCRService()  # To be implemented
 termsheet_ocr_service = TermSheetOCRService()  # To be implemented
 
+# Services by document type, for the job API
+ocr_services = {
+    "pos": pos_ocr_service,
+    "invoice": invoice_ocr_service,
+    "ppa": ppa_ocr_service,
+    "termsheet": termsheet_ocr_service
+}
+
+
+def _extraction_variant(service, doc_type: str) -> str:
+    """
+    Cache key part for everything besides the PDF that shapes a result: the extractor version and
+    code, the OCR profile and a digest of the OCR settings (engine, language, DPI, image preprocessing,
+    profile contents, region re-OCR settings) and of the document type's learned templates.
+    """
+    profile = get_ocr_profiles().for_doc_type(doc_type)
+    settings = get_ocr_executor().settings(profile)
+    settings["roi"] = roi_settings() if getattr(service, "use_roi_ocr", False) else None
+    # Learning or relearning a template changes which regions are read, so earlier results are stale
+    settings["templates"] = get_template_store().version(doc_type)
+    digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    variant = f"{service.extractor_version}+{extraction_code_digest()}-{profile.name}-{digest}"
+    if getattr(service, "use_early_stop", False):
+        variant += "-early_stop"
+    return variant
+
+
+async def _extract_with_cache(service, doc_type: str, content: bytes, filename: str) -> tuple[Dict[str, Any], bool]:
+    """
+    Run the service's extraction, reusing a cached result for identical uploads.
+    Concurrent identical uploads (double clicks, retries) share one extraction.
+    Returns the extraction result and whether it was served from cache.
+    """
+    cache = get_extraction_cache()
+    # Results OCR'd with other settings, or stopped early, are not interchangeable
+    key = cache.make_key(content, doc_type, _extraction_variant(service, doc_type))
+
+    async def extract() -> tuple[Dict[str, Any], bool, Dict[str, float]]:
+        # Per-document entries, since the documents of a bundle are extracted concurrently
+        with collect_timings(doc_type) as timings:
+            with stage("cache"):
+                result = await asyncio.to_thread(cache.get, key)
+            cached = result is not None
+
+            if not cached:
+                result = await service.process_document(content, filename)
+
+                # Don't pin a degraded result when LLM refinement failed or the extraction budget ran out
+                if "llm_error" not in result and not result.get("extraction_skipped"):
+                    with stage("cache"):
+                        await asyncio.to_thread(cache.put, key, result)
+        return result, cached, timings
+
+    started = time.perf_counter()
+    (result, cached, timings), shared = await get_single_flight().do(key, extract)
+    # Stages of a shared extraction are already recorded by the request that ran it
+    observe_extraction(doc_type, cached, time.perf_counter() - started, {} if shared else timings)
+    return result, cached
+
+
 @app.get("/")
 async def root():
     """Root endpoint with API information"""
@@ -41,7 +143,13 @@ async def root():
             "pos": "/api/v1/ocr/pos",
             "invoice": "/api/v1/ocr/invoice",
             "ppa": "/api/v1/ocr/ppa",
-            "termsheet": "/api/v1/ocr/termsheet"
+            "termsheet": "/api/v1/ocr/termsheet",
+            "bundle": "/api/v1/ocr/bundle",
+            "submit_job": "/api/v1/jobs/{doc_type}",
+            "job_status": "/api/v1/jobs/{job_id}",
+            "ocr_profiles": "/api/v1/ocr/profiles",
+            "templates": "/api/v1/templates",
+            "learn_template": "/api/v1/templates/{doc_type}/learn"
         }
     }
 
@@ -49,7 +157,48 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "OCR API"}
+    return {
+        "status": "healthy",
+        "service": "OCR API",
+        "ocr_pool": get_ocr_executor().stats(),
+        "extraction_cache": get_extraction_cache().stats(),
+        "single_flight": get_single_flight().stats(),
+        "templates": get_template_store().stats(),
+        "llm_http_pool": get_llm_client().stats(),
+        "llm_response_cache": get_llm_response_cache().stats(),
+        "job_queue": get_job_queue().stats()
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: extraction and per-stage duration histograms by document type and cache hit/miss"""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/api/v1/ocr/profiles")
+async def list_ocr_profiles():
+    """List the OCR profiles and the one selected per document type"""
+    return get_ocr_profiles().to_dict()
+
+
+@app.put("/api/v1/ocr/profiles/{doc_type}")
+async def select_ocr_profile(doc_type: str, profile: str = Form(...)):
+    """Select the OCR profile a document type is OCR'd with (until restart; see OCR_PROFILE_<DOC_TYPE>)"""
+    if doc_type not in ocr_services:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Unknown document type '{doc_type}'. Supported: {', '.join(ocr_services)}"
+        )
+    profiles = get_ocr_profiles()
+    try:
+        profiles.select(doc_type, profile)
+    except KeyError:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown OCR profile '{profile}'. Available: {', '.join(profiles.names())}"
+        )
+    return {"doc_type": doc_type, "profile": profile}
 
 
 @app.post("/api/v1/ocr/pos")
@@ -79,13 +228,14 @@ async def process_pos_document(file: UploadFile = File(...)):
         content = await file.read()
         
         # Process the document
-        result = await pos_ocr_service.process_document(content, file.filename)
+        result, cached = await _extract_with_cache(pos_ocr_service, "pos", content, file.filename)
         
         return JSONResponse(
             status_code=200,
             content={
                 "status": "success",
                 "filename": file.filename,
+                "cached": cached,
                 "data": result
             }
         )
@@ -115,13 +265,14 @@ async def process_invoice_document(file: UploadFile = File(...)):
         content = await file.read()
         
         # Process the document
-        result = await invoice_ocr_service.process_document(content, file.filename)
+        result, cached = await _extract_with_cache(invoice_ocr_service, "invoice", content, file.filename)
 
         return JSONResponse(
             status_code=200,
             content={
                 "status": "success",
                 "filename": file.filename,
+                "cached": cached,
                 "data": result
             }
         )
@@ -151,13 +302,14 @@ async def process_ppa_document(file: UploadFile = File(...)):
         content = await file.read()
         
         # Process the document
-        result = await ppa_ocr_service.process_document(content, file.filename)
+        result, cached = await _extract_with_cache(ppa_ocr_service, "ppa", content, file.filename)
         print(result)
         return JSONResponse(
             status_code=200,
             content={
                 "status": "success",
                 "filename": file.filename,
+                "cached": cached,
                 "data": result
             }
         )
@@ -188,13 +340,14 @@ async def process_termsheet_document(file: UploadFile = File(...)):
         content = await file.read()
         
         # Process the document
-        result = await termsheet_ocr_service.process_document(content, file.filename)
+        result, cached = await _extract_with_cache(termsheet_ocr_service, "termsheet", content, file.filename)
 
         return JSONResponse(
             status_code=200,
             content={
                 "status": "success",
                 "filename": file.filename,
+                "cached": cached,
                 "data": result
             }
         )
@@ -206,6 +359,182 @@ async def process_termsheet_document(file: UploadFile = File(...)):
         )
 
 
+@app.post("/api/v1/ocr/bundle")
+async def process_document_bundle(
+    pos: UploadFile = File(...),
+    invoice: UploadFile = File(...),
+    ppa: UploadFile = File(...),
+    termsheet: UploadFile = File(...),
+    plant_id: Optional[str] = Form(None)
+):
+    """
+    Extract all four certification documents concurrently and run the plausibility check.
+
+    Returns:
+        JSON with each document's extraction and the PlausibilityCheckResponse.
+        If the plausibility check itself fails, the extractions are still returned
+        together with plausibility_error.
+    """
+    uploads = {"pos": pos, "invoice": invoice, "ppa": ppa, "termsheet": termsheet}
+    for doc_type, file in uploads.items():
+        if not file.filename.lower().endswith('.pdf'):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid file type for {doc_type}. Only PDF files are supported."
+            )
+
+    try:
+        contents = {doc_type: await file.read() for doc_type, file in uploads.items()}
+
+        # Extract concurrently; OCR work is bounded by the shared process pool
+        outcomes = await asyncio.gather(*[
+            _extract_with_cache(ocr_services[doc_type], doc_type, contents[doc_type], file.filename)
+            for doc_type, file in uploads.items()
+        ])
+        documents = {
+            doc_type: {
+                "filename": file.filename,
+                "cached": cached,
+                "data": result
+            }
+            for (doc_type, file), (result, cached) in zip(uploads.items(), outcomes)
+        }
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing document bundle: {str(e)}"
+        )
+
+    payload = build_plausibility_request(
+        {doc_type: document["data"] for doc_type, document in documents.items()},
+        plant_id
+    )
+    content = {
+        "status": "success",
+        "documents": documents,
+        "plausibility": None
+    }
+    try:
+        content["plausibility"], content["plausibility_mode"] = await run_plausibility_check(payload)
+    except Exception as e:
+        print(f"Error running plausibility check: {e}")
+        content["plausibility_error"] = str(e)
+
+    return JSONResponse(status_code=200, content=content)
+
+
+@app.post("/api/v1/jobs/{doc_type}", status_code=202)
+async def submit_job(doc_type: str, file: UploadFile = File(...), callback_url: Optional[str] = Form(None)):
+    """
+    Queue a document for background extraction and return a job id immediately.
+    Poll GET /api/v1/jobs/{job_id} for the result, or pass callback_url (https, public host) to have the
+    finished job POSTed back. Returns 429 with Retry-After when the queue is full.
+    """
+    service = ocr_services.get(doc_type)
+    if service is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Unknown document type '{doc_type}'. Supported: {', '.join(ocr_services)}"
+        )
+    if not file.filename.lower().endswith('.pdf'):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid file type. Only PDF files are supported."
+        )
+
+    content = await file.read()
+    filename = file.filename
+
+    async def handler():
+        result, cached = await _extract_with_cache(service, doc_type, content, filename)
+        return {
+            "status": "success",
+            "filename": filename,
+            "cached": cached,
+            "data": result
+        }
+
+    try:
+        job = await get_job_queue().submit(handler, doc_type, filename, callback_url)
+    except JobQueueFull as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except InvalidCallbackURL as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "status_url": f"/api/v1/jobs/{job['job_id']}"
+    }
+
+
+@app.get("/api/v1/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Return the status of a queued job, and its result once completed"""
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+
+@app.get("/api/v1/templates")
+async def list_templates(doc_type: Optional[str] = None):
+    """List the learned layout templates"""
+    return {"templates": get_template_store().list(doc_type)}
+
+
+@app.post("/api/v1/templates/{doc_type}/learn")
+async def learn_document_template(doc_type: str, file: UploadFile = File(...), extraction: str = Form(...)):
+    """
+    Learn the layout template of a known issuer from a document and its verified extraction.
+
+    Args:
+        file: PDF file upload
+        extraction: JSON of the verified extraction (the "data" of an OCR response, corrected)
+
+    Returns:
+        JSON with the learned template's id and the fields it can read from fixed regions.
+    """
+    service = ocr_services.get(doc_type)
+    if service is None or not hasattr(service, "spatial_labels"):
+        raise HTTPException(
+            status_code=404,
+            detail=f"Templates are not supported for document type '{doc_type}'"
+        )
+    if not file.filename.lower().endswith('.pdf'):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid file type. Only PDF files are supported."
+        )
+    try:
+        verified = json.loads(extraction)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="extraction must be a JSON object")
+    if not isinstance(verified, dict):
+        raise HTTPException(status_code=400, detail="extraction must be a JSON object")
+
+    content = await file.read()
+    try:
+        template = await learn_template(service, doc_type, content, verified, file.filename)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error learning template: {str(e)}"
+        )
+
+    return {
+        "status": "success",
+        "template_id": template["id"],
+        "fields": sorted(template["fields"])
+    }
+
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
@@ -0,0 +1,69 @@
+from typing import Dict, Any, Optional
+
+from ocr_services.field_gap import get_field
+from ocr_services.word_boxes import WordBoxes
+
+
+def _word_confidences(boxes: WordBoxes) -> Dict[str, float]:
+    """Map each OCR'd word to its Tesseract confidence (0-1), keeping the lowest per word"""
+    confidences = {}
+    for word, conf in zip(boxes.words(), (boxes.confidence / 100).tolist()):
+        if conf < 0:
+            continue
+        word = word.lower()
+        confidences[word] = min(conf, confidences.get(word, 1.0))
+    return confidences
+
+
+def score_extraction(
+    extraction: Dict[str, Any],
+    field_anchors: Dict[str, str],
+    boxes: Optional[WordBoxes] = None
+) -> Dict[str, Any]:
+    """
+    Score completeness and confidence of a regex extraction.
+    Text-layer values count as fully confident; OCR'd values take the lowest Tesseract
+    confidence of their words. Scores are reported per field, per extractor section and overall.
+    """
+    word_confidences = _word_confidences(boxes) if boxes is not None and len(boxes) else {}
+    document_confidence = sum(word_confidences.values()) / len(word_confidences) if word_confidences else 1.0
+
+    fields = {}
+    for path in field_anchors:
+        value = get_field(extraction, path)
+        if value is None:
+            fields[path] = 0.0
+        elif not word_confidences:
+            fields[path] = 1.0
+        else:
+            matched = [word_confidences[word] for word in str(value).lower().split() if word in word_confidences]
+            # Cleaned or re-joined values don't map back to single words; use the document-wide average
+            fields[path] = round(min(matched) if matched else document_confidence, 3)
+
+    sections = {}
+    for path, conf in fields.items():
+        section = sections.setdefault(path.split('.')[0], {"filled": 0, "total": 0, "confidence_sum": 0.0})
+        section["total"] += 1
+        if get_field(extraction, path) is not None:
+            section["filled"] += 1
+            section["confidence_sum"] += conf
+
+    def summarize(filled: int, total: int, confidence_sum: float) -> Dict[str, Any]:
+        return {
+            "completeness": round(filled / total, 3) if total else 1.0,
+            "confidence": round(confidence_sum / filled, 3) if filled else 0.0
+        }
+
+    filled = sum(section["filled"] for section in sections.values())
+    total = sum(section["total"] for section in sections.values())
+    confidence_sum = sum(section["confidence_sum"] for section in sections.values())
+
+    return {
+        **summarize(filled, total, confidence_sum),
+        "source": "ocr" if word_confidences else "text_layer",
+        "sections": {
+            name: summarize(section["filled"], section["total"], section["confidence_sum"])
+            for name, section in sections.items()
+        },
+        "fields": fields
+    }
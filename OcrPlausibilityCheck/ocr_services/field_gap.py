@@ -0,0 +1,177 @@
+import copy
+import json
+import os
+import re
+from typing import Dict, Any, Optional, List, Tuple
+
+from ocr_services.llm_client import get_llm_client
+
+
+# Field-gap answers are a handful of short values, so a small output budget is enough
+FIELD_GAP_GENERATION_CONFIG = {
+    "maxOutputTokens": 1024,
+    "temperature": 0.1
+}
+
+
+def get_field(data: Dict[str, Any], path: str) -> Any:
+    """Read a value by dotted path (e.g. 'parties.seller.name')"""
+    value = data
+    for key in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def set_field(data: Dict[str, Any], path: str, value: Any):
+    """Write a value by dotted path, creating intermediate dicts"""
+    keys = path.split('.')
+    target = data
+    for key in keys[:-1]:
+        if not isinstance(target.get(key), dict):
+            target[key] = {}
+        target = target[key]
+    target[keys[-1]] = value
+
+
+def find_missing_fields(
+    extraction: Dict[str, Any],
+    field_anchors: Dict[str, str],
+    field_confidence: Optional[Dict[str, float]] = None,
+    min_confidence: float = 0.0
+) -> List[str]:
+    """Return the refinable fields that are null or below the confidence threshold"""
+    missing = []
+    for path in field_anchors:
+        if get_field(extraction, path) is None:
+            missing.append(path)
+        elif field_confidence is not None and field_confidence.get(path, 1.0) < min_confidence:
+            missing.append(path)
+    return missing
+
+
+def _anchor_hits(text: str, anchor: str, bounds: Optional[List[Tuple[int, int]]] = None):
+    """Yield (match, start, end) for the anchor in the text, or only inside the given spans"""
+    pattern = re.compile(anchor, re.IGNORECASE)
+    for start, end in bounds or [(0, len(text))]:
+        for match in pattern.finditer(text, start, end):
+            yield match, start, end
+
+
+def build_context_windows(
+    text: str,
+    anchors: List[str],
+    radius: int,
+    max_hits: int = 2,
+    bounds: Optional[List[Optional[List[Tuple[int, int]]]]] = None
+) -> str:
+    """
+    Collect the text around each anchor label and merge overlapping windows.
+    Anchors that do not occur in the text contribute nothing. bounds (one entry per anchor) limits
+    an anchor to its document sections and clips its windows to them.
+    """
+    spans = []
+    for index, anchor in enumerate(anchors):
+        anchor_bounds = bounds[index] if bounds is not None else None
+        for hit_num, (match, start, end) in enumerate(_anchor_hits(text, anchor, anchor_bounds)):
+            if hit_num >= max_hits:
+                break
+            spans.append((max(start, match.start() - radius // 4), min(end, match.end() + radius)))
+
+    if not spans:
+        return ""
+
+    spans.sort()
+    merged = [list(spans[0])]
+    for start, end in spans[1:]:
+        if start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return "\n...\n".join(text[start:end].strip() for start, end in merged)
+
+
+def build_field_gap_prompt(document_name: str, fields: List[str], context: str) -> str:
+    """Build a prompt that asks only for the given fields"""
+    field_list = "\n".join(f"- {path}" for path in fields)
+    return f"""You are an expert at extracting structured data from {document_name} documents.
+
+The following fields could not be extracted automatically:
+{field_list}
+
+Here are the relevant EXCERPTS of the document (separated by "..."):
+---
+{context}
+---
+
+INSTRUCTIONS:
+1. Find the value of each listed field in the excerpts
+2. Handle merged fields and table structures ("|" marks column boundaries)
+3. Clean special characters (■ → -, − → -)
+4. Return numbers and dates as strings, exactly as written after cleaning
+5. If a field is not present in the excerpts, return null for it
+
+Return ONLY a flat JSON object mapping each field name above to its value, no explanations."""
+
+
+def merge_field_values(extraction: Dict[str, Any], values: Dict[str, Any], fields: List[str]) -> tuple[Dict[str, Any], List[str]]:
+    """
+    Merge the LLM answers for the requested fields into a copy of the extraction.
+    Returns the merged extraction and the fields that were filled.
+    """
+    merged = copy.deepcopy(extraction)
+    filled = []
+    for path in fields:
+        value = values.get(path)
+        if value is None:
+            value = get_field(values, path)
+        if value is None:
+            continue
+        # Regex extractors produce strings for numeric fields; keep the LLM answer consistent
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = str(value)
+        set_field(merged, path, value)
+        filled.append(path)
+    return merged, filled
+
+
+async def refine_missing_fields(
+    document_name: str,
+    extraction: Dict[str, Any],
+    text: str,
+    field_anchors: Dict[str, str],
+    llm_api_url: str,
+    llm_api_key: str,
+    llm_model: str,
+    fields: Optional[List[str]] = None,
+    field_spans: Optional[Dict[str, List[Tuple[int, int]]]] = None
+) -> tuple[Dict[str, Any], List[str]]:
+    """
+    Ask the LLM only for the missing fields, sending the text windows around their labels.
+    field_spans optionally limits each field's windows to its document sections.
+    Returns the merged extraction and the fields the LLM filled; no call is made when nothing is missing.
+    """
+    if fields is None:
+        fields = find_missing_fields(extraction, field_anchors)
+    field_spans = field_spans or {}
+    # A field whose label never occurs in the text can't be recovered from a window around it
+    fields = [
+        path for path in fields
+        if next(_anchor_hits(text, field_anchors[path], field_spans.get(path)), None) is not None
+    ]
+    radius = int(os.getenv('LLM_FIELD_GAP_WINDOW_CHARS', '300'))
+    context = build_context_windows(
+        text, [field_anchors[path] for path in fields], radius,
+        bounds=[field_spans.get(path) for path in fields]
+    )
+    if not fields or not context:
+        return extraction, []
+
+    prompt = build_field_gap_prompt(document_name, fields, context)
+    values = await get_llm_client().generate_json(
+        llm_api_url, llm_api_key, llm_model, prompt, FIELD_GAP_GENERATION_CONFIG
+    )
+    if not isinstance(values, dict):
+        raise ValueError(f"Expected a JSON object from field-gap refinement, got: {json.dumps(values)[:200]}")
+    return merge_field_values(extraction, values, fields)
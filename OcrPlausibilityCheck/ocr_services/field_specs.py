@@ -0,0 +1,256 @@
+import heapq
+import os
+import re
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+from ocr_services.sections import SectionIndex, SectionSegmenter, span_containing
+
+
+# Characters after a label that a value pattern is matched against
+DEFAULT_WINDOW = 500
+
+# How often (in anchor positions) a field search checks the document deadline
+_DEADLINE_CHECK_INTERVAL = 64
+
+_REGEX_METACHARACTERS = set('\\[](){}.*+?^$|')
+_QUANTIFIERS = set('*+?{')
+
+
+def _has_top_level_alternation(pattern: str) -> bool:
+    """True if the pattern is an alternation at its outermost level (e.g. 'waste|residue')"""
+    depth = 0
+    in_class = False
+    escaped = False
+    for char in pattern:
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif in_class:
+            in_class = char != ']'
+        elif char == '[':
+            in_class = True
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            return True
+    return False
+
+
+def literal_prefix(pattern: str) -> str:
+    """
+    Return the literal text every match of the pattern starts with (e.g. 'PoS ID' for r'PoS ID[\\s:]+...').
+    A character followed by a quantifier is optional and therefore not part of the prefix.
+    """
+    if _has_top_level_alternation(pattern):
+        return ""
+    prefix = []
+    for char in pattern:
+        if char in _REGEX_METACHARACTERS:
+            if char in _QUANTIFIERS and prefix:
+                prefix.pop()
+            break
+        prefix.append(char)
+    return "".join(prefix)
+
+
+class FieldSpec:
+    """
+    A regex field: the value pattern and the literal label every match of it starts with.
+    The anchor defaults to the pattern's literal prefix; patterns without a usable prefix are
+    searched over the whole text. A tuple of anchors gives the alternative ways a label is written
+    (e.g. ('E =', 'E=')), for patterns whose own prefix is too short to anchor on. Values are matched within `window` characters of their anchor,
+    so the window must cover the longest expected label + value. Bounding the window keeps lazy
+    or DOTALL patterns (e.g. r'Compliant.*?Yes') from scanning the rest of the document at every anchor.
+    `sections` binds the field to those document sections (by default the section named like the
+    field's result key); it is searched in the whole text only when none of them was found.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        pattern: str,
+        anchor: Optional[Union[str, Tuple[str, ...]]] = None,
+        flags: int = re.IGNORECASE,
+        window: int = DEFAULT_WINDOW,
+        sections: Optional[Tuple[str, ...]] = None
+    ):
+        self.name = name
+        self.pattern = re.compile(pattern, flags)
+        if anchor is None:
+            anchor = literal_prefix(pattern)
+            anchor = anchor if len(anchor) >= 2 else None
+        if anchor is None:
+            self.anchors: Tuple[str, ...] = ()
+        else:
+            self.anchors = (anchor,) if isinstance(anchor, str) else tuple(anchor)
+        self.window = window
+        self.sections = sections
+
+
+class FieldSpecRegistry:
+    """
+    Field specs of one extractor, compiled once.
+    scan() locates every label anchor with plain substring search on the lowercased text; value
+    patterns are then matched only at those positions instead of searching the whole document per field.
+    """
+
+    def __init__(self, specs: List[FieldSpec], segmenter: Optional[SectionSegmenter] = None):
+        self.segmenter = segmenter
+        self.specs: Dict[str, FieldSpec] = {}
+        for spec in specs:
+            if spec.name in self.specs:
+                raise ValueError(f"Duplicate field spec: {spec.name}")
+            self.specs[spec.name] = spec
+            # Fields default to the section named like their result key (e.g. 'parties.seller' -> 'parties')
+            if spec.sections is None and segmenter is not None and spec.name.split('.')[0] in segmenter.sections:
+                spec.sections = (spec.name.split('.')[0],)
+
+        self.anchors: Dict[str, str] = {}
+        for spec in specs:
+            for anchor in spec.anchors:
+                self.anchors.setdefault(anchor, anchor.lower())
+
+    def scan(
+        self,
+        text: str,
+        budget_seconds: Optional[float] = None,
+        slow_pattern_seconds: Optional[float] = None
+    ) -> "FieldMatches":
+        """
+        Locate all anchors in the text.
+        budget_seconds bounds the total extraction time of the document (OCR_EXTRACTION_BUDGET_MS);
+        fields searched after it has run out are skipped. Single patterns slower than
+        slow_pattern_seconds (OCR_SLOW_PATTERN_MS) are logged.
+        """
+        if budget_seconds is None:
+            budget_seconds = float(os.getenv('OCR_EXTRACTION_BUDGET_MS', '2000')) / 1000
+        if slow_pattern_seconds is None:
+            slow_pattern_seconds = float(os.getenv('OCR_SLOW_PATTERN_MS', '100')) / 1000
+        deadline = time.perf_counter() + budget_seconds if budget_seconds > 0 else None
+        sections = self.segmenter.segment(text) if self.segmenter is not None else None
+
+        lowered = text.lower()
+        positions: Dict[str, List[int]] = {}
+        if len(lowered) != len(text):
+            # Lowercasing changed the length (e.g. 'İ'), so offsets don't line up; use the regex instead
+            for anchor in self.anchors:
+                positions[anchor] = [
+                    hit.start() for hit in re.finditer(re.escape(anchor), text, re.IGNORECASE)
+                ]
+            return FieldMatches(self, text, positions, deadline, slow_pattern_seconds, sections)
+
+        for anchor, needle in self.anchors.items():
+            found = []
+            start = lowered.find(needle)
+            while start != -1:
+                found.append(start)
+                start = lowered.find(needle, start + 1)
+            positions[anchor] = found
+        return FieldMatches(self, text, positions, deadline, slow_pattern_seconds, sections)
+
+    def section_spans(self, sections: SectionIndex, prefix: str) -> List[Tuple[int, int]]:
+        """Spans of the sections the fields under a result key (e.g. 'pricing') are bound to"""
+        names = set()
+        for spec in self.specs.values():
+            if spec.sections and spec.name.split('.')[0] == prefix:
+                names.update(spec.sections)
+        return sections.spans_for(names)
+
+
+class FieldMatches:
+    """
+    Field lookups over one scanned text; search() returns what re.search(pattern, text) would,
+    or None once the document's extraction budget is spent (the field is then listed in `skipped`).
+    """
+
+    def __init__(
+        self,
+        registry: FieldSpecRegistry,
+        text: str,
+        anchor_positions: Dict[str, List[int]],
+        deadline: Optional[float] = None,
+        slow_pattern_seconds: float = 0.1,
+        sections: Optional[SectionIndex] = None
+    ):
+        self.registry = registry
+        self.text = text
+        self.anchor_positions = anchor_positions
+        self.deadline = deadline
+        self.slow_pattern_seconds = slow_pattern_seconds
+        self.sections = sections
+        self.skipped: List[str] = []
+        self.slow_patterns: Dict[str, float] = {}
+        self._results: Dict[str, Optional[re.Match]] = {}
+
+    def search(self, name: str) -> Optional[re.Match]:
+        """Return the first match of the named field, or None"""
+        if name in self._results:
+            return self._results[name]
+
+        spec = self.registry.specs[name]
+        if self._budget_spent():
+            self._skip(spec)
+            return None
+
+        started = time.perf_counter()
+        match = self._search(spec)
+        elapsed = time.perf_counter() - started
+        if elapsed > self.slow_pattern_seconds:
+            self.slow_patterns[name] = elapsed
+            print(f"Slow extraction pattern {name} ({spec.pattern.pattern!r}): "
+                  f"{elapsed * 1000:.1f}ms on {len(self.text)} chars")
+        self._results[name] = match
+        return match
+
+    def _budget_spent(self) -> bool:
+        return self.deadline is not None and time.perf_counter() > self.deadline
+
+    def _skip(self, spec: FieldSpec):
+        if not self.skipped:
+            print(f"Extraction budget exceeded on {len(self.text)} chars; skipping remaining fields")
+        self.skipped.append(spec.name)
+        self._results[spec.name] = None
+
+    def _spans(self, spec: FieldSpec) -> Optional[List[Tuple[int, int]]]:
+        """Spans the field is restricted to, or None for the whole text"""
+        if not spec.sections or self.sections is None:
+            return None
+        return self.sections.spans_for(spec.sections) or None
+
+    def _search(self, spec: FieldSpec) -> Optional[re.Match]:
+        spans = self._spans(spec)
+        if not spec.anchors:
+            if spans is None:
+                return spec.pattern.search(self.text)
+            for start, end in spans:
+                match = spec.pattern.search(self.text, start, end)
+                if match is not None:
+                    return match
+            return None
+
+        if len(spec.anchors) == 1:
+            positions = self.anchor_positions[spec.anchors[0]]
+        else:
+            positions = heapq.merge(*(self.anchor_positions[anchor] for anchor in spec.anchors))
+        for count, position in enumerate(positions):
+            if count and count % _DEADLINE_CHECK_INTERVAL == 0 and self._budget_spent():
+                self._skip(spec)
+                return None
+            limit = len(self.text)
+            if spans is not None:
+                span = span_containing(spans, position)
+                if span is None:
+                    continue
+                limit = span[1]
+            end = min(limit, position + spec.window)
+            match = spec.pattern.match(self.text, position, end)
+            if match is not None and match.end() >= end and end < limit:
+                # A greedy value ran into the window edge; let it continue up to one more window
+                match = spec.pattern.match(self.text, position, min(limit, end + spec.window))
+            if match is not None:
+                return match
+        return None
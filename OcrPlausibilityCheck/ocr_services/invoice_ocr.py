@@ -1,15 +1,21 @@
-import re
 from typing import Dict, Any, Optional, List
-import io
-import PyPDF2
-from pdf2image import convert_from_bytes
-import pytesseract
-from PIL import Image
 import os
 import json
-import httpx
 from dotenv import load_dotenv
 
+from ocr_services.page_router import extract_document_text, extract_document_text_until
+from ocr_services.ocr_profiles import get_ocr_profiles
+from ocr_services.layout import structure_text_by_spatial_layout
+from ocr_services.word_boxes import WordBoxes
+from ocr_services.llm_client import get_llm_client
+from ocr_services.refinement import refine_extraction
+from ocr_services.metrics import stage, timed
+from ocr_services.field_specs import FieldSpec, FieldSpecRegistry, FieldMatches
+from ocr_services.field_gap import get_field
+from ocr_services.spatial_index import fill_from_layout
+from ocr_services.templates import extract_with_template
+from ocr_services.roi_ocr import reocr_weak_fields
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -19,6 +25,60 @@ class InvoiceOCRService:
     Service for extracting structured data from Invoice documents.
     """
     
+    # Bump whenever extraction logic changes so cached results are invalidated
+    extractor_version = "1.2.0"
+    
+    # Label patterns used to locate each field for field-gap LLM refinement
+    field_anchors = {
+        "identifiers.invoice_no": r"Invoice No",
+        "identifiers.issue_date": r"Issue Date",
+        "identifiers.payment_due": r"Payment Due",
+        "parties.supplier": r"Supplier",
+        "parties.buyer": r"Buyer",
+        "billing_period.period_start": r"Period",
+        "billing_period.period_end": r"Period",
+        "product_amount.product": r"Product",
+        "product_amount.quantity": r"Quantity",
+        "product_amount.unit": r"Quantity",
+        "product_amount.unit_price": r"Unit Price",
+        "product_amount.unit_price_currency": r"Unit Price",
+        "product_amount.amount_excl_vat": r"Amount",
+        "product_amount.amount_currency": r"Amount",
+        "logistics.incoterm": r"Incoterm",
+        "logistics.customs": r"Customs"
+    }
+    
+    # Labels whose values are also read from OCR word geometry when the text pass misses them
+    spatial_labels = [
+        "Invoice No", "Issue Date", "Payment Due", "Supplier", "Buyer", "Product",
+        "Quantity", "Unit Price", "Amount (excl. VAT)", "Incoterm", "Customs"
+    ]
+    
+    # Fields the plausibility checks read; early-stop mode stops OCR'ing pages once all are found
+    required_fields = [
+        "identifiers.invoice_no", "identifiers.payment_due", "parties.supplier", "parties.buyer",
+        "product_amount.product", "product_amount.quantity", "product_amount.unit_price"
+    ]
+    
+    # Labels with numeric values; their regions are re-OCR'd with a digit/unit whitelist
+    numeric_labels = ["Quantity", "Unit Price", "Amount (excl. VAT)"]
+    
+    # Regex fields, compiled once; each value pattern is matched only where its label occurs
+    field_specs = FieldSpecRegistry([
+        FieldSpec("identifiers.invoice", r'Invoice No[\s:\.]+([A-Z0-9■\-]+)'),
+        FieldSpec("identifiers.issue", r'Issue Date[\s:]+(\d{4}[■\-]\d{2}[■\-]\d{2})'),
+        FieldSpec("identifiers.due", r'Payment Due[\s:]+(\d{4}[■\-]\d{2}[■\-]\d{2})'),
+        FieldSpec("parties.supplier", r'Supplier[\s:]+([^\n]+)'),
+        FieldSpec("parties.buyer", r'Buyer[\s:]+([^\n]+)'),
+        FieldSpec("billing_period.period", r'(\d{4}[■\-]\d{2}[■\-]\d{2})\s*[→>■\-]+\s*(\d{4}[■\-]\d{2}[■\-]\d{2})'),
+        FieldSpec("product_amount.product", r'Product[\s:]+([^\n]+)'),
+        FieldSpec("product_amount.quantity", r'Quantity[\s:]+([0-9\.]+)\s*(t|tonnes|MT)'),
+        FieldSpec("product_amount.unit_price", r'Unit Price[\s:]+([€$£])([0-9,]+\.\d{2})/t'),
+        FieldSpec("product_amount.amount", r'Amount\s*\(excl\.?\s*VAT\)[\s:]+([€$£])([0-9,]+\.\d{2})'),
+        FieldSpec("logistics.incoterm", r'Incoterm[\s:]+([^\n]+)'),
+        FieldSpec("logistics.customs", r'Customs[\s:]+([^\n]+)')
+    ])
+    
     def __init__(self):
         """Initialize the Invoice OCR service"""
         # LLM Configuration
@@ -26,134 +86,89 @@ class InvoiceOCRService:
         self.llm_api_url = os.getenv('LLM_API_URL', 'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent')
         self.llm_api_key = os.getenv('LLM_API_KEY')
         self.llm_model = os.getenv('LLM_MODEL', 'gemini-2.0-flash')
+        # 'field_gap' asks the LLM only for missing fields; 'full' re-extracts the whole document
+        self.llm_refinement_mode = os.getenv('LLM_REFINEMENT_MODE', 'field_gap').lower()
+        # Skip the LLM when the regex pass is complete and confident enough
+        self.llm_bypass_min_completeness = float(os.getenv('LLM_BYPASS_MIN_COMPLETENESS', '1.0'))
+        self.llm_bypass_min_confidence = float(os.getenv('LLM_BYPASS_MIN_CONFIDENCE', '0.85'))
+        # Fields below this confidence are re-asked in field_gap mode
+        self.llm_field_min_confidence = float(os.getenv('LLM_FIELD_MIN_CONFIDENCE', '0.6'))
+        # Fill fields from OCR word positions (label -> value to the right / below) after the regex pass
+        self.use_spatial_fields = os.getenv('OCR_SPATIAL_FIELDS', 'true').lower() == 'true'
+        # Re-OCR the regions of missing and low-confidence fields at a higher DPI
+        self.use_roi_ocr = os.getenv('OCR_ROI_REOCR', 'false').lower() == 'true'
+        # OCR scanned pages in order and stop once the required fields are found (skips annexes)
+        self.use_early_stop = os.getenv('OCR_EARLY_STOP', 'false').lower() == 'true'
+        self.early_stop_batch = int(os.getenv('OCR_EARLY_STOP_BATCH', '1'))
     
     async def process_document(self, content: bytes, filename: str) -> Dict[str, Any]:
         """Process the Invoice document and extract structured information."""
-        text = self._extract_text_from_pdf(content)
-        
-        structured_text = None
-        if not text or len(text.strip()) < 100:
-            text, bounding_boxes = self._ocr_pdf_with_bounding_boxes(content)
-            if bounding_boxes:
-                structured_text = self._structure_text_by_spatial_layout(bounding_boxes)
+        # Scans of a known issuer layout: OCR only the field regions learned for it
+        templated = await extract_with_template(self, "invoice", content)
+        if templated is not None:
+            extracted_data, text, bounding_boxes = templated
+            return await refine_extraction(self, "Invoice", extracted_data, text, bounding_boxes)
+
+        # Use the text layer where it is usable and OCR only the remaining pages
+        profile = get_ocr_profiles().for_doc_type("invoice")
+        pages_skipped = None
+        if self.use_early_stop:
+            text, structured_text, bounding_boxes, pages_skipped = await extract_document_text_until(
+                content, self._structure_text_by_spatial_layout, self._has_required_fields, profile, self.early_stop_batch
+            )
+        else:
+            text, structured_text, bounding_boxes = await extract_document_text(
+                content, self._structure_text_by_spatial_layout, profile
+            )
         
         processing_text = structured_text if structured_text else text
         
-        extracted_data = {
-            "identifiers": self._extract_identifiers(processing_text),
-            "parties": self._extract_parties(processing_text),
-            "billing_period": self._extract_billing_period(processing_text),
-            "product_amount": self._extract_product_amount(processing_text),
-            "logistics": self._extract_logistics(processing_text),
-            "raw_text": text,
-            "structured_text": structured_text
-        }
+        with stage("regex"):
+            extracted_data = self._extract_fields(processing_text)
+        if self.use_spatial_fields and bounding_boxes is not None and len(bounding_boxes):
+            # Tables flattened to text lose which value belongs to which label; resolve those from geometry
+            with stage("spatial"):
+                extracted_data["layout_fields"] = fill_from_layout(self, extracted_data, bounding_boxes)
+        if self.use_roi_ocr and bounding_boxes is not None and len(bounding_boxes):
+            # Small table cells (CI values, volumes) are misread at the page DPI; re-read just those
+            with stage("roi"):
+                extracted_data["roi_fields"], bounding_boxes = await reocr_weak_fields(
+                    self, "invoice", content, extracted_data, bounding_boxes
+                )
+        if pages_skipped is not None:
+            extracted_data["pages_skipped"] = pages_skipped
+        extracted_data["raw_text"] = text
+        extracted_data["structured_text"] = structured_text
         
-        if self.use_llm_refinement and self.llm_api_key:
-            try:
-                refined_data = await self._refine_with_llm(extracted_data, processing_text)
-                refined_data["raw_text"] = text
-                refined_data["structured_text"] = structured_text
-                refined_data["llm_refined"] = True
-                return refined_data
-            except Exception as e:
-                print(f"LLM refinement failed: {e}")
-                extracted_data["llm_refined"] = False
-                return extracted_data
-        else:
-            extracted_data["llm_refined"] = False
-            return extracted_data
+        return await refine_extraction(self, "Invoice", extracted_data, processing_text, bounding_boxes)
     
-    def _extract_text_from_pdf(self, content: bytes) -> str:
-        """Extract text directly from PDF"""
-        try:
-            pdf_file = io.BytesIO(content)
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            return text
-        except Exception as e:
-            print(f"Error extracting text from PDF: {e}")
-            return ""
+    def _has_required_fields(self, text: str, boxes: Optional[WordBoxes]) -> bool:
+        """Whether the pages read so far hold every field the plausibility checks need"""
+        extracted_data = self._extract_fields(text)
+        if self.use_spatial_fields and boxes is not None and len(boxes):
+            fill_from_layout(self, extracted_data, boxes)
+        return all(get_field(extracted_data, path) is not None for path in self.required_fields)
     
-    def _ocr_pdf_with_bounding_boxes(self, content: bytes) -> tuple[str, List[Dict[str, Any]]]:
-        """Perform OCR with bounding box data"""
-        try:
-            images = convert_from_bytes(content)
-            all_text = ""
-            all_boxes = []
-            
-            for page_num, image in enumerate(images):
-                data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
-                n_boxes = len(data['text'])
-                for i in range(n_boxes):
-                    text = data['text'][i].strip()
-                    if text:
-                        box_info = {
-                            'text': text,
-                            'left': data['left'][i],
-                            'top': data['top'][i],
-                            'width': data['width'][i],
-                            'height': data['height'][i],
-                            'confidence': data['conf'][i],
-                            'page': page_num
-                        }
-                        all_boxes.append(box_info)
-                        all_text += text + " "
-                all_text += "\n"
-            return all_text.strip(), all_boxes
-        except Exception as e:
-            print(f"Error performing bounding box OCR: {e}")
-            return "", []
-    
-    def _structure_text_by_spatial_layout(self, boxes: List[Dict[str, Any]]) -> str:
+    @timed("layout")
+    def _structure_text_by_spatial_layout(self, boxes: WordBoxes) -> str:
         """Structure text based on spatial layout"""
-        if not boxes:
-            return ""
-        
-        lines = []
-        current_line = []
-        current_y = None
-        y_tolerance = 10
-        
-        sorted_boxes = sorted(boxes, key=lambda b: (b['top'], b['left']))
-        
-        for box in sorted_boxes:
-            if current_y is None:
-                current_y = box['top']
-                current_line = [box]
-            elif abs(box['top'] - current_y) <= y_tolerance:
-                current_line.append(box)
-            else:
-                if current_line:
-                    lines.append(current_line)
-                current_line = [box]
-                current_y = box['top']
-        
-        if current_line:
-            lines.append(current_line)
-        
-        structured_text = ""
-        for line in lines:
-            line.sort(key=lambda b: b['left'])
-            prev_right = None
-            for box in line:
-                if prev_right is not None:
-                    gap = box['left'] - prev_right
-                    if gap > 50:
-                        structured_text += "  |  "
-                    elif gap > 20:
-                        structured_text += "  "
-                    else:
-                        structured_text += " "
-                structured_text += box['text']
-                prev_right = box['left'] + box['width']
-            structured_text += "\n"
-        
-        return structured_text
+        return structure_text_by_spatial_layout(boxes)
+    
+    def _extract_fields(self, text: str) -> Dict[str, Any]:
+        """Run the regex extractors over the document text"""
+        fields = self.field_specs.scan(text)
+        extracted = {
+            "identifiers": self._extract_identifiers(fields),
+            "parties": self._extract_parties(fields),
+            "billing_period": self._extract_billing_period(fields),
+            "product_amount": self._extract_product_amount(fields),
+            "logistics": self._extract_logistics(fields)
+        }
+        if fields.skipped:
+            extracted["extraction_skipped"] = list(fields.skipped)
+        return extracted
     
-    def _extract_identifiers(self, text: str) -> Dict[str, Any]:
+    def _extract_identifiers(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract invoice identifiers"""
         identifiers = {
             "invoice_no": None,
@@ -162,45 +177,40 @@ class InvoiceOCRService:
         }
         
         # Invoice number
-        invoice_pattern = r'Invoice No[\s:\.]+([A-Z0-9■\-]+)'
-        match = re.search(invoice_pattern, text, re.IGNORECASE)
+        match = fields.search("identifiers.invoice")
         if match:
             identifiers["invoice_no"] = match.group(1).replace('■', '-').strip()
         
         # Issue date
-        issue_pattern = r'Issue Date[\s:]+(\d{4}[■\-]\d{2}[■\-]\d{2})'
-        match = re.search(issue_pattern, text, re.IGNORECASE)
+        match = fields.search("identifiers.issue")
         if match:
             identifiers["issue_date"] = match.group(1).replace('■', '-')
         
         # Payment due
-        due_pattern = r'Payment Due[\s:]+(\d{4}[■\-]\d{2}[■\-]\d{2})'
-        match = re.search(due_pattern, text, re.IGNORECASE)
+        match = fields.search("identifiers.due")
         if match:
             identifiers["payment_due"] = match.group(1).replace('■', '-')
         
         return identifiers
     
-    def _extract_parties(self, text: str) -> Dict[str, Any]:
+    def _extract_parties(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract party information"""
         parties = {
             "supplier": None,
             "buyer": None
         }
         
-        supplier_pattern = r'Supplier[\s:]+([^\n]+)'
-        match = re.search(supplier_pattern, text, re.IGNORECASE)
+        match = fields.search("parties.supplier")
         if match:
             parties["supplier"] = match.group(1).strip()
         
-        buyer_pattern = r'Buyer[\s:]+([^\n]+)'
-        match = re.search(buyer_pattern, text, re.IGNORECASE)
+        match = fields.search("parties.buyer")
         if match:
             parties["buyer"] = match.group(1).strip()
         
         return parties
     
-    def _extract_billing_period(self, text: str) -> Dict[str, Any]:
+    def _extract_billing_period(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract billing period"""
         billing = {
             "period_start": None,
@@ -208,15 +218,14 @@ class InvoiceOCRService:
         }
         
         # Billing period with arrow
-        period_pattern = r'(\d{4}[■\-]\d{2}[■\-]\d{2})\s*[→>■\-]+\s*(\d{4}[■\-]\d{2}[■\-]\d{2})'
-        match = re.search(period_pattern, text, re.IGNORECASE)
+        match = fields.search("billing_period.period")
         if match:
             billing["period_start"] = match.group(1).replace('■', '-')
             billing["period_end"] = match.group(2).replace('■', '-')
         
         return billing
     
-    def _extract_product_amount(self, text: str) -> Dict[str, Any]:
+    def _extract_product_amount(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract product and amount information"""
         product_amount = {
             "product": None,
@@ -229,35 +238,31 @@ class InvoiceOCRService:
         }
         
         # Product
-        product_pattern = r'Product[\s:]+([^\n]+)'
-        match = re.search(product_pattern, text, re.IGNORECASE)
+        match = fields.search("product_amount.product")
         if match:
             product_amount["product"] = match.group(1).strip()
         
         # Quantity
-        quantity_pattern = r'Quantity[\s:]+([0-9\.]+)\s*(t|tonnes|MT)'
-        match = re.search(quantity_pattern, text, re.IGNORECASE)
+        match = fields.search("product_amount.quantity")
         if match:
             product_amount["quantity"] = match.group(1).strip()
             product_amount["unit"] = match.group(2).strip()
         
         # Unit price
-        unit_price_pattern = r'Unit Price[\s:]+([€$£])([0-9,]+\.\d{2})/t'
-        match = re.search(unit_price_pattern, text, re.IGNORECASE)
+        match = fields.search("product_amount.unit_price")
         if match:
             product_amount["unit_price_currency"] = match.group(1).strip()
             product_amount["unit_price"] = match.group(2).replace(',', '').strip()
         
         # Amount (excl. VAT)
-        amount_pattern = r'Amount\s*\(excl\.?\s*VAT\)[\s:]+([€$£])([0-9,]+\.\d{2})'
-        match = re.search(amount_pattern, text, re.IGNORECASE)
+        match = fields.search("product_amount.amount")
         if match:
             product_amount["amount_currency"] = match.group(1).strip()
             product_amount["amount_excl_vat"] = match.group(2).replace(',', '').strip()
         
         return product_amount
     
-    def _extract_logistics(self, text: str) -> Dict[str, Any]:
+    def _extract_logistics(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract logistics information"""
         logistics = {
             "incoterm": None,
@@ -265,14 +270,12 @@ class InvoiceOCRService:
         }
         
         # Incoterm
-        incoterm_pattern = r'Incoterm[\s:]+([^\n]+)'
-        match = re.search(incoterm_pattern, text, re.IGNORECASE)
+        match = fields.search("logistics.incoterm")
         if match:
             logistics["incoterm"] = match.group(1).strip()
         
         # Customs
-        customs_pattern = r'Customs[\s:]+([^\n]+)'
-        match = re.search(customs_pattern, text, re.IGNORECASE)
+        match = fields.search("logistics.customs")
         if match:
             logistics["customs"] = match.group(1).strip()
         
@@ -311,35 +314,15 @@ INSTRUCTIONS:
 
 Return ONLY the corrected JSON, no explanations."""
 
+        generation_config = {
+            "maxOutputTokens": 4096,
+            "temperature": 0.1
+        }
+        
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                headers = {
-                    "X-goog-api-key": self.llm_api_key,
-                    "Content-Type": "application/json"
-                }
-                
-                payload = {
-                    "contents": [{
-                        "parts": [{"text": prompt}]
-                    }],
-                    "generationConfig": {
-                        "maxOutputTokens": 4096,
-                        "temperature": 0.1
-                    }
-                }
-                
-                response = await client.post(self.llm_api_url, headers=headers, json=payload)
-                response.raise_for_status()
-                result = response.json()
-                
-                llm_text = result['candidates'][0]['content']['parts'][0]['text'].strip()
-                if llm_text.startswith('```'):
-                    llm_text = re.sub(r'^```json\s*\n', '', llm_text)
-                    llm_text = re.sub(r'^```\s*\n', '', llm_text)
-                    llm_text = re.sub(r'\n```\s*$', '', llm_text)
-                
-                refined_data = json.loads(llm_text)
-                return refined_data
+            return await get_llm_client().generate_json(
+                self.llm_api_url, self.llm_api_key, self.llm_model, prompt, generation_config
+            )
         except Exception as e:
             print(f"Error in LLM refinement: {str(e)}")
             raise
\ No newline at end of file
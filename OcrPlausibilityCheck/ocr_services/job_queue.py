@@ -0,0 +1,224 @@
+import asyncio
+import ipaddress
+import math
+import os
+import socket
+import time
+import uuid
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+from urllib.parse import urlsplit
+
+from ocr_services.llm_client import get_llm_client
+
+
+class JobQueueFull(Exception):
+    """Raised when the job queue is at capacity"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Job queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class InvalidCallbackURL(ValueError):
+    """Raised for callback URLs the service must not POST results to"""
+
+
+def _is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address)
+    # IPv4-mapped IPv6 (::ffff:10.0.0.1) is judged by the IPv4 address it carries
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def _host_allowed(host: str, allowed_hosts: List[str]) -> bool:
+    """Exact host names, or '.example.com' for the domain and its subdomains"""
+    for allowed in allowed_hosts:
+        if allowed.startswith('.'):
+            if host == allowed[1:] or host.endswith(allowed):
+                return True
+        elif host == allowed:
+            return True
+    return False
+
+
+class JobQueue:
+    """
+    Bounded queue of background extraction jobs.
+    A fixed number of workers drain the queue; finished jobs are kept for polling until they expire
+    and can optionally be posted to a callback URL.
+    """
+
+    def __init__(self):
+        """Initialize queue limits from OCR_JOB_* environment settings"""
+        self.workers = int(os.getenv('OCR_JOB_WORKERS', '4'))
+        self.max_queued = int(os.getenv('OCR_JOB_QUEUE_SIZE', '100'))
+        self.result_ttl_seconds = float(os.getenv('OCR_JOB_RESULT_TTL_SECONDS', '3600'))
+        self.callback_timeout = float(os.getenv('OCR_JOB_CALLBACK_TIMEOUT', '10.0'))
+        # Hosts results may be POSTed to (comma-separated; '.example.com' includes subdomains); empty allows any public host
+        self.callback_allowed_hosts = [
+            host.strip().lower() for host in os.getenv('OCR_JOB_CALLBACK_ALLOWED_HOSTS', '').split(',') if host.strip()
+        ]
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers = []
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._completed = 0
+        self._failed = 0
+        self._total_seconds = 0.0
+
+    async def start(self):
+        """Start the worker tasks"""
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queued)
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Cancel the workers; queued jobs are dropped"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    async def submit(
+        self,
+        handler: Callable[[], Awaitable[Dict[str, Any]]],
+        doc_type: str,
+        filename: str,
+        callback_url: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Enqueue a job and return its record immediately.
+        Raises JobQueueFull instead of waiting when the queue is at capacity, and InvalidCallbackURL
+        for callback URLs that fail check_callback_url.
+        """
+        if callback_url:
+            await self.check_callback_url(callback_url)
+        # Services used outside the app lifespan (scripts, tests) start the workers on demand
+        if self._queue is None:
+            await self.start()
+        self._prune()
+
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "status": "queued",
+            "doc_type": doc_type,
+            "filename": filename,
+            "callback_url": callback_url,
+            "submitted_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None
+        }
+        try:
+            self._queue.put_nowait((job, handler))
+        except asyncio.QueueFull:
+            raise JobQueueFull(self.retry_after())
+
+        self._jobs[job["job_id"]] = job
+        return job
+
+    async def check_callback_url(self, url: str):
+        """
+        Reject callback URLs that could reach internal services: only https, only hosts in
+        OCR_JOB_CALLBACK_ALLOWED_HOSTS when set, and only hosts that resolve to public addresses.
+        """
+        parts = urlsplit(url)
+        host = (parts.hostname or '').lower()
+        if parts.scheme != 'https' or not host:
+            raise InvalidCallbackURL("callback_url must be an https URL")
+        if parts.username or parts.password:
+            raise InvalidCallbackURL("callback_url must not contain credentials")
+        if self.callback_allowed_hosts and not _host_allowed(host, self.callback_allowed_hosts):
+            raise InvalidCallbackURL(f"callback_url host '{host}' is not allowed")
+
+        try:
+            port = parts.port or 443
+            addresses = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except (ValueError, OSError) as e:
+            raise InvalidCallbackURL(f"callback_url host '{host}' can't be resolved: {e}")
+        if not addresses or not all(_is_public_address(address[4][0].split('%')[0]) for address in addresses):
+            raise InvalidCallbackURL(f"callback_url host '{host}' resolves to a private or reserved address")
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job record, or None if unknown or expired"""
+        self._prune()
+        return self._jobs.get(job_id)
+
+    def retry_after(self) -> int:
+        """Estimate how long a rejected client should wait, from the average job duration"""
+        finished = self._completed + self._failed
+        average_seconds = self._total_seconds / finished if finished else 5.0
+        queued = self._queue.qsize() if self._queue is not None else 0
+        return max(1, math.ceil(average_seconds * queued / max(1, self.workers)))
+
+    def stats(self) -> Dict[str, Any]:
+        """Report queue depth and job counts"""
+        return {
+            "workers": self.workers,
+            "max_queued": self.max_queued,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "processing": sum(1 for job in self._jobs.values() if job["status"] == "processing"),
+            "completed": self._completed,
+            "failed": self._failed,
+            "tracked_jobs": len(self._jobs)
+        }
+
+    async def _worker(self):
+        """Run queued jobs one at a time"""
+        while True:
+            job, handler = await self._queue.get()
+            job["status"] = "processing"
+            job["started_at"] = time.time()
+            try:
+                job["result"] = await handler()
+                job["status"] = "completed"
+                self._completed += 1
+            except Exception as e:
+                print(f"Error processing job {job['job_id']}: {e}")
+                job["error"] = str(e)
+                job["status"] = "failed"
+                self._failed += 1
+            finally:
+                job["finished_at"] = time.time()
+                self._total_seconds += job["finished_at"] - job["started_at"]
+                self._queue.task_done()
+
+            if job["callback_url"]:
+                await self._send_callback(job)
+
+    async def _send_callback(self, job: Dict[str, Any]):
+        """POST the finished job to its callback URL; failures are logged, not retried"""
+        try:
+            # Checked again at send time, since the host's DNS records may have changed since submission
+            await self.check_callback_url(job["callback_url"])
+            # Reuse the shared pooled client instead of opening a connection per callback; redirects are not followed
+            response = await get_llm_client().post(
+                job["callback_url"], json=job, timeout=self.callback_timeout, follow_redirects=False
+            )
+            response.raise_for_status()
+        except Exception as e:
+            print(f"Error sending callback for job {job['job_id']}: {e}")
+
+    def _prune(self):
+        """Forget finished jobs older than the result TTL"""
+        cutoff = time.time() - self.result_ttl_seconds
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["finished_at"] is not None and job["finished_at"] < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+_job_queue: Optional[JobQueue] = None
+
+
+def get_job_queue() -> JobQueue:
+    """Return the process-wide job queue"""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue()
+    return _job_queue
@@ -0,0 +1,105 @@
+import numpy as np
+
+from ocr_services.word_boxes import WordBoxes
+
+
+# Tolerances relative to the page's median word height, so layout doesn't depend on DPI.
+# At 200 DPI body text is ~25px high, which matches the former fixed 10px / 20px / 50px thresholds.
+LINE_TOLERANCE_RATIO = 0.4
+WIDE_GAP_RATIO = 0.8
+COLUMN_GAP_RATIO = 2.0
+
+
+def _median_height_per_word(page: np.ndarray, height: np.ndarray) -> np.ndarray:
+    """Return each word's page median word height"""
+    pages, page_index = np.unique(page, return_inverse=True)
+    medians = np.array([np.median(height[page_index == i]) for i in range(len(pages))], dtype=np.float64)
+    return np.maximum(medians[page_index], 1.0)
+
+
+def assign_lines(page: np.ndarray, top: np.ndarray, height: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Group words into line bands per page.
+    Returns the (page, top) sort order and the line id of each word in that order; a new line
+    starts on a page change or at the first word whose top is more than the height-relative
+    tolerance below the top of the word that started the current line.
+    """
+    order = np.lexsort((top, page))
+    tolerance = _median_height_per_word(page, height)[order] * LINE_TOLERANCE_RATIO
+
+    sorted_page = page[order]
+    sorted_top = top[order]
+    new_line = np.zeros(len(order), dtype=bool)
+    page_starts = np.flatnonzero(np.r_[True, sorted_page[1:] != sorted_page[:-1]])
+    page_ends = np.r_[page_starts[1:], len(order)]
+    for start, end in zip(page_starts.tolist(), page_ends.tolist()):
+        tops = sorted_top[start:end]
+        # Jump from line start to line start, so the loop runs per line rather than per word;
+        # comparing against the line's first word keeps gradually stepping (skewed) words apart
+        index = 0
+        while index < len(tops):
+            new_line[start + index] = True
+            index = int(np.searchsorted(tops, tops[index] + tolerance[start], side='right'))
+    return order, np.cumsum(new_line) - 1
+
+
+def structure_columns(
+    text: np.ndarray,
+    page: np.ndarray,
+    left: np.ndarray,
+    top: np.ndarray,
+    width: np.ndarray,
+    height: np.ndarray
+) -> str:
+    """
+    Rebuild reading order from word box columns (text as an object array, geometry as numeric arrays).
+    Words are grouped by page, then by line band, sorted left to right, and joined with
+    separators by horizontal gap: '  |  ' for column gaps, two spaces for wide gaps, else one space.
+    """
+    if len(text) == 0:
+        return ""
+
+    order, line_ids = assign_lines(page, top, height)
+
+    # Within each line, order words left to right
+    line_order = np.lexsort((left[order], line_ids))
+    order = order[line_order]
+    line_ids = line_ids[line_order]
+
+    word_height = _median_height_per_word(page, height)[order]
+    sorted_left = left[order]
+    sorted_right = sorted_left + width[order]
+    gaps = np.zeros(len(order), dtype=np.float64)
+    gaps[1:] = sorted_left[1:] - sorted_right[:-1]
+
+    line_start = np.ones(len(order), dtype=bool)
+    line_start[1:] = line_ids[1:] != line_ids[:-1]
+
+    separator_index = np.where(
+        line_start, 0,
+        np.where(gaps > COLUMN_GAP_RATIO * word_height, 3, np.where(gaps > WIDE_GAP_RATIO * word_height, 2, 1))
+    )
+    separators = np.array(["\n", " ", "  ", "  |  "], dtype=object)[separator_index]
+    separators[0] = ""
+
+    # Interleave separators and words, then join once
+    pieces = np.empty(2 * len(order) + 1, dtype=object)
+    pieces[0:-1:2] = separators
+    pieces[1:-1:2] = text[order]
+    pieces[-1] = "\n"
+    return "".join(pieces.tolist())
+
+
+def structure_text_by_spatial_layout(boxes: WordBoxes) -> str:
+    """Rebuild reading order from OCR word boxes (see structure_columns)"""
+    if not len(boxes):
+        return ""
+
+    return structure_columns(
+        np.array(boxes.words(), dtype=object),
+        boxes.page,
+        boxes.left.astype(np.float64),
+        boxes.top.astype(np.float64),
+        boxes.width.astype(np.float64),
+        boxes.height.astype(np.float64)
+    )
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+
+class LLMResponseCache:
+    """
+    In-memory memoization of LLM refinement results.
+    Keys hash the model, prompt and generation config; entries expire after a TTL and the
+    least recently used entry is dropped once the cache is full. Failed prompts are kept in a
+    short-lived negative cache so they are not retried immediately.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        negative_ttl_seconds: Optional[float] = None
+    ):
+        """Initialize the cache from LLM_CACHE_* environment settings"""
+        self.enabled = os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+        self.ttl_seconds = ttl_seconds or float(os.getenv('LLM_CACHE_TTL_SECONDS', '86400'))
+        self.max_entries = max_entries or int(os.getenv('LLM_CACHE_MAX_ENTRIES', '512'))
+        self.negative_ttl_seconds = negative_ttl_seconds or float(os.getenv('LLM_CACHE_NEGATIVE_TTL_SECONDS', '60'))
+
+        # key -> (expires_at, JSON payload); stored as JSON so callers can't mutate cached results
+        self._entries: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+        # key -> (expires_at, error message)
+        self._failures: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._negative_hits = 0
+
+    @staticmethod
+    def make_key(model: str, prompt: str, generation_config: Dict[str, Any], endpoint: Optional[str] = None) -> str:
+        """Hash everything that determines the LLM response"""
+        material = json.dumps({
+            "model": model,
+            "endpoint": endpoint,
+            "prompt": prompt,
+            "generation_config": generation_config
+        }, sort_keys=True)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a cached refinement result, or None if missing or expired"""
+        if not self.enabled:
+            return None
+
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(key, None)
+            self._misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self._hits += 1
+        return json.loads(entry[1])
+
+    def put(self, key: str, value: Dict[str, Any]):
+        """Cache a successful refinement result"""
+        if not self.enabled:
+            return
+
+        self._failures.pop(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, json.dumps(value))
+        self._entries.move_to_end(key)
+        self._evict(self._entries)
+
+    def recent_failure(self, key: str) -> Optional[str]:
+        """Return the error of a recent failed call for this key, if any"""
+        if not self.enabled:
+            return None
+
+        failure = self._failures.get(key)
+        if failure is None:
+            return None
+        if failure[0] < time.monotonic():
+            del self._failures[key]
+            return None
+
+        self._negative_hits += 1
+        return failure[1]
+
+    def put_failure(self, key: str, error: str):
+        """Remember a failed call so identical prompts are not retried immediately"""
+        if not self.enabled:
+            return
+
+        self._failures[key] = (time.monotonic() + self.negative_ttl_seconds, error)
+        self._failures.move_to_end(key)
+        self._evict(self._failures)
+
+    def stats(self) -> Dict[str, Any]:
+        """Report hit rates and sizes"""
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "negative_entries": len(self._failures),
+            "hits": self._hits,
+            "misses": self._misses,
+            "negative_hits": self._negative_hits
+        }
+
+    def _evict(self, entries: OrderedDict):
+        """Drop expired entries, then the least recently used ones while over capacity"""
+        now = time.monotonic()
+        for key in [key for key, (expires_at, _) in entries.items() if expires_at < now]:
+            del entries[key]
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+
+_llm_response_cache: Optional[LLMResponseCache] = None
+
+
+def get_llm_response_cache() -> LLMResponseCache:
+    """Return the process-wide LLM response cache"""
+    global _llm_response_cache
+    if _llm_response_cache is None:
+        _llm_response_cache = LLMResponseCache()
+    return _llm_response_cache
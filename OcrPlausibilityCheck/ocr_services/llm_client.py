@@ -0,0 +1,152 @@
+import importlib.util
+import json
+import os
+import re
+from typing import Dict, Any, Optional
+
+import httpx
+
+from ocr_services.llm_cache import get_llm_response_cache
+
+
+class LLMClient:
+    """
+    Long-lived pooled HTTP client for LLM refinement calls.
+    Shared by all OCR services so keep-alive connections are reused across documents.
+    """
+
+    def __init__(self):
+        """Initialize pool settings from LLM_HTTP_* environment settings"""
+        self.timeout = float(os.getenv('LLM_HTTP_TIMEOUT', '30.0'))
+        self.max_connections = int(os.getenv('LLM_HTTP_MAX_CONNECTIONS', '20'))
+        self.max_keepalive_connections = int(os.getenv('LLM_HTTP_MAX_KEEPALIVE', '10'))
+        self.keepalive_expiry = float(os.getenv('LLM_HTTP_KEEPALIVE_EXPIRY', '60.0'))
+        self.http2 = os.getenv('LLM_HTTP2', 'true').lower() == 'true'
+
+        if self.http2 and importlib.util.find_spec('h2') is None:
+            print("LLM_HTTP2 is enabled but the 'h2' package is missing; falling back to HTTP/1.1")
+            self.http2 = False
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._requests = 0
+        self._errors = 0
+        self._in_flight = 0
+
+    async def start(self):
+        """Open the connection pool"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                    keepalive_expiry=self.keepalive_expiry
+                )
+            )
+
+    async def aclose(self):
+        """Close all pooled connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        """Send a POST request over the shared pool"""
+        # Services used outside the app lifespan (scripts, tests) open the pool on demand
+        if self._client is None:
+            await self.start()
+
+        self._requests += 1
+        self._in_flight += 1
+        try:
+            return await self._client.post(url, **kwargs)
+        except Exception:
+            self._errors += 1
+            raise
+        finally:
+            self._in_flight -= 1
+
+    async def generate_json(
+        self,
+        url: str,
+        api_key: str,
+        model: str,
+        prompt: str,
+        generation_config: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """
+        Send a prompt to the Gemini endpoint and parse the JSON answer.
+        Results are memoized by model, prompt and generation config; recent failures are not retried.
+        """
+        llm_cache = get_llm_response_cache()
+        cache_key = llm_cache.make_key(model, prompt, generation_config, endpoint=url)
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        recent_failure = llm_cache.recent_failure(cache_key)
+        if recent_failure:
+            raise RuntimeError(f"Identical LLM prompt failed recently: {recent_failure}")
+
+        try:
+            headers = {
+                "X-goog-api-key": api_key,
+                "Content-Type": "application/json"
+            }
+
+            payload = {
+                "contents": [{
+                    "parts": [{"text": prompt}]
+                }],
+                "generationConfig": generation_config
+            }
+
+            response = await self.post(url, headers=headers, json=payload)
+            response.raise_for_status()
+            result = response.json()
+
+            llm_text = result['candidates'][0]['content']['parts'][0]['text'].strip()
+            if llm_text.startswith('```'):
+                llm_text = re.sub(r'^```json\s*\n', '', llm_text)
+                llm_text = re.sub(r'^```\s*\n', '', llm_text)
+                llm_text = re.sub(r'\n```\s*$', '', llm_text)
+
+            parsed = json.loads(llm_text)
+            llm_cache.put(cache_key, parsed)
+            return parsed
+        except Exception as e:
+            llm_cache.put_failure(cache_key, str(e))
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        """Report pool limits, usage and open connections"""
+        stats = {
+            "started": self._client is not None,
+            "http2": self.http2,
+            "max_connections": self.max_connections,
+            "max_keepalive_connections": self.max_keepalive_connections,
+            "requests": self._requests,
+            "errors": self._errors,
+            "in_flight": self._in_flight,
+            "connections": None,
+            "idle_connections": None
+        }
+
+        # httpx doesn't expose the pool publicly; read the httpcore pool when it is available
+        pool = getattr(getattr(self._client, '_transport', None), '_pool', None)
+        connections = getattr(pool, 'connections', None)
+        if connections is not None:
+            stats["connections"] = len(connections)
+            stats["idle_connections"] = sum(1 for connection in connections if connection.is_idle())
+        return stats
+
+
+_llm_client: Optional[LLMClient] = None
+
+
+def get_llm_client() -> LLMClient:
+    """Return the process-wide LLM client"""
+    global _llm_client
+    if _llm_client is None:
+        _llm_client = LLMClient()
+    return _llm_client
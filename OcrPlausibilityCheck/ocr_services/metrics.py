@@ -0,0 +1,104 @@
+import functools
+import inspect
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Callable
+
+from prometheus_client import Histogram
+
+
+# Seconds; OCR of long scans and LLM calls can take well over ten seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+EXTRACTION_SECONDS = Histogram(
+    'ocr_extraction_duration_seconds',
+    'End-to-end extraction time per document',
+    ['doc_type', 'cache'],
+    buckets=DURATION_BUCKETS
+)
+
+STAGE_SECONDS = Histogram(
+    'ocr_stage_duration_seconds',
+    'Time spent per pipeline stage; OCR worker stages are summed over pages',
+    ['doc_type', 'stage', 'cache'],
+    buckets=DURATION_BUCKETS
+)
+
+# Stage name -> accumulated seconds for the current request or extraction
+_stage_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar('stage_timings', default=None)
+
+
+def record_stage(name: str, seconds: float):
+    """Add time to a stage of the current request; a no-op outside of one"""
+    timings = _stage_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+def record_stages(stage_seconds: Dict[str, float]):
+    """Add several stage timings at once, e.g. those reported by an OCR worker process"""
+    for name, seconds in stage_seconds.items():
+        record_stage(name, seconds)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as a pipeline stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def timed(name: str) -> Callable:
+    """Decorator that times a sync or async function as a pipeline stage"""
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def collect_timings(prefix: Optional[str] = None):
+    """
+    Collect stage timings for the enclosed block into a fresh dict.
+    The timings are also added to the enclosing collection (e.g. the HTTP request) when there is one,
+    as '<prefix>-<stage>' when a prefix is given. Blocks that run concurrently (the documents of a
+    bundle) need distinct prefixes, or their stages would be summed into one entry longer than the request.
+    """
+    parent = _stage_timings.get()
+    timings: Dict[str, float] = {}
+    token = _stage_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _stage_timings.reset(token)
+        if parent is not None:
+            for name, seconds in timings.items():
+                name = f"{prefix}-{name}" if prefix else name
+                parent[name] = parent.get(name, 0.0) + seconds
+
+
+def observe_extraction(doc_type: str, cached: bool, total_seconds: float, timings: Dict[str, float]):
+    """Record an extraction and its stages in the Prometheus histograms"""
+    cache = "hit" if cached else "miss"
+    EXTRACTION_SECONDS.labels(doc_type=doc_type, cache=cache).observe(total_seconds)
+    for name, seconds in timings.items():
+        STAGE_SECONDS.labels(doc_type=doc_type, stage=name, cache=cache).observe(seconds)
+
+
+def format_server_timing(timings: Dict[str, float]) -> str:
+    """Render stage timings as a Server-Timing header value (durations in milliseconds)"""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
@@ -0,0 +1,154 @@
+import importlib.util
+import os
+from typing import Dict, Any, Optional, List, Tuple
+
+import pytesseract
+
+
+class PytesseractBackend:
+    """
+    Runs the tesseract binary through pytesseract.
+    Every call starts a new tesseract process that reloads the language data.
+    """
+
+    name = "pytesseract"
+
+    def __init__(self, lang: str = "eng", oem: Optional[int] = None):
+        self.lang = lang
+        self.oem = oem
+
+    def image_to_data(
+        self,
+        image: Any,
+        psm: Optional[int] = None,
+        whitelist: Optional[str] = None
+    ) -> Dict[str, List[Any]]:
+        """
+        OCR a PIL image or image file path into word-level data (pytesseract DICT layout).
+        psm overrides the page segmentation mode; whitelist restricts the recognized characters.
+        """
+        config = []
+        if self.oem is not None:
+            config.append(f"--oem {self.oem}")
+        if psm is not None:
+            config.append(f"--psm {psm}")
+        if whitelist:
+            config.append(f"-c tessedit_char_whitelist={whitelist}")
+        return pytesseract.image_to_data(
+            image, lang=self.lang, config=" ".join(config), output_type=pytesseract.Output.DICT
+        )
+
+
+class TesserocrBackend:
+    """
+    Keeps a Tesseract engine loaded in-process through tesserocr.
+    The engine is initialized once per OCR worker process and reused for every page,
+    so no subprocess, temp files or language data reloads are needed per page.
+    """
+
+    name = "tesserocr"
+
+    def __init__(self, lang: str = "eng", tessdata_path: Optional[str] = None, oem: Optional[int] = None):
+        import tesserocr
+
+        self._tesserocr = tesserocr
+        kwargs = {"lang": lang}
+        if tessdata_path:
+            kwargs["path"] = tessdata_path
+        if oem is not None:
+            kwargs["oem"] = tesserocr.OEM(oem)
+        self._api = tesserocr.PyTessBaseAPI(**kwargs)
+
+    def image_to_data(
+        self,
+        image: Any,
+        psm: Optional[int] = None,
+        whitelist: Optional[str] = None
+    ) -> Dict[str, List[Any]]:
+        """
+        OCR a PIL image or image file path into word-level data (pytesseract DICT layout).
+        psm and whitelist apply to this call only; the engine is reset afterwards.
+        """
+        tesserocr = self._tesserocr
+        if psm is not None:
+            self._api.SetPageSegMode(psm)
+        if whitelist:
+            self._api.SetVariable("tessedit_char_whitelist", whitelist)
+        if isinstance(image, str):
+            self._api.SetImageFile(image)
+        else:
+            self._api.SetImage(image)
+
+        data = {"text": [], "left": [], "top": [], "width": [], "height": [], "conf": []}
+        try:
+            self._api.Recognize()
+            iterator = self._api.GetIterator()
+            level = tesserocr.RIL.WORD
+            for word in tesserocr.iterate_level(iterator, level):
+                text = word.GetUTF8Text(level)
+                box = word.BoundingBox(level)
+                if not text or box is None:
+                    continue
+                left, top, right, bottom = box
+                data["text"].append(text)
+                data["left"].append(left)
+                data["top"].append(top)
+                data["width"].append(right - left)
+                data["height"].append(bottom - top)
+                data["conf"].append(word.Confidence(level))
+        finally:
+            self._api.Clear()
+            if psm is not None:
+                self._api.SetPageSegMode(tesserocr.PSM.AUTO)
+            if whitelist:
+                self._api.SetVariable("tessedit_char_whitelist", "")
+        return data
+
+
+# One backend per process and language/engine mode; in OCR pool workers this keeps the engines warm across requests
+_ocr_backends: Dict[Tuple[str, str, Optional[int]], Any] = {}
+
+
+def ocr_backend_identity(name: Optional[str] = None, lang: Optional[str] = None) -> Dict[str, Any]:
+    """
+    The engine get_ocr_backend would run for these settings, for keying cached results:
+    engines differ in their output, so results of one must not be served for the other.
+    """
+    name = (name or os.getenv('OCR_BACKEND', 'auto')).lower()
+    tesserocr = name in ('auto', 'tesserocr') and importlib.util.find_spec('tesserocr') is not None
+    return {
+        "engine": "tesserocr" if tesserocr else "pytesseract",
+        "lang": lang or os.getenv('OCR_TESSERACT_LANG', 'eng'),
+        "tessdata": (os.getenv('OCR_TESSDATA_PATH') or None) if tesserocr else None
+    }
+
+
+def get_ocr_backend(name: Optional[str] = None, lang: Optional[str] = None, oem: Optional[int] = None) -> Any:
+    """
+    Return the process-wide OCR backend for the language(s) and OCR engine mode.
+    'auto' uses tesserocr when it is installed and pytesseract otherwise. An installed tesserocr
+    that fails to start raises RuntimeError instead of falling back: results are cached under the
+    engine ocr_backend_identity reports, so a worker must not silently run another one.
+    """
+    name = (name or os.getenv('OCR_BACKEND', 'auto')).lower()
+    lang = lang or os.getenv('OCR_TESSERACT_LANG', 'eng')
+    key = (name, lang, oem)
+    backend = _ocr_backends.get(key)
+    if backend is not None:
+        return backend
+
+    if name in ('auto', 'tesserocr') and importlib.util.find_spec('tesserocr') is not None:
+        try:
+            backend = TesserocrBackend(lang, os.getenv('OCR_TESSDATA_PATH') or None, oem)
+        except Exception as e:
+            raise RuntimeError(
+                f"Error starting the tesserocr engine (lang={lang}, OCR_TESSDATA_PATH="
+                f"{os.getenv('OCR_TESSDATA_PATH') or 'default'}): {e}; fix the setup or set OCR_BACKEND=pytesseract"
+            ) from e
+    elif name == 'tesserocr':
+        print("OCR_BACKEND is tesserocr but the 'tesserocr' package is missing; falling back to pytesseract")
+
+    if backend is None:
+        backend = PytesseractBackend(lang, oem)
+    _ocr_backends[key] = backend
+    return backend
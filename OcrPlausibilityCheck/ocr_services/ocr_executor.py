@@ -0,0 +1,390 @@
+import asyncio
+import io
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, Optional, List, Callable
+
+import PyPDF2
+from PyPDF2.generic import RectangleObject
+from pdf2image import convert_from_bytes, pdfinfo_from_bytes
+from PIL import Image
+from ocr_services.metrics import stage, record_stages
+from ocr_services.ocr_backends import get_ocr_backend, ocr_backend_identity
+from ocr_services.ocr_profiles import OCRProfile
+from ocr_services.preprocessing import PreprocessSettings, preprocess_image
+from ocr_services.word_boxes import WordBoxes
+
+
+def count_pdf_pages(content: bytes) -> int:
+    """Return the number of pages in the PDF"""
+    return pdfinfo_from_bytes(content)["Pages"]
+
+
+def _recognize(image: Any, page_num: int, ocr_backend: Optional[str], profile: Optional[OCRProfile]) -> WordBoxes:
+    """OCR one image with the profile's Tesseract settings (engine defaults without a profile)"""
+    if profile is None:
+        return WordBoxes.from_tesseract(get_ocr_backend(ocr_backend).image_to_data(image), page_num)
+    backend = get_ocr_backend(ocr_backend, profile.lang, profile.oem)
+    return WordBoxes.from_tesseract(backend.image_to_data(image, profile.psm, profile.whitelist), page_num)
+
+
+def _recognize_preprocessed(
+    image: Any,
+    page_num: int,
+    timings: Dict[str, float],
+    ocr_backend: Optional[str],
+    profile: Optional[OCRProfile],
+    preprocess: Optional[PreprocessSettings]
+) -> WordBoxes:
+    """
+    Run the preprocessing stages on an image (PIL image or file path), OCR it and map the boxes back
+    to the coordinates of the image as rendered. Stage timings are added to timings.
+    """
+    if preprocess is None or not preprocess.edits_pixels:
+        started = time.perf_counter()
+        boxes = _recognize(image, page_num, ocr_backend, profile)
+        timings["tesseract"] = timings.get("tesseract", 0.0) + time.perf_counter() - started
+        return boxes
+
+    if isinstance(image, str):
+        with Image.open(image) as opened:
+            image = opened.copy()
+    image, transform, stage_timings = preprocess_image(image, preprocess)
+    for name, seconds in stage_timings.items():
+        timings[name] = timings.get(name, 0.0) + seconds
+    started = time.perf_counter()
+    boxes = _recognize(image, page_num, ocr_backend, profile)
+    timings["tesseract"] = timings.get("tesseract", 0.0) + time.perf_counter() - started
+    return transform.restore(boxes)
+
+
+def ocr_pdf_page(
+    content: bytes,
+    page_num: int,
+    raster_to_disk: bool = True,
+    raster_dir: Optional[str] = None,
+    ocr_backend: Optional[str] = None,
+    dpi: int = 200,
+    profile: Optional[OCRProfile] = None,
+    preprocess: Optional[PreprocessSettings] = None
+) -> tuple[str, WordBoxes, Dict[str, float]]:
+    """
+    Rasterize and OCR a single PDF page (0-based) at the given DPI with bounding box data,
+    using the Tesseract settings of the OCR profile after the preprocessing stages.
+    Runs inside an OCR pool worker process, so it must stay a module-level function.
+    Also returns the worker's stage timings, since the parent can't time work done in another process.
+
+    With raster_to_disk the page is rendered to a file in raster_dir (e.g. a tmpfs) and Tesseract
+    reads it from there, so the bitmap is never held in worker memory.
+    The OCR engine comes from get_ocr_backend, so it stays loaded in the worker between pages.
+    """
+    # Poppler renders gray pages directly, which is cheaper than converting the RGB bitmap
+    grayscale = preprocess is not None and preprocess.grayscale
+    if not raster_to_disk:
+        timings = {}
+        started = time.perf_counter()
+        images = convert_from_bytes(
+            content, dpi=dpi, first_page=page_num + 1, last_page=page_num + 1, grayscale=grayscale
+        )
+        timings["rasterize"] = time.perf_counter() - started
+        return _ocr_page_images(images, page_num, timings, ocr_backend, profile, preprocess)
+
+    with tempfile.TemporaryDirectory(prefix="ocr-page-", dir=raster_dir) as tmp_dir:
+        timings = {}
+        started = time.perf_counter()
+        image_paths = convert_from_bytes(
+            content,
+            dpi=dpi,
+            first_page=page_num + 1,
+            last_page=page_num + 1,
+            output_folder=tmp_dir,
+            paths_only=True,
+            grayscale=grayscale
+        )
+        timings["rasterize"] = time.perf_counter() - started
+        return _ocr_page_images(image_paths, page_num, timings, ocr_backend, profile, preprocess)
+
+
+def _ocr_page_images(
+    images: List[Any],
+    page_num: int,
+    timings: Dict[str, float],
+    ocr_backend: Optional[str] = None,
+    profile: Optional[OCRProfile] = None,
+    preprocess: Optional[PreprocessSettings] = None
+) -> tuple[str, WordBoxes, Dict[str, float]]:
+    """Run Tesseract on rendered page images (PIL images or file paths) and collect the word boxes"""
+    page_boxes = WordBoxes.concat([
+        _recognize_preprocessed(image, page_num, timings, ocr_backend, profile, preprocess) for image in images
+    ])
+    return page_boxes.page_text(), page_boxes, timings
+
+
+def _region_pdf(content: bytes, page_num: int, regions: Dict[str, List[float]]) -> tuple[bytes, float, float]:
+    """
+    One copy of the page per region, each cropped to its region (fractions of the page as rendered).
+    Returns the PDF and the rendered page size in points.
+    """
+    page = PyPDF2.PdfReader(io.BytesIO(content)).pages[page_num]
+    left, bottom = float(page.mediabox.left), float(page.mediabox.bottom)
+    right, top = float(page.mediabox.right), float(page.mediabox.top)
+    width, height = right - left, top - bottom
+    rotation = int(page.get('/Rotate', 0) or 0) % 360
+
+    def user_space(fx: float, fy: float) -> tuple[float, float]:
+        """PDF user space point of a point given as fractions of the rotated page"""
+        if rotation == 90:
+            return left + fy * width, bottom + fx * height
+        if rotation == 180:
+            return right - fx * width, bottom + fy * height
+        if rotation == 270:
+            return right - fy * width, top - fx * height
+        return left + fx * width, top - fy * height
+
+    writer = PyPDF2.PdfWriter()
+    for x0, y0, x1, y1 in regions.values():
+        (ax, ay), (bx, by) = user_space(x0, y0), user_space(x1, y1)
+        writer.add_page(page)
+        # At least a point wide and high, so degenerate regions still render
+        writer.pages[-1].cropbox = RectangleObject([
+            min(ax, bx), min(ay, by), max(max(ax, bx), min(ax, bx) + 1), max(max(ay, by), min(ay, by) + 1)
+        ])
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    if rotation % 180 == 90:
+        width, height = height, width
+    return buffer.getvalue(), width, height
+
+
+def ocr_pdf_regions(
+    content: bytes,
+    page_num: int,
+    regions: Dict[str, List[float]],
+    dpi: int = 300,
+    ocr_backend: Optional[str] = None,
+    profiles: Optional[Dict[str, OCRProfile]] = None,
+    preprocess: Optional[PreprocessSettings] = None
+) -> tuple[Dict[str, WordBoxes], Dict[str, float]]:
+    """
+    OCR only the given regions of one PDF page (name -> [x0, y0, x1, y1] as fractions of the page).
+    Runs inside an OCR pool worker process. Only the regions are rasterized, not the whole page;
+    region boxes are returned in page pixel coordinates.
+    profiles maps region names to the OCR profile they are read with (engine defaults otherwise).
+    Regions are never downscaled or deskewed, since they are rendered at a chosen DPI and hold a single line.
+    """
+    if preprocess is not None:
+        preprocess = preprocess.for_regions()
+    timings = {}
+    started = time.perf_counter()
+    region_pdf, width, height = _region_pdf(content, page_num, regions)
+    crops = convert_from_bytes(
+        region_pdf, dpi=dpi, use_cropbox=True, grayscale=preprocess is not None and preprocess.grayscale
+    )
+    timings["rasterize"] = time.perf_counter() - started
+
+    width, height = width * dpi / 72, height * dpi / 72
+    results = {}
+    for (name, (x0, y0, _, _)), crop in zip(regions.items(), crops):
+        boxes = _recognize_preprocessed(
+            crop, page_num, timings, ocr_backend, profiles.get(name) if profiles else None, preprocess
+        )
+        boxes.left += round(x0 * width)
+        boxes.top += round(y0 * height)
+        results[name] = boxes
+    return results, timings
+
+
+class OCRExecutor:
+    """
+    Process pool that runs rasterization and Tesseract OCR off the event loop.
+    One instance is shared by all OCR services so the pool caps total OCR CPU usage.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, max_concurrency: Optional[int] = None):
+        """Initialize the executor from OCR_POOL_* environment settings"""
+        self.max_workers = max_workers or int(os.getenv('OCR_POOL_WORKERS', str(os.cpu_count() or 1)))
+        # Jobs beyond this limit wait on the event loop instead of piling up in the pool queue
+        self.max_concurrency = max_concurrency or int(os.getenv('OCR_POOL_MAX_CONCURRENCY', str(self.max_workers)))
+        self.start_method = os.getenv('OCR_POOL_START_METHOD', 'spawn')
+        # Render pages to files instead of keeping bitmaps in memory; point OCR_RASTER_DIR at a tmpfs to avoid disk I/O
+        self.raster_to_disk = os.getenv('OCR_RASTER_TO_DISK', 'true').lower() == 'true'
+        self.raster_dir = os.getenv('OCR_RASTER_DIR') or None
+        # Pages of one document in flight at once; lower it so long PDFs share the pool with other requests
+        self.page_window = int(os.getenv('OCR_PAGE_WINDOW', str(self.max_concurrency)))
+        # 'auto' keeps a tesserocr engine warm in each worker when installed, else runs pytesseract
+        self.ocr_backend = os.getenv('OCR_BACKEND', 'auto').lower()
+        # Rendering resolution of the regular OCR pass
+        self.dpi = int(os.getenv('OCR_DPI', '200'))
+        # Image cleanup (grayscale, downscale, deskew, binarize) before Tesseract, from the OCR_PRE_* flags
+        self.preprocess = PreprocessSettings()
+
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._in_flight = 0
+        self._waiting = 0
+        self._completed = 0
+        self._failed = 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """Create the process pool on first use"""
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context(self.start_method)
+                )
+            return self._pool
+
+    def _discard_pool(self, pool: ProcessPoolExecutor):
+        """
+        Shut down a broken pool so its management thread and surviving workers exit.
+        Only the current pool is replaced; callers that saw the same breakage later find a fresh one.
+        """
+        with self._pool_lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, func: Callable, *args) -> Any:
+        """Run a picklable function in the pool, waiting for a free slot if saturated"""
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+        self._in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            pool = self._get_pool()
+            result = await loop.run_in_executor(pool, func, *args)
+            self._completed += 1
+            return result
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM on a huge scan); start a fresh pool for the next job
+            self._failed += 1
+            self._discard_pool(pool)
+            raise
+        except Exception:
+            self._failed += 1
+            raise
+        finally:
+            self._in_flight -= 1
+            self._semaphore.release()
+
+    async def ocr_pdf_pages(
+        self,
+        content: bytes,
+        page_nums: Optional[List[int]] = None,
+        dpi: Optional[int] = None,
+        profile: Optional[OCRProfile] = None
+    ) -> Dict[int, tuple[str, WordBoxes]]:
+        """
+        OCR the given pages (0-based; all pages when None) at the given DPI (OCR_DPI when None) with
+        the OCR profile, each as an independent pool task.
+        Returns page number -> (page text, page boxes) in page order.
+        """
+        dpi = dpi or self.dpi
+        window = asyncio.Semaphore(max(1, self.page_window))
+
+        async def ocr_page(page_num: int):
+            async with window:
+                return await self.run(
+                    ocr_pdf_page, content, page_num, self.raster_to_disk, self.raster_dir, self.ocr_backend, dpi, profile,
+                    self.preprocess
+                )
+
+        with stage("ocr"):
+            if page_nums is None:
+                page_nums = list(range(await self.run(count_pdf_pages, content)))
+            pages = await asyncio.gather(*[ocr_page(page_num) for page_num in page_nums])
+
+        results = {}
+        for page_num, (page_text, page_boxes, page_timings) in sorted(zip(page_nums, pages), key=lambda page: page[0]):
+            results[page_num] = (page_text, page_boxes)
+            record_stages(page_timings)
+        return results
+
+    async def ocr_pdf_regions(
+        self,
+        content: bytes,
+        page_regions: Dict[int, Dict[str, List[float]]],
+        dpi: int = 300,
+        profiles: Optional[Dict[str, OCRProfile]] = None
+    ) -> Dict[str, WordBoxes]:
+        """OCR only the given regions, one pool task per page; returns region name -> word boxes"""
+        with stage("ocr"):
+            pages = await asyncio.gather(*[
+                self.run(ocr_pdf_regions, content, page_num, regions, dpi, self.ocr_backend, profiles, self.preprocess)
+                for page_num, regions in page_regions.items()
+            ])
+
+        results = {}
+        for regions, timings in pages:
+            results.update(regions)
+            record_stages(timings)
+        return results
+
+    async def ocr_pdf(self, content: bytes) -> tuple[str, WordBoxes]:
+        """
+        OCR every page of the PDF as an independent pool task.
+        Pages are merged back in page order, so box 'page' indices match the PDF.
+        """
+        pages = await self.ocr_pdf_pages(content)
+
+        all_text = "\n".join(page_text for page_text, _ in pages.values())
+        all_boxes = WordBoxes.concat([page_boxes for _, page_boxes in pages.values()])
+        return all_text.strip(), all_boxes
+
+    def settings(self, profile: Optional[OCRProfile] = None) -> Dict[str, Any]:
+        """The settings that shape OCR output (engine, resolution, preprocessing and profile), for keying cached results"""
+        return {
+            "backend": ocr_backend_identity(self.ocr_backend, profile.lang if profile is not None else None),
+            "dpi": self.dpi,
+            "preprocess": self.preprocess.to_dict(),
+            "profile": profile.to_dict() if profile is not None else None
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """Report pool size and saturation"""
+        return {
+            "workers": self.max_workers,
+            "max_concurrency": self.max_concurrency,
+            "page_window": self.page_window,
+            "raster_to_disk": self.raster_to_disk,
+            "ocr_backend": self.ocr_backend,
+            "preprocess": [
+                name for name in ("grayscale", "downscale", "deskew", "binarize") if getattr(self.preprocess, name)
+            ],
+            "started": self._pool is not None,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "completed": self._completed,
+            "failed": self._failed,
+            "saturation": round(self._in_flight / self.max_concurrency, 3)
+        }
+
+    def shutdown(self, wait: bool = True):
+        """Stop the worker processes"""
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=True)
+
+
+_ocr_executor: Optional[OCRExecutor] = None
+
+
+def get_ocr_executor() -> OCRExecutor:
+    """Return the process-wide OCR executor"""
+    global _ocr_executor
+    if _ocr_executor is None:
+        _ocr_executor = OCRExecutor()
+    return _ocr_executor
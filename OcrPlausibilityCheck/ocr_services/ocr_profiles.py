@@ -0,0 +1,135 @@
+import json
+import os
+import threading
+from typing import Dict, Any, List, Optional
+
+
+# Digits, signs, separators, currency symbols and the letters of the units the extractors read
+# (t, tonnes, MT, kg, MWh, kWh, GJ, MJ, gCO2e/MJ); spaces are never whitelisted characters
+NUMERIC_WHITELIST = "0123456789.,-−+%/€$£<=≤tonesMTkgWhGJCO"
+
+DOC_TYPES = ("pos", "invoice", "ppa", "termsheet")
+
+
+class OCRProfile:
+    """
+    Tesseract settings for one kind of document or field region.
+    None leaves a setting at the engine default (lang falls back to OCR_TESSERACT_LANG).
+    `regions` maps field labels to the profile their regions are OCR'd with.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        psm: Optional[int] = None,
+        oem: Optional[int] = None,
+        lang: Optional[str] = None,
+        whitelist: Optional[str] = None,
+        regions: Optional[Dict[str, str]] = None
+    ):
+        self.name = name
+        self.psm = psm
+        self.oem = oem
+        self.lang = lang
+        self.whitelist = whitelist
+        self.regions = regions or {}
+
+    @classmethod
+    def from_dict(cls, name: str, spec: Dict[str, Any]) -> "OCRProfile":
+        unknown = set(spec) - {"psm", "oem", "lang", "whitelist", "regions"}
+        if unknown:
+            raise ValueError(f"Unknown OCR profile setting(s) in {name}: {', '.join(sorted(unknown))}")
+        return cls(name, **spec)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "psm": self.psm,
+            "oem": self.oem,
+            "lang": self.lang,
+            "whitelist": self.whitelist,
+            "regions": dict(self.regions)
+        }
+
+
+BUILTIN_PROFILES = {
+    # Tesseract defaults (automatic page segmentation)
+    "default": OCRProfile("default"),
+    # Key/value forms such as PoS certificates: sparse text finds isolated labels and values anywhere
+    "form": OCRProfile("form", psm=11),
+    # Dense tables such as invoices: one uniform block of text
+    "table": OCRProfile("table", psm=6),
+    # Running text such as PPAs and term sheets: automatic segmentation, LSTM engine only
+    "prose": OCRProfile("prose", psm=3, oem=1),
+    # Field regions: a single text line, optionally restricted to numbers and units
+    "line": OCRProfile("line", psm=7),
+    "numeric_line": OCRProfile("numeric_line", psm=7, whitelist=NUMERIC_WHITELIST),
+}
+
+
+class OCRProfileRegistry:
+    """
+    Available OCR profiles and the one selected per document type.
+    Selections start from OCR_PROFILE_<DOC_TYPE> and can be changed at runtime with select().
+    Extra profiles are loaded from the JSON file in OCR_PROFILES_FILE ({"name": {"psm": 6, ...}}).
+    """
+
+    def __init__(self, profiles_file: Optional[str] = None):
+        self.profiles: Dict[str, OCRProfile] = dict(BUILTIN_PROFILES)
+        self._lock = threading.Lock()
+
+        profiles_file = profiles_file or os.getenv('OCR_PROFILES_FILE')
+        if profiles_file:
+            with open(profiles_file, 'r', encoding='utf-8') as f:
+                for name, spec in json.load(f).items():
+                    self.profiles[name] = OCRProfile.from_dict(name, spec)
+
+        self.selected: Dict[str, str] = {}
+        for doc_type in DOC_TYPES:
+            name = os.getenv(f'OCR_PROFILE_{doc_type.upper()}', 'default')
+            if name not in self.profiles:
+                print(f"Unknown OCR profile '{name}' for {doc_type}; using 'default'")
+                name = 'default'
+            self.selected[doc_type] = name
+
+    def get(self, name: str) -> OCRProfile:
+        """Return a profile by name; raises KeyError for unknown names"""
+        return self.profiles[name]
+
+    def for_doc_type(self, doc_type: str) -> OCRProfile:
+        """Return the profile selected for a document type"""
+        with self._lock:
+            return self.profiles[self.selected.get(doc_type, 'default')]
+
+    def region_profile(self, doc_type: str, label: str, numeric: bool = False) -> OCRProfile:
+        """Profile for one field region: the document profile's choice for the label, else a single-line profile"""
+        name = self.for_doc_type(doc_type).regions.get(label) or ("numeric_line" if numeric else "line")
+        return self.profiles[name]
+
+    def select(self, doc_type: str, name: str):
+        """Select the profile of a document type; raises KeyError for unknown profiles"""
+        if name not in self.profiles:
+            raise KeyError(name)
+        with self._lock:
+            self.selected[doc_type] = name
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            selected = dict(self.selected)
+        return {
+            "profiles": {name: profile.to_dict() for name, profile in self.profiles.items()},
+            "selected": selected
+        }
+
+    def names(self) -> List[str]:
+        return list(self.profiles)
+
+
+_ocr_profiles: Optional[OCRProfileRegistry] = None
+
+
+def get_ocr_profiles() -> OCRProfileRegistry:
+    """Return the process-wide OCR profile registry"""
+    global _ocr_profiles
+    if _ocr_profiles is None:
+        _ocr_profiles = OCRProfileRegistry()
+    return _ocr_profiles
@@ -0,0 +1,220 @@
+import asyncio
+import io
+import os
+from typing import Dict, Any, List, Callable, Optional, Tuple
+
+import PyPDF2
+
+from ocr_services.ocr_executor import get_ocr_executor
+from ocr_services.ocr_profiles import OCRProfile
+from ocr_services.metrics import stage, timed
+from ocr_services.word_boxes import WordBoxes
+
+
+# Nesting depth of Form XObjects searched for fonts
+MAX_XOBJECT_DEPTH = 8
+
+
+def _resources_have_fonts(resources, depth: int = 0, seen: Optional[set] = None) -> bool:
+    """Whether resources, or the Form XObjects they draw, declare fonts"""
+    resources = resources.get_object() if resources is not None else None
+    if resources is None:
+        return False
+    if '/Font' in resources:
+        return True
+    xobjects = resources.get('/XObject')
+    xobjects = xobjects.get_object() if xobjects is not None else None
+    if not xobjects or depth >= MAX_XOBJECT_DEPTH:
+        return False
+
+    seen = seen if seen is not None else set()
+    for reference in xobjects.values():
+        # Shared XObjects (and reference cycles) are only searched once
+        key = (reference.idnum, reference.generation) if hasattr(reference, 'idnum') else id(reference)
+        if key in seen:
+            continue
+        seen.add(key)
+        xobject = reference.get_object()
+        if xobject.get('/Subtype') == '/Form' and _resources_have_fonts(xobject.get('/Resources'), depth + 1, seen):
+            return True
+    return False
+
+
+def _page_has_fonts(page) -> bool:
+    """
+    A page without font resources has no text layer to extract.
+    Text drawn through Form XObjects has its fonts in the XObject's own resources, so those are searched too.
+    """
+    try:
+        return _resources_have_fonts(page.get('/Resources'))
+    except Exception:
+        return True
+
+
+def _text_layer_is_usable(text: str, min_chars: int) -> bool:
+    """
+    Decide whether extracted page text is good enough to skip OCR.
+    Pages with too little text or mostly undecodable glyphs are OCR'd instead.
+    """
+    stripped = text.strip()
+    alnum_chars = sum(1 for char in stripped if char.isalnum())
+    if alnum_chars < min_chars:
+        return False
+    garbled_chars = stripped.count('�') + stripped.count('(cid:')
+    return garbled_chars / len(stripped) < 0.1
+
+
+def pdf_page_sizes(reader: PyPDF2.PdfReader) -> List[Tuple[float, float]]:
+    """Page sizes in PDF points, as rendered (rotation applied)"""
+    sizes = []
+    for page in reader.pages:
+        width, height = float(page.mediabox.width), float(page.mediabox.height)
+        if int(page.get('/Rotate', 0) or 0) % 180 == 90:
+            width, height = height, width
+        sizes.append((width, height))
+    return sizes
+
+
+@timed("pdf_text")
+def classify_pdf_pages(content: bytes, min_chars: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Read the text layer of every page and flag the pages that need OCR.
+    Pages without fonts are flagged without running PyPDF2 text extraction on them.
+    Parses the whole PDF synchronously; call it from async code through asyncio.to_thread.
+    """
+    if min_chars is None:
+        min_chars = int(os.getenv('OCR_PAGE_MIN_CHARS', '50'))
+
+    try:
+        pdf_reader = PyPDF2.PdfReader(io.BytesIO(content))
+        pdf_pages = list(pdf_reader.pages)
+    except Exception as e:
+        print(f"Error reading PDF pages: {e}")
+        return []
+
+    pages = []
+    for page_num, page in enumerate(pdf_pages):
+        text = ""
+        if _page_has_fonts(page):
+            try:
+                text = page.extract_text() or ""
+            except Exception as e:
+                print(f"Error extracting text from page {page_num}: {e}")
+        pages.append({
+            "page": page_num,
+            "text": text,
+            "needs_ocr": not _text_layer_is_usable(text, min_chars)
+        })
+    return pages
+
+
+async def extract_document_text(
+    content: bytes,
+    structure_layout: Callable[[WordBoxes], str],
+    profile: Optional[OCRProfile] = None
+) -> tuple[str, Optional[str], Optional[WordBoxes]]:
+    """
+    Extract the document text, OCR'ing only the pages without a usable text layer (with the OCR profile).
+
+    Returns (text, structured_text, bounding_boxes). For a fully digital PDF the text is the
+    PyPDF2 text and structured_text/bounding_boxes are None. Otherwise OCR'd pages are laid out
+    with structure_layout and merged with the text-layer pages in page order.
+    """
+    pages = await asyncio.to_thread(classify_pdf_pages, content)
+    ocr_page_nums = [page["page"] for page in pages if page["needs_ocr"]]
+    if not pages:
+        # PyPDF2 couldn't parse the file; let the rasterizer try every page
+        ocr_page_nums = None
+
+    if ocr_page_nums == []:
+        return "".join(page["text"] + "\n" for page in pages), None, None
+
+    try:
+        ocr_pages = await get_ocr_executor().ocr_pdf_pages(content, ocr_page_nums, profile=profile)
+    except Exception as e:
+        print(f"Error performing bounding box OCR: {e}")
+        return "".join(page["text"] + "\n" for page in pages), None, None
+
+    if ocr_page_nums is None:
+        pages = [{"page": page_num, "text": "", "needs_ocr": True} for page_num in ocr_pages]
+
+    return _merge_pages(pages, _lay_out_pages(ocr_pages, structure_layout))
+
+
+def _lay_out_pages(
+    ocr_pages: Dict[int, tuple[str, WordBoxes]],
+    structure_layout: Callable[[WordBoxes], str]
+) -> Dict[int, tuple[str, str, WordBoxes]]:
+    """Page number -> (page text, structured page text, page boxes) of OCR'd pages"""
+    return {
+        page_num: (page_text, structure_layout(page_boxes) if len(page_boxes) else page_text + "\n", page_boxes)
+        for page_num, (page_text, page_boxes) in ocr_pages.items()
+    }
+
+
+def _merge_pages(
+    pages: List[Dict[str, Any]],
+    ocr_pages: Dict[int, tuple[str, str, WordBoxes]]
+) -> tuple[str, Optional[str], Optional[WordBoxes]]:
+    """Merge OCR'd pages with the text layer of the other pages in page order"""
+    text_parts = []
+    structured_parts = []
+    page_boxes_parts = []
+    for page in pages:
+        if page["page"] in ocr_pages:
+            page_text, structured_text, page_boxes = ocr_pages[page["page"]]
+            text_parts.append(page_text + "\n")
+            structured_parts.append(structured_text)
+            page_boxes_parts.append(page_boxes)
+        else:
+            text_parts.append(page["text"] + "\n")
+            structured_parts.append(page["text"] + "\n")
+
+    bounding_boxes = WordBoxes.concat(page_boxes_parts)
+    if not len(bounding_boxes):
+        return "".join(text_parts), None, None
+    return "".join(text_parts), "".join(structured_parts), bounding_boxes
+
+
+async def extract_document_text_until(
+    content: bytes,
+    structure_layout: Callable[[WordBoxes], str],
+    is_complete: Callable[[str, Optional[WordBoxes]], bool],
+    profile: Optional[OCRProfile] = None,
+    batch_pages: int = 1
+) -> tuple[str, Optional[str], Optional[WordBoxes], int]:
+    """
+    Like extract_document_text, but OCR the pages without a usable text layer in page order,
+    batch_pages at a time, and stop once is_complete(text, bounding_boxes) holds for the text read so far.
+    is_complete runs in a worker thread, so it must not touch event-loop state.
+    Text-layer pages are always read, since that costs no OCR.
+
+    Returns (text, structured_text, bounding_boxes, pages_skipped), where pages_skipped counts the
+    pages that were never rasterized.
+    """
+    pages = await asyncio.to_thread(classify_pdf_pages, content)
+    if not pages:
+        # Without a page list there is no page order to stop in
+        return (*await extract_document_text(content, structure_layout, profile), 0)
+
+    remaining = [page["page"] for page in pages if page["needs_ocr"]]
+    executor = get_ocr_executor()
+    ocr_pages: Dict[int, tuple[str, str, WordBoxes]] = {}
+    merged = _merge_pages(pages, ocr_pages)
+    while remaining:
+        # The regex and key/value pass over the growing text would block the event loop on long scans
+        with stage("early_stop"):
+            complete = await asyncio.to_thread(is_complete, merged[1] or merged[0], merged[2])
+        if complete:
+            break
+        batch, remaining = remaining[:max(1, batch_pages)], remaining[max(1, batch_pages):]
+        try:
+            ocr_pages.update(_lay_out_pages(await executor.ocr_pdf_pages(content, batch, profile=profile), structure_layout))
+        except Exception as e:
+            print(f"Error performing bounding box OCR: {e}")
+            return (*merged, len(remaining) + len(batch))
+        merged = _merge_pages(pages, ocr_pages)
+
+    if remaining:
+        print(f"Required fields found; skipped OCR of {len(remaining)} of {len(remaining) + len(ocr_pages)} scanned page(s)")
+    return (*merged, len(remaining))
@@ -0,0 +1,82 @@
+import importlib.util
+import os
+from typing import Dict, Any, Optional
+
+from ocr_services.llm_client import get_llm_client
+
+
+# Extraction metadata that is not part of PlausibilityCheckRequest
+EXTRACTION_METADATA_KEYS = (
+    "raw_text",
+    "structured_text",
+    "llm_refined",
+    "llm_refined_fields",
+    "llm_error",
+    "extraction_quality",
+    "extraction_path",
+    "layout_fields",
+    "roi_fields",
+    "pages_skipped",
+    "extraction_skipped",
+    "template",
+    "ocr_memory_bytes"
+)
+
+_plausibility_module = None
+_plausibility_module_loaded = False
+
+
+def build_plausibility_request(extractions: Dict[str, Dict[str, Any]], plant_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Map the four extraction results onto a PlausibilityCheckRequest payload.
+    Mirrors the reshaping the certification webapp does before calling the plausibility service.
+    """
+    payload = {
+        doc_type: {key: value for key, value in extraction.items() if key not in EXTRACTION_METADATA_KEYS}
+        for doc_type, extraction in extractions.items()
+    }
+    if plant_id:
+        payload["plant_id"] = plant_id
+    return payload
+
+
+def _load_plausibility_module():
+    """
+    Import PlausibilityCheck/main.py from PLAUSIBILITY_CHECK_PATH.
+    Returns None when the module is not available (e.g. in the standalone OCR image).
+    """
+    global _plausibility_module, _plausibility_module_loaded
+    if _plausibility_module_loaded:
+        return _plausibility_module
+
+    default_path = os.path.join(os.path.dirname(__file__), '..', '..', 'PlausibilityCheck', 'main.py')
+    path = os.path.abspath(os.getenv('PLAUSIBILITY_CHECK_PATH', default_path))
+    try:
+        spec = importlib.util.spec_from_file_location("plausibility_check_main", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _plausibility_module = module
+    except (FileNotFoundError, ImportError) as e:
+        print(f"PlausibilityChecker not importable from {path}, using the plausibility service instead: {e}")
+        _plausibility_module = None
+
+    _plausibility_module_loaded = True
+    return _plausibility_module
+
+
+async def run_plausibility_check(payload: Dict[str, Any]) -> tuple[Dict[str, Any], str]:
+    """
+    Evaluate the plausibility checks for a bundle.
+    Runs PlausibilityChecker in-process when it can be imported, otherwise calls the
+    plausibility service at PLAUSIBILITY_SERVICE_URL. Returns the response and the mode used.
+    """
+    module = _load_plausibility_module()
+    if module is not None:
+        request = module.PlausibilityCheckRequest(**payload)
+        response = module.PlausibilityChecker(request).perform_checks()
+        return response.model_dump(), "in_process"
+
+    service_url = os.getenv('PLAUSIBILITY_SERVICE_URL', 'http://localhost:8001').rstrip('/')
+    response = await get_llm_client().post(f"{service_url}/api/v1/plausibility/check", json=payload)
+    response.raise_for_status()
+    return response.json(), "http"
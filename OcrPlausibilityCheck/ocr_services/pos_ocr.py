@@ -1,13 +1,19 @@
-import re
 from typing import Dict, Any, Optional, List
-import io
-import PyPDF2
-from pdf2image import convert_from_bytes
-import pytesseract
-from PIL import Image
 import os
 import json
-import httpx
+
+from ocr_services.page_router import extract_document_text, extract_document_text_until
+from ocr_services.ocr_profiles import get_ocr_profiles
+from ocr_services.layout import structure_text_by_spatial_layout
+from ocr_services.word_boxes import WordBoxes
+from ocr_services.llm_client import get_llm_client
+from ocr_services.refinement import refine_extraction
+from ocr_services.metrics import stage, timed
+from ocr_services.field_specs import FieldSpec, FieldSpecRegistry, FieldMatches
+from ocr_services.field_gap import get_field
+from ocr_services.spatial_index import fill_from_layout
+from ocr_services.templates import extract_with_template
+from ocr_services.roi_ocr import reocr_weak_fields
 
 
 class PoSOCRService:
@@ -16,6 +22,67 @@ class PoSOCRService:
     Updated to match PPA/Term Sheet/Invoice OCR structure.
     """
     
+    # Bump whenever extraction logic changes so cached results are invalidated
+    extractor_version = "1.2.0"
+    
+    # Label patterns used to locate each field for field-gap LLM refinement
+    field_anchors = {
+        "certificate.pos_id": r"PoS ID",
+        "certificate.scheme": r"Scheme",
+        "certificate.issuer": r"Issuer",
+        "certificate.issue_date": r"Issue Date",
+        "certificate.validity": r"Validity",
+        "parties.supplier": r"Supplier",
+        "parties.recipient": r"Recipient",
+        "batch.batch_id": r"Batch ID",
+        "batch.batch_volume": r"Batch Volume",
+        "batch.batch_volume_unit": r"Batch Volume",
+        "batch.energy_content": r"Energy Content",
+        "batch.energy_content_unit": r"Energy Content",
+        "ghg.ci_lca": r"CI\s*\(LCA\)",
+        "ghg.ci_limit": r"limit",
+        "chain_of_custody.model": r"Chain of Custody|Mass Balance|Segregat"
+    }
+    
+    # Labels whose values are also read from OCR word geometry when the text pass misses them
+    spatial_labels = [
+        "PoS ID", "Scheme", "Issuer", "Issue Date", "Validity", "Supplier", "Recipient",
+        "Batch ID", "Batch Volume", "Energy Content", "CI (LCA)", "Chain of Custody"
+    ]
+    
+    # Fields whose value sits on another field's label line: "CI (LCA): -51.2 gCO2e/MJ (limit ≤ −49.5)"
+    spatial_field_labels = {"ghg.ci_limit": "CI (LCA)"}
+    
+    # Fields the plausibility checks read; early-stop mode stops OCR'ing pages once all are found
+    required_fields = [
+        "certificate.pos_id", "certificate.scheme", "certificate.issue_date", "certificate.validity",
+        "parties.supplier", "parties.recipient", "ghg.ci_lca", "ghg.ci_limit"
+    ]
+    
+    # Labels with numeric values; their regions are re-OCR'd with a digit/unit whitelist.
+    # Not "CI (LCA)": its region also holds "(limit ≤ …)", which the whitelist can't spell
+    numeric_labels = ["Batch Volume", "Energy Content"]
+    
+    # Regex fields, compiled once; each value pattern is matched only where its label occurs
+    field_specs = FieldSpecRegistry([
+        FieldSpec("certificate.pos_id", r'PoS ID[\s:]+([A-Z0-9■\-]+)'),
+        FieldSpec("certificate.scheme", r'Scheme[\s:]+([^\n]+)'),
+        FieldSpec("certificate.issuer", r'Issuer[\s:]+([^\n]+)'),
+        FieldSpec("certificate.issue_date", r'Issue Date[\s:]+(\d{4}[■\-]\d{2}[■\-]\d{2})'),
+        FieldSpec("certificate.validity", r'Validity\s*[:：]\s*(\d+\s*[Yy]ears?)'),
+        FieldSpec("parties.supplier", r'Supplier[\s:]+([^\n]+)'),
+        FieldSpec("parties.recipient", r'Recipient[\s:]+([^\n]+)'),
+        FieldSpec("batch.batch_id", r'Batch ID[\s:]+([A-Z0-9■\-]+)'),
+        FieldSpec("batch.volume", r'Batch Volume[\s:]+([0-9\.]+)\s*(t|tonnes|MT|kg)?'),
+        FieldSpec("batch.energy", r'Energy Content[\s:]+([0-9\.]+)\s*(MWh|kWh|GJ|MJ)?'),
+        # Pattern: CI (LCA): -51.2 gCO2e/MJ (limit ≤ −49.5)
+        FieldSpec("ghg.ci", r'CI\s*\(LCA\)[\s:]+([−\-]?[0-9\.]+)\s*gCO[■₂2]?[■e]*[/■]*MJ\s*\(limit\s*[≤<=]+\s*([−\-]?[0-9\.]+)\)'),
+        FieldSpec("ghg.ci_simple", r'CI\s*\(LCA\)[\s:]+([−\-]?[0-9\.]+)'),
+        FieldSpec("ghg.limit", r'limit\s*[≤<=]+\s*([−\-]?[0-9\.]+)'),
+        FieldSpec("chain_of_custody.no_double_counting", r'No Double Counting[\s:]*TRUE'),
+        FieldSpec("chain_of_custody.double_counting_no", r'Double Counting[\s:]*(?:No|FALSE)')
+    ])
+    
     def __init__(self):
         """Initialize the PoS OCR service"""
         # LLM Configuration
@@ -23,134 +90,89 @@ class PoSOCRService:
         self.llm_api_url = os.getenv('LLM_API_URL', 'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent')
         self.llm_api_key = os.getenv('LLM_API_KEY', '')
         self.llm_model = os.getenv('LLM_MODEL', 'gemini-2.0-flash')
+        # 'field_gap' asks the LLM only for missing fields; 'full' re-extracts the whole document
+        self.llm_refinement_mode = os.getenv('LLM_REFINEMENT_MODE', 'field_gap').lower()
+        # Skip the LLM when the regex pass is complete and confident enough
+        self.llm_bypass_min_completeness = float(os.getenv('LLM_BYPASS_MIN_COMPLETENESS', '1.0'))
+        self.llm_bypass_min_confidence = float(os.getenv('LLM_BYPASS_MIN_CONFIDENCE', '0.85'))
+        # Fields below this confidence are re-asked in field_gap mode
+        self.llm_field_min_confidence = float(os.getenv('LLM_FIELD_MIN_CONFIDENCE', '0.6'))
+        # Fill fields from OCR word positions (label -> value to the right / below) after the regex pass
+        self.use_spatial_fields = os.getenv('OCR_SPATIAL_FIELDS', 'true').lower() == 'true'
+        # Re-OCR the regions of missing and low-confidence fields at a higher DPI
+        self.use_roi_ocr = os.getenv('OCR_ROI_REOCR', 'false').lower() == 'true'
+        # OCR scanned pages in order and stop once the required fields are found (skips annexes)
+        self.use_early_stop = os.getenv('OCR_EARLY_STOP', 'false').lower() == 'true'
+        self.early_stop_batch = int(os.getenv('OCR_EARLY_STOP_BATCH', '1'))
     
     async def process_document(self, content: bytes, filename: str) -> Dict[str, Any]:
         """Process the PoS document and extract structured information."""
-        text = self._extract_text_from_pdf(content)
-        
-        structured_text = None
-        if not text or len(text.strip()) < 100:
-            text, bounding_boxes = self._ocr_pdf_with_bounding_boxes(content)
-            if bounding_boxes:
-                structured_text = self._structure_text_by_spatial_layout(bounding_boxes)
+        # Scans of a known issuer layout: OCR only the field regions learned for it
+        templated = await extract_with_template(self, "pos", content)
+        if templated is not None:
+            extracted_data, text, bounding_boxes = templated
+            return await refine_extraction(self, "Proof of Sustainability (PoS)", extracted_data, text, bounding_boxes)
+
+        # Use the text layer where it is usable and OCR only the remaining pages
+        profile = get_ocr_profiles().for_doc_type("pos")
+        pages_skipped = None
+        if self.use_early_stop:
+            text, structured_text, bounding_boxes, pages_skipped = await extract_document_text_until(
+                content, self._structure_text_by_spatial_layout, self._has_required_fields, profile, self.early_stop_batch
+            )
+        else:
+            text, structured_text, bounding_boxes = await extract_document_text(
+                content, self._structure_text_by_spatial_layout, profile
+            )
         
         processing_text = structured_text if structured_text else text
         
-        extracted_data = {
-            "certificate": self._extract_certificate_info(processing_text),
-            "parties": self._extract_parties(processing_text),
-            "batch": self._extract_batch_info(processing_text),
-            "ghg": self._extract_ghg_info(processing_text),
-            "chain_of_custody": self._extract_chain_of_custody(processing_text),
-            "raw_text": text,
-            "structured_text": structured_text
-        }
+        with stage("regex"):
+            extracted_data = self._extract_fields(processing_text)
+        if self.use_spatial_fields and bounding_boxes is not None and len(bounding_boxes):
+            # Tables flattened to text lose which value belongs to which label; resolve those from geometry
+            with stage("spatial"):
+                extracted_data["layout_fields"] = fill_from_layout(self, extracted_data, bounding_boxes)
+        if self.use_roi_ocr and bounding_boxes is not None and len(bounding_boxes):
+            # Small table cells (CI values, volumes) are misread at the page DPI; re-read just those
+            with stage("roi"):
+                extracted_data["roi_fields"], bounding_boxes = await reocr_weak_fields(
+                    self, "pos", content, extracted_data, bounding_boxes
+                )
+        if pages_skipped is not None:
+            extracted_data["pages_skipped"] = pages_skipped
+        extracted_data["raw_text"] = text
+        extracted_data["structured_text"] = structured_text
         
-        if self.use_llm_refinement and self.llm_api_key:
-            try:
-                refined_data = await self._refine_with_llm(extracted_data, processing_text)
-                refined_data["raw_text"] = text
-                refined_data["structured_text"] = structured_text
-                refined_data["llm_refined"] = True
-                return refined_data
-            except Exception as e:
-                print(f"LLM refinement failed: {e}")
-                extracted_data["llm_refined"] = False
-                return extracted_data
-        else:
-            extracted_data["llm_refined"] = False
-            return extracted_data
+        return await refine_extraction(self, "Proof of Sustainability (PoS)", extracted_data, processing_text, bounding_boxes)
     
-    def _extract_text_from_pdf(self, content: bytes) -> str:
-        """Extract text directly from PDF"""
-        try:
-            pdf_file = io.BytesIO(content)
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            return text
-        except Exception as e:
-            print(f"Error extracting text from PDF: {e}")
-            return ""
+    def _has_required_fields(self, text: str, boxes: Optional[WordBoxes]) -> bool:
+        """Whether the pages read so far hold every field the plausibility checks need"""
+        extracted_data = self._extract_fields(text)
+        if self.use_spatial_fields and boxes is not None and len(boxes):
+            fill_from_layout(self, extracted_data, boxes)
+        return all(get_field(extracted_data, path) is not None for path in self.required_fields)
     
-    def _ocr_pdf_with_bounding_boxes(self, content: bytes) -> tuple[str, List[Dict[str, Any]]]:
-        """Perform OCR with bounding box data"""
-        try:
-            images = convert_from_bytes(content)
-            all_text = ""
-            all_boxes = []
-            
-            for page_num, image in enumerate(images):
-                data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
-                n_boxes = len(data['text'])
-                for i in range(n_boxes):
-                    text = data['text'][i].strip()
-                    if text:
-                        box_info = {
-                            'text': text,
-                            'left': data['left'][i],
-                            'top': data['top'][i],
-                            'width': data['width'][i],
-                            'height': data['height'][i],
-                            'confidence': data['conf'][i],
-                            'page': page_num
-                        }
-                        all_boxes.append(box_info)
-                        all_text += text + " "
-                all_text += "\n"
-            return all_text.strip(), all_boxes
-        except Exception as e:
-            print(f"Error performing bounding box OCR: {e}")
-            return "", []
-    
-    def _structure_text_by_spatial_layout(self, boxes: List[Dict[str, Any]]) -> str:
+    @timed("layout")
+    def _structure_text_by_spatial_layout(self, boxes: WordBoxes) -> str:
         """Structure text based on spatial layout"""
-        if not boxes:
-            return ""
-        
-        lines = []
-        current_line = []
-        current_y = None
-        y_tolerance = 10
-        
-        sorted_boxes = sorted(boxes, key=lambda b: (b['top'], b['left']))
-        
-        for box in sorted_boxes:
-            if current_y is None:
-                current_y = box['top']
-                current_line = [box]
-            elif abs(box['top'] - current_y) <= y_tolerance:
-                current_line.append(box)
-            else:
-                if current_line:
-                    lines.append(current_line)
-                current_line = [box]
-                current_y = box['top']
-        
-        if current_line:
-            lines.append(current_line)
-        
-        structured_text = ""
-        for line in lines:
-            line.sort(key=lambda b: b['left'])
-            prev_right = None
-            for box in line:
-                if prev_right is not None:
-                    gap = box['left'] - prev_right
-                    if gap > 50:
-                        structured_text += "  |  "
-                    elif gap > 20:
-                        structured_text += "  "
-                    else:
-                        structured_text += " "
-                structured_text += box['text']
-                prev_right = box['left'] + box['width']
-            structured_text += "\n"
-        
-        return structured_text
+        return structure_text_by_spatial_layout(boxes)
+    
+    def _extract_fields(self, text: str) -> Dict[str, Any]:
+        """Run the regex extractors over the document text"""
+        fields = self.field_specs.scan(text)
+        extracted = {
+            "certificate": self._extract_certificate_info(fields),
+            "parties": self._extract_parties(fields),
+            "batch": self._extract_batch_info(fields),
+            "ghg": self._extract_ghg_info(fields),
+            "chain_of_custody": self._extract_chain_of_custody(fields)
+        }
+        if fields.skipped:
+            extracted["extraction_skipped"] = list(fields.skipped)
+        return extracted
     
-    def _extract_certificate_info(self, text: str) -> Dict[str, Any]:
+    def _extract_certificate_info(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract certificate information"""
         certificate = {
             "pos_id": None,
@@ -161,38 +183,33 @@ class PoSOCRService:
         }
         
         # Extract PoS ID
-        pos_id_pattern = r'PoS ID[\s:]+([A-Z0-9■\-]+)'
-        match = re.search(pos_id_pattern, text, re.IGNORECASE)
+        match = fields.search("certificate.pos_id")
         if match:
             certificate["pos_id"] = match.group(1).replace('■', '-').strip()
         
         # Extract scheme
-        scheme_pattern = r'Scheme[\s:]+([^\n]+)'
-        match = re.search(scheme_pattern, text, re.IGNORECASE)
+        match = fields.search("certificate.scheme")
         if match:
             certificate["scheme"] = match.group(1).strip()
         
         # Extract issuer
-        issuer_pattern = r'Issuer[\s:]+([^\n]+)'
-        match = re.search(issuer_pattern, text, re.IGNORECASE)
+        match = fields.search("certificate.issuer")
         if match:
             certificate["issuer"] = match.group(1).strip()
         
         # Extract issue date
-        issue_date_pattern = r'Issue Date[\s:]+(\d{4}[■\-]\d{2}[■\-]\d{2})'
-        match = re.search(issue_date_pattern, text, re.IGNORECASE)
+        match = fields.search("certificate.issue_date")
         if match:
             certificate["issue_date"] = match.group(1).replace('■', '-')
         
         # Extract validity
-        validity_pattern = r'Validity\s*[:：]\s*(\d+\s*[Yy]ears?)'
-        match = re.search(validity_pattern, text, re.IGNORECASE)
+        match = fields.search("certificate.validity")
         if match:
             certificate["validity"] = match.group(1).strip()
         
         return certificate
     
-    def _extract_parties(self, text: str) -> Dict[str, Any]:
+    def _extract_parties(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract party information"""
         parties = {
             "supplier": None,
@@ -200,20 +217,18 @@ class PoSOCRService:
         }
         
         # Extract supplier
-        supplier_pattern = r'Supplier[\s:]+([^\n]+)'
-        match = re.search(supplier_pattern, text, re.IGNORECASE)
+        match = fields.search("parties.supplier")
         if match:
             parties["supplier"] = match.group(1).strip()
         
         # Extract recipient
-        recipient_pattern = r'Recipient[\s:]+([^\n]+)'
-        match = re.search(recipient_pattern, text, re.IGNORECASE)
+        match = fields.search("parties.recipient")
         if match:
             parties["recipient"] = match.group(1).strip()
         
         return parties
     
-    def _extract_batch_info(self, text: str) -> Dict[str, Any]:
+    def _extract_batch_info(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract batch information"""
         batch = {
             "batch_id": None,
@@ -224,22 +239,19 @@ class PoSOCRService:
         }
         
         # Extract Batch ID
-        batch_id_pattern = r'Batch ID[\s:]+([A-Z0-9■\-]+)'
-        match = re.search(batch_id_pattern, text, re.IGNORECASE)
+        match = fields.search("batch.batch_id")
         if match:
             batch["batch_id"] = match.group(1).replace('■', '-').strip()
         
         # Extract Batch Volume
-        volume_pattern = r'Batch Volume[\s:]+([0-9\.]+)\s*(t|tonnes|MT|kg)?'
-        match = re.search(volume_pattern, text, re.IGNORECASE)
+        match = fields.search("batch.volume")
         if match:
             batch["batch_volume"] = match.group(1).strip()
             if match.group(2):
                 batch["batch_volume_unit"] = match.group(2).strip()
         
         # Extract Energy Content
-        energy_pattern = r'Energy Content[\s:]+([0-9\.]+)\s*(MWh|kWh|GJ|MJ)?'
-        match = re.search(energy_pattern, text, re.IGNORECASE)
+        match = fields.search("batch.energy")
         if match:
             batch["energy_content"] = match.group(1).strip()
             if match.group(2):
@@ -247,7 +259,7 @@ class PoSOCRService:
         
         return batch
     
-    def _extract_ghg_info(self, text: str) -> Dict[str, Any]:
+    def _extract_ghg_info(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract GHG emissions information"""
         ghg = {
             "ci_lca": None,
@@ -256,28 +268,24 @@ class PoSOCRService:
         }
         
         # Extract CI (LCA) value and limit
-        # Pattern: CI (LCA): -51.2 gCO2e/MJ (limit ≤ −49.5)
-        ci_pattern = r'CI\s*\(LCA\)[\s:]+([−\-]?[0-9\.]+)\s*gCO[■₂2]?[■e]*[/■]*MJ\s*\(limit\s*[≤<=]+\s*([−\-]?[0-9\.]+)\)'
-        match = re.search(ci_pattern, text, re.IGNORECASE)
+        match = fields.search("ghg.ci")
         if match:
             ghg["ci_lca"] = match.group(1).replace('−', '-').strip()
             ghg["ci_limit"] = match.group(2).replace('−', '-').strip()
         else:
             # Try simpler pattern for CI value only
-            ci_simple_pattern = r'CI\s*\(LCA\)[\s:]+([−\-]?[0-9\.]+)'
-            match = re.search(ci_simple_pattern, text, re.IGNORECASE)
+            match = fields.search("ghg.ci_simple")
             if match:
                 ghg["ci_lca"] = match.group(1).replace('−', '-').strip()
             
             # Try to find limit separately
-            limit_pattern = r'limit\s*[≤<=]+\s*([−\-]?[0-9\.]+)'
-            match = re.search(limit_pattern, text, re.IGNORECASE)
+            match = fields.search("ghg.limit")
             if match:
                 ghg["ci_limit"] = match.group(1).replace('−', '-').strip()
         
         return ghg
     
-    def _extract_chain_of_custody(self, text: str) -> Dict[str, Any]:
+    def _extract_chain_of_custody(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract chain of custody information"""
         chain = {
             "model": None,
@@ -285,15 +293,16 @@ class PoSOCRService:
         }
         
         # Extract model (Mass Balance, Segregated, etc.)
-        if 'mass balance' in text.lower():
+        text = fields.text.lower()
+        if 'mass balance' in text:
             chain["model"] = "Mass Balance"
-        elif 'segregat' in text.lower():
+        elif 'segregat' in text:
             chain["model"] = "Segregated"
         
         # Check for no double counting
-        if re.search(r'No Double Counting[\s:]*TRUE', text, re.IGNORECASE):
+        if fields.search("chain_of_custody.no_double_counting"):
             chain["no_double_counting"] = True
-        elif re.search(r'Double Counting[\s:]*(?:No|FALSE)', text, re.IGNORECASE):
+        elif fields.search("chain_of_custody.double_counting_no"):
             chain["no_double_counting"] = True
         
         return chain
@@ -331,35 +340,15 @@ INSTRUCTIONS:
 
 Return ONLY the corrected JSON, no explanations."""
 
+        generation_config = {
+            "maxOutputTokens": 4096,
+            "temperature": 0.1
+        }
+        
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                headers = {
-                    "X-goog-api-key": self.llm_api_key,
-                    "Content-Type": "application/json"
-                }
-                
-                payload = {
-                    "contents": [{
-                        "parts": [{"text": prompt}]
-                    }],
-                    "generationConfig": {
-                        "maxOutputTokens": 4096,
-                        "temperature": 0.1
-                    }
-                }
-                
-                response = await client.post(self.llm_api_url, headers=headers, json=payload)
-                response.raise_for_status()
-                result = response.json()
-                
-                llm_text = result['candidates'][0]['content']['parts'][0]['text'].strip()
-                if llm_text.startswith('```'):
-                    llm_text = re.sub(r'^```json\s*\n', '', llm_text)
-                    llm_text = re.sub(r'^```\s*\n', '', llm_text)
-                    llm_text = re.sub(r'\n```\s*$', '', llm_text)
-                
-                refined_data = json.loads(llm_text)
-                return refined_data
+            return await get_llm_client().generate_json(
+                self.llm_api_url, self.llm_api_key, self.llm_model, prompt, generation_config
+            )
         except Exception as e:
             print(f"Error in LLM refinement: {str(e)}")
             raise
\ No newline at end of file
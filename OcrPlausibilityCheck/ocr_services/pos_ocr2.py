@@ -11,6 +11,8 @@ import json
 import httpx
 from dotenv import load_dotenv
 
+from ocr_services.field_specs import FieldSpec, FieldSpecRegistry, FieldMatches
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -20,19 +22,62 @@ class PoSOCRServiceTwo:
     Service for extracting structured data from Proof of Sustainability (PoS) documents.
     """
     
+    feedstock_keywords = [
+        'used cooking oil', 'uco', 'corn starch', 'animal fat', 
+        'wood residues', 'rapeseed', 'soybean', 'palm oil',
+        'wheat straw', 'forest residues', 'waste', 'residue'
+    ]
+    
+    fuel_types = [
+        'hvo', 'hydrotreated vegetable oil', 'fame', 'biodiesel',
+        'bioethanol', 'biogas', 'e-methanol', 'rme', 'renewable diesel'
+    ]
+    
+    ghg_components = ['eec', 'el', 'ep', 'etd', 'eu', 'esca', 'eccs', 'eccr']
+    
+    # Regex fields, compiled once; each value pattern is matched only where its label occurs.
+    # Lazy patterns ('.*?') only look within the window after their label instead of the whole rest of the document.
+    field_specs = FieldSpecRegistry([
+        FieldSpec("document_info.unique_number", r'(?:Unique Number|PoS Number|Certificate Number)[\s:]+([A-Z0-9\-]+)'),
+        FieldSpec("document_info.issuance_date", r'(?:Date of Issuance|Issue Date)[\s:]+(\d{2}\.\d{2}\.\d{4})'),
+        FieldSpec("supplier_recipient.supplier_name", r'Supplier[\s\S]{0,50}Name[\s:]+([^\n]+)'),
+        FieldSpec("supplier_recipient.recipient_name", r'Recipient[\s\S]{0,50}Name[\s:]+([^\n]+)'),
+        FieldSpec("supplier_recipient.certification_system", r'Certification System[\s:]+([^\n]+)'),
+        FieldSpec("supplier_recipient.certificate_number", r'Certificate Number[\s:]+([A-Z0-9\-]+)'),
+        FieldSpec("supplier_recipient.shipping_point", r'(?:Address of dispatch|shipping point)[\s:]+([^\n]+(?:\n[^\n]+)?)'),
+        FieldSpec("supplier_recipient.receiving_point", r'(?:Address of receipt|receiving point)[\s:]+([^\n]+(?:\n[^\n]+)?)'),
+        FieldSpec("feedstock.raw_material", r'(?:Type of Raw Material|Feedstock)[\s:]+([^\n]+)'),
+        *[
+            FieldSpec(f"feedstock.keyword.{keyword}", rf'({keyword}[^\n]*)', anchor=keyword)
+            for keyword in feedstock_keywords
+        ],
+        FieldSpec("feedstock.country_of_origin", r'Country of Origin[\s:]+([^\n]+)'),
+        FieldSpec("feedstock.waste_residue", r'waste|residue'),
+        FieldSpec("feedstock.low_iluc_risk", r'low ILUC risk'),
+        FieldSpec("feedstock.intermediate_crop", r'intermediate crop'),
+        FieldSpec("fuel_product.type", r'Type of Product[\s:]+([^\n]+)'),
+        FieldSpec("fuel_product.quantity", r'Quantity[\s:|]+([0-9,\.]+)\s*(m3|metric tons|tonnes|liters)?'),
+        FieldSpec("fuel_product.energy_content", r'Energy content.*?([0-9,\s\.]+)\s*MJ'),
+        FieldSpec("fuel_product.country_of_production", r'Country of.*?production[\s:]+([^\n]+)'),
+        FieldSpec("fuel_product.eu_red_compliant", r'EU RED Compliant.*?Yes', flags=re.IGNORECASE | re.DOTALL),
+        FieldSpec("fuel_product.iscc_compliant", r'ISCC Compliant.*?Yes', flags=re.IGNORECASE | re.DOTALL),
+        FieldSpec("ghg_emissions.total", r'E\s*=.*?([0-9\.]+)\s*gCO2eq/MJ', anchor=('E =', 'E=')),
+        FieldSpec("ghg_emissions.saving", r'(?:GHG emission saving|saving)[\s:]+([0-9\.]+)\s*%'),
+        FieldSpec("ghg_emissions.default_value", r'Total default value.*?Yes', flags=re.IGNORECASE | re.DOTALL),
+        *[
+            FieldSpec(f"ghg_emissions.{component}", rf'{component.upper()}\s*[=:]+\s*([0-9\.]+)')
+            for component in ghg_components
+        ],
+        FieldSpec("compliance.article_29", r'Art(?:icle)?\s*29.*?(?:2|complies)'),
+        FieldSpec("compliance.chain_of_custody", r'Chain of custody.*?([^\n]+)'),
+        FieldSpec("dates.dispatch", r'Date of dispatch[\s:]+([0-9]{2}\.[0-9]{2}\.[0-9]{4})'),
+        FieldSpec("dates.production_start", r'Start date of.*?production[\s:]+([0-9]{2}\.[0-9]{2}\.[0-9]{4})'),
+        FieldSpec("certification.scheme", r'Certification System[\s:]+([^\n]+)'),
+        FieldSpec("certification.certificate_number", r'Certificate Number[\s:]+([A-Z0-9\-]+)')
+    ])
+    
     def __init__(self):
         """Initialize the PoS OCR service"""
-        self.feedstock_keywords = [
-            'used cooking oil', 'uco', 'corn starch', 'animal fat', 
-            'wood residues', 'rapeseed', 'soybean', 'palm oil',
-            'wheat straw', 'forest residues', 'waste', 'residue'
-        ]
-        
-        self.fuel_types = [
-            'hvo', 'hydrotreated vegetable oil', 'fame', 'biodiesel',
-            'bioethanol', 'biogas', 'e-methanol', 'rme', 'renewable diesel'
-        ]
-        
         # LLM Configuration
         self.use_llm_refinement = os.getenv('USE_LLM_REFINEMENT', 'true').lower() == 'true'
         self.llm_api_url = os.getenv('LLM_API_URL', 'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent')
@@ -65,18 +110,9 @@ class PoSOCRServiceTwo:
         processing_text = structured_text if structured_text else text
         
         # Extract structured data using regex-based extraction
-        extracted_data = {
-            "document_info": self._extract_document_info(processing_text),
-            "supplier_recipient": self._extract_supplier_recipient(processing_text),
-            "feedstock": self._extract_feedstock_info(processing_text),
-            "fuel_product": self._extract_fuel_product_info(processing_text),
-            "ghg_emissions": self._extract_ghg_info(processing_text),
-            "compliance": self._extract_compliance_info(processing_text),
-            "dates": self._extract_dates(processing_text),
-            "certification": self._extract_certification_info(processing_text),
-            "raw_text": text,
-            "structured_text": structured_text  # Include structured version for debugging
-        }
+        extracted_data = self._extract_fields(processing_text)
+        extracted_data["raw_text"] = text
+        extracted_data["structured_text"] = structured_text  # Include structured version for debugging
         
         # Refine with LLM if enabled and API key is available
         if self.use_llm_refinement and self.llm_api_key:
@@ -223,7 +259,24 @@ class PoSOCRServiceTwo:
         
         return structured_text
     
-    def _extract_document_info(self, text: str) -> Dict[str, Any]:
+    def _extract_fields(self, text: str) -> Dict[str, Any]:
+        """Run the regex extractors over the document text"""
+        fields = self.field_specs.scan(text)
+        extracted = {
+            "document_info": self._extract_document_info(fields),
+            "supplier_recipient": self._extract_supplier_recipient(fields),
+            "feedstock": self._extract_feedstock_info(fields),
+            "fuel_product": self._extract_fuel_product_info(fields),
+            "ghg_emissions": self._extract_ghg_info(fields),
+            "compliance": self._extract_compliance_info(fields),
+            "dates": self._extract_dates(fields),
+            "certification": self._extract_certification_info(fields)
+        }
+        if fields.skipped:
+            extracted["extraction_skipped"] = list(fields.skipped)
+        return extracted
+    
+    def _extract_document_info(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract basic document information"""
         info = {
             "document_type": "Proof of Sustainability (PoS)",
@@ -233,24 +286,22 @@ class PoSOCRServiceTwo:
         }
         
         # Extract unique PoS number
-        pos_number_pattern = r'(?:Unique Number|PoS Number|Certificate Number)[\s:]+([A-Z0-9\-]+)'
-        match = re.search(pos_number_pattern, text, re.IGNORECASE)
+        match = fields.search("document_info.unique_number")
         if match:
             info["unique_number"] = match.group(1).strip()
         
         # Extract issuance date
-        date_pattern = r'(?:Date of Issuance|Issue Date)[\s:]+(\d{2}\.\d{2}\.\d{4})'
-        match = re.search(date_pattern, text, re.IGNORECASE)
+        match = fields.search("document_info.issuance_date")
         if match:
             info["issuance_date"] = match.group(1).strip()
         
         # Check for RED II directive
-        if 'RED II' in text or '2018/2001' in text:
+        if 'RED II' in fields.text or '2018/2001' in fields.text:
             info["directive"] = "Renewable Energy Directive (EU) 2018/2001 (RED II)"
         
         return info
     
-    def _extract_supplier_recipient(self, text: str) -> Dict[str, Any]:
+    def _extract_supplier_recipient(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract supplier and recipient information"""
         data = {
             "supplier": {
@@ -271,43 +322,37 @@ class PoSOCRServiceTwo:
         }
         
         # Extract supplier name
-        supplier_pattern = r'Supplier[\s\S]{0,50}Name[\s:]+([^\n]+)'
-        match = re.search(supplier_pattern, text, re.IGNORECASE)
+        match = fields.search("supplier_recipient.supplier_name")
         if match:
             data["supplier"]["name"] = match.group(1).strip()
         
         # Extract recipient name
-        recipient_pattern = r'Recipient[\s\S]{0,50}Name[\s:]+([^\n]+)'
-        match = re.search(recipient_pattern, text, re.IGNORECASE)
+        match = fields.search("supplier_recipient.recipient_name")
         if match:
             data["recipient"]["name"] = match.group(1).strip()
         
         # Extract certification system
-        cert_system_pattern = r'Certification System[\s:]+([^\n]+)'
-        match = re.search(cert_system_pattern, text, re.IGNORECASE)
+        match = fields.search("supplier_recipient.certification_system")
         if match:
             data["supplier"]["certification_system"] = match.group(1).strip()
         
         # Extract certificate number
-        cert_num_pattern = r'Certificate Number[\s:]+([A-Z0-9\-]+)'
-        match = re.search(cert_num_pattern, text, re.IGNORECASE)
+        match = fields.search("supplier_recipient.certificate_number")
         if match:
             data["supplier"]["certificate_number"] = match.group(1).strip()
         
         # Extract shipping and receiving points
-        shipping_pattern = r'(?:Address of dispatch|shipping point)[\s:]+([^\n]+(?:\n[^\n]+)?)'
-        match = re.search(shipping_pattern, text, re.IGNORECASE)
+        match = fields.search("supplier_recipient.shipping_point")
         if match:
             data["shipping_point"] = match.group(1).strip()
         
-        receiving_pattern = r'(?:Address of receipt|receiving point)[\s:]+([^\n]+(?:\n[^\n]+)?)'
-        match = re.search(receiving_pattern, text, re.IGNORECASE)
+        match = fields.search("supplier_recipient.receiving_point")
         if match:
             data["receiving_point"] = match.group(1).strip()
         
         return data
     
-    def _extract_feedstock_info(self, text: str) -> Dict[str, Any]:
+    def _extract_feedstock_info(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract feedstock type and origin information"""
         feedstock = {
             "type": None,
@@ -320,44 +365,41 @@ class PoSOCRServiceTwo:
         }
         
         # Extract feedstock type/raw material
-        raw_material_pattern = r'(?:Type of Raw Material|Feedstock)[\s:]+([^\n]+)'
-        match = re.search(raw_material_pattern, text, re.IGNORECASE)
+        match = fields.search("feedstock.raw_material")
         if match:
             feedstock["type"] = match.group(1).strip()
         
         # Check for specific feedstock mentions
         if not feedstock["type"]:
             for keyword in self.feedstock_keywords:
-                if keyword.lower() in text.lower():
-                    pattern = rf'({keyword}[^\n]*)'
-                    match = re.search(pattern, text, re.IGNORECASE)
+                if keyword.lower() in fields.text.lower():
+                    match = fields.search(f"feedstock.keyword.{keyword}")
                     if match:
                         feedstock["type"] = match.group(1).strip()
                         break
         
         # Extract country of origin
-        origin_pattern = r'Country of Origin[\s:]+([^\n]+)'
-        match = re.search(origin_pattern, text, re.IGNORECASE)
+        match = fields.search("feedstock.country_of_origin")
         if match:
             feedstock["country_of_origin"] = match.group(1).strip()
         
         # Check if waste/residue
-        if re.search(r'waste|residue', text, re.IGNORECASE):
+        if fields.search("feedstock.waste_residue"):
             feedstock["is_waste_residue"] = True
-            if 'Yes' in text and 'waste or residue' in text.lower():
+            if 'Yes' in fields.text and 'waste or residue' in fields.text.lower():
                 feedstock["is_waste_residue"] = True
         
         # Check for low ILUC risk
-        if re.search(r'low ILUC risk', text, re.IGNORECASE):
+        if fields.search("feedstock.low_iluc_risk"):
             feedstock["is_low_iluc_risk"] = True
         
         # Check for intermediate crop
-        if re.search(r'intermediate crop', text, re.IGNORECASE):
+        if fields.search("feedstock.intermediate_crop"):
             feedstock["is_intermediate_crop"] = True
         
         return feedstock
     
-    def _extract_fuel_product_info(self, text: str) -> Dict[str, Any]:
+    def _extract_fuel_product_info(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract fuel product and batch details"""
         fuel = {
             "type": None,
@@ -372,51 +414,47 @@ class PoSOCRServiceTwo:
         }
         
         # Extract fuel type/product
-        product_pattern = r'Type of Product[\s:]+([^\n]+)'
-        match = re.search(product_pattern, text, re.IGNORECASE)
+        match = fields.search("fuel_product.type")
         if match:
             fuel["type"] = match.group(1).strip()
         
         # Check for specific fuel types if not found
         if not fuel["type"]:
             for fuel_type in self.fuel_types:
-                if fuel_type.lower() in text.lower():
+                if fuel_type.lower() in fields.text.lower():
                     fuel["type"] = fuel_type
                     break
         
         # Extract quantity - improved to handle column separators
-        quantity_pattern = r'Quantity[\s:|]+([0-9,\.]+)\s*(m3|metric tons|tonnes|liters)?'
-        match = re.search(quantity_pattern, text, re.IGNORECASE)
+        match = fields.search("fuel_product.quantity")
         if match:
             fuel["quantity"] = match.group(1).strip().replace(',', '')
             if match.group(2):
                 fuel["unit"] = match.group(2).strip()
         
         # Extract energy content - handle spaces in numbers like "817 971"
-        energy_pattern = r'Energy content.*?([0-9,\s\.]+)\s*MJ'
-        match = re.search(energy_pattern, text, re.IGNORECASE)
+        match = fields.search("fuel_product.energy_content")
         if match:
             # Remove spaces and commas from number
             energy_value = match.group(1).strip().replace(' ', '').replace(',', '')
             fuel["energy_content_mj"] = energy_value
         
         # Extract country of production
-        production_country_pattern = r'Country of.*?production[\s:]+([^\n]+)'
-        match = re.search(production_country_pattern, text, re.IGNORECASE)
+        match = fields.search("fuel_product.country_of_production")
         if match:
             fuel["country_of_production"] = match.group(1).strip()
         
         # Check RED compliance
-        if re.search(r'EU RED Compliant.*?Yes', text, re.IGNORECASE | re.DOTALL):
+        if fields.search("fuel_product.eu_red_compliant"):
             fuel["eu_red_compliant"] = True
         
         # Check ISCC compliance
-        if re.search(r'ISCC Compliant.*?Yes', text, re.IGNORECASE | re.DOTALL):
+        if fields.search("fuel_product.iscc_compliant"):
             fuel["iscc_compliant"] = True
         
         return fuel
     
-    def _extract_ghg_info(self, text: str) -> Dict[str, Any]:
+    def _extract_ghg_info(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract GHG emissions and savings information"""
         ghg = {
             "total_emissions_gco2eq_mj": None,
@@ -436,32 +474,28 @@ class PoSOCRServiceTwo:
         }
         
         # Extract total emissions
-        total_emissions_pattern = r'E\s*=.*?([0-9\.]+)\s*gCO2eq/MJ'
-        match = re.search(total_emissions_pattern, text, re.IGNORECASE)
+        match = fields.search("ghg_emissions.total")
         if match:
             ghg["total_emissions_gco2eq_mj"] = float(match.group(1))
         
         # Extract GHG saving percentage
-        saving_pattern = r'(?:GHG emission saving|saving)[\s:]+([0-9\.]+)\s*%'
-        match = re.search(saving_pattern, text, re.IGNORECASE)
+        match = fields.search("ghg_emissions.saving")
         if match:
             ghg["emission_saving_percentage"] = float(match.group(1))
         
         # Check if default value was applied
-        if re.search(r'Total default value.*?Yes', text, re.IGNORECASE | re.DOTALL):
+        if fields.search("ghg_emissions.default_value"):
             ghg["default_value_applied"] = True
         
         # Extract breakdown components (Eec, El, Ep, etc.)
-        components = ['eec', 'el', 'ep', 'etd', 'eu', 'esca', 'eccs', 'eccr']
-        for component in components:
-            pattern = rf'{component.upper()}\s*[=:]+\s*([0-9\.]+)'
-            match = re.search(pattern, text, re.IGNORECASE)
+        for component in self.ghg_components:
+            match = fields.search(f"ghg_emissions.{component}")
             if match:
                 ghg["breakdown"][component] = float(match.group(1))
         
         return ghg
     
-    def _extract_compliance_info(self, text: str) -> Dict[str, Any]:
+    def _extract_compliance_info(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract compliance and traceability information"""
         compliance = {
             "red_ii_article_29_compliant": False,
@@ -472,13 +506,12 @@ class PoSOCRServiceTwo:
         }
         
         # Check RED II Article 29 compliance
-        if re.search(r'Art(?:icle)?\s*29.*?(?:2|complies)', text, re.IGNORECASE):
+        if fields.search("compliance.article_29"):
             compliance["red_ii_article_29_compliant"] = True
             compliance["sustainability_criteria_met"] = True
         
         # Extract chain of custody model
-        custody_pattern = r'Chain of custody.*?([^\n]+)'
-        match = re.search(custody_pattern, text, re.IGNORECASE)
+        match = fields.search("compliance.chain_of_custody")
         if match:
             custody_text = match.group(1).strip()
             if 'mass balance' in custody_text.lower():
@@ -487,12 +520,12 @@ class PoSOCRServiceTwo:
                 compliance["chain_of_custody"] = "Segregated"
         
         # Check for double counting disclaimer
-        if 'not already been used' in text.lower() or 'quota obligation' in text.lower():
+        if 'not already been used' in fields.text.lower() or 'quota obligation' in fields.text.lower():
             compliance["no_double_counting"] = True
         
         return compliance
     
-    def _extract_dates(self, text: str) -> Dict[str, Any]:
+    def _extract_dates(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract all relevant dates from the document"""
         dates = {
             "issuance_date": None,
@@ -502,20 +535,18 @@ class PoSOCRServiceTwo:
         }
         
         # Extract dispatch date
-        dispatch_pattern = r'Date of dispatch[\s:]+([0-9]{2}\.[0-9]{2}\.[0-9]{4})'
-        match = re.search(dispatch_pattern, text, re.IGNORECASE)
+        match = fields.search("dates.dispatch")
         if match:
             dates["dispatch_date"] = match.group(1).strip()
         
         # Extract production start date
-        production_pattern = r'Start date of.*?production[\s:]+([0-9]{2}\.[0-9]{2}\.[0-9]{4})'
-        match = re.search(production_pattern, text, re.IGNORECASE)
+        match = fields.search("dates.production_start")
         if match:
             dates["production_start_date"] = match.group(1).strip()
         
         return dates
     
-    def _extract_certification_info(self, text: str) -> Dict[str, Any]:
+    def _extract_certification_info(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract certification and auditing information"""
         cert_info = {
             "certification_scheme": None,
@@ -525,14 +556,12 @@ class PoSOCRServiceTwo:
         }
         
         # Extract certification scheme
-        scheme_pattern = r'Certification System[\s:]+([^\n]+)'
-        match = re.search(scheme_pattern, text, re.IGNORECASE)
+        match = fields.search("certification.scheme")
         if match:
             cert_info["certification_scheme"] = match.group(1).strip()
         
         # Extract certificate number
-        cert_pattern = r'Certificate Number[\s:]+([A-Z0-9\-]+)'
-        match = re.search(cert_pattern, text, re.IGNORECASE)
+        match = fields.search("certification.certificate_number")
         if match:
             cert_info["certificate_number"] = match.group(1).strip()
         
@@ -1,15 +1,18 @@
-import re
 from typing import Dict, Any, Optional, List
-import io
-import PyPDF2
-from pdf2image import convert_from_bytes
-import pytesseract
-from PIL import Image
 import os
 import json
-import httpx
 from dotenv import load_dotenv
 
+from ocr_services.page_router import extract_document_text
+from ocr_services.ocr_profiles import get_ocr_profiles
+from ocr_services.layout import structure_text_by_spatial_layout
+from ocr_services.word_boxes import WordBoxes
+from ocr_services.llm_client import get_llm_client
+from ocr_services.refinement import refine_extraction
+from ocr_services.metrics import stage, timed
+from ocr_services.field_specs import FieldSpec, FieldSpecRegistry, FieldMatches
+from ocr_services.sections import SectionSegmenter
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -19,6 +22,65 @@ class PPAOCRService:
     Service for extracting structured data from Power Purchase Agreement (PPA) documents.
     """
     
+    # Bump whenever extraction logic changes so cached results are invalidated
+    extractor_version = "1.1.0"
+    
+    # Label patterns used to locate each field for field-gap LLM refinement
+    field_anchors = {
+        "parties.seller.name": r"Seller",
+        "parties.seller.registration": r"Seller",
+        "parties.buyer.name": r"Buyer",
+        "parties.buyer.registration": r"Buyer",
+        "key_terms.project_id": r"Project ID",
+        "key_terms.commodity": r"Commodity",
+        "key_terms.effective_date": r"Effective Date",
+        "key_terms.duration": r"Duration",
+        "key_terms.acq": r"ACQ",
+        "key_terms.acq_unit": r"ACQ",
+        "key_terms.monthly_plan": r"Monthly Plan",
+        "key_terms.monthly_tolerance": r"Monthly Plan",
+        "key_terms.delivery": r"Delivery",
+        "key_terms.customs": r"Customs",
+        "pricing.price_y1_y5": r"Price",
+        "pricing.currency": r"Currency",
+        "sustainability_compliance.ci_limit": r"CI Limit",
+        "sustainability_compliance.certification": r"Certification",
+        "sustainability_compliance.auditor_signature": r"auditor signature",
+        "commencement.commencement_rule": r"Commencement",
+        "commencement.long_stop_date": r"Long[■\-\s]*Stop"
+    }
+    
+    # Headed sections of a PPA; fields are only matched inside their own section
+    section_segmenter = SectionSegmenter({
+        "parties": ["Parties"],
+        "key_terms": ["Key Terms"],
+        "pricing": ["Pricing", "Price", "Pricing & Payment"],
+        "sustainability_compliance": ["Sustainability & Compliance", "Sustainability", "Compliance"],
+        "commencement": ["Commencement & Long Stop", "Commencement"]
+    })
+    
+    # Regex fields, compiled once; each value pattern is matched only where its label occurs
+    field_specs = FieldSpecRegistry([
+        FieldSpec("parties.seller", r'Seller[\s:]+([^\n(]+)(?:\s*\(([^)]+)\))?'),
+        FieldSpec("parties.buyer", r'Buyer[\s:]+([^\n(]+)(?:\s*\(([^)]+)\))?'),
+        FieldSpec("key_terms.project", r'Project ID[\s:]+([^\n]+)'),
+        FieldSpec("key_terms.commodity", r'Commodity[\s:]+([^\n]+)'),
+        FieldSpec("key_terms.effective", r'Effective Date[\s:]+(\d{4}[■\-]\d{2}[■\-]\d{2})'),
+        FieldSpec("key_terms.duration", r'Duration[\s:]+(\d+)\s*years?'),
+        FieldSpec("key_terms.acq", r'ACQ[\s:]+([0-9,]+)\s*(t/yr|tonnes/year)'),
+        FieldSpec("key_terms.monthly", r'Monthly Plan[\s:]+([0-9\.]+)\s*t\s*\(([^)]+)\)'),
+        FieldSpec("key_terms.delivery", r'Delivery[\s:]+([^\n;]+)'),
+        FieldSpec("key_terms.customs", r'Customs[\s:]+([^\n]+)'),
+        FieldSpec("pricing.price", r'Price\s*\(Y1[■\-–]Y5\)[\s:]+[€$]([0-9,]+)/t', sections=("pricing", "key_terms")),
+        FieldSpec("pricing.currency", r'Currency[\s:]+([A-Z]{3})', sections=("pricing", "key_terms")),
+        FieldSpec("sustainability_compliance.ci", r'CI Limit[\s:]+([≤<]+\s*[-−]?\s*[\d\.]+\s*gCO[■₂2]?/MJ)'),
+        FieldSpec("sustainability_compliance.cert", r'Certification[\s:]+([^\n]+)'),
+        FieldSpec("sustainability_compliance.audit_required", r'Third[■\-\s]*party audit required'),
+        FieldSpec("sustainability_compliance.auditor_signature", r'auditor signature.*?on[■\-\s]*chain'),
+        FieldSpec("commencement.rule", r'Commencement Rule[\s:]+([^\n]+)'),
+        FieldSpec("commencement.long_stop", r'Long[■\-\s]*Stop Date[\s:]+(\d{4}[■\-]\d{2}[■\-]\d{2})')
+    ], section_segmenter)
+    
     def __init__(self):
         """Initialize the PPA OCR service"""
         # LLM Configuration
@@ -26,135 +88,51 @@ class PPAOCRService:
         self.llm_api_url = os.getenv('LLM_API_URL', 'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent')
         self.llm_api_key = os.getenv('LLM_API_KEY')
         self.llm_model = os.getenv('LLM_MODEL', 'gemini-2.0-flash')
+        # 'field_gap' asks the LLM only for missing fields; 'full' re-extracts the whole document
+        self.llm_refinement_mode = os.getenv('LLM_REFINEMENT_MODE', 'field_gap').lower()
+        # Skip the LLM when the regex pass is complete and confident enough
+        self.llm_bypass_min_completeness = float(os.getenv('LLM_BYPASS_MIN_COMPLETENESS', '1.0'))
+        self.llm_bypass_min_confidence = float(os.getenv('LLM_BYPASS_MIN_CONFIDENCE', '0.85'))
+        # Fields below this confidence are re-asked in field_gap mode
+        self.llm_field_min_confidence = float(os.getenv('LLM_FIELD_MIN_CONFIDENCE', '0.6'))
         print("Using API key:", self.llm_api_key)
 
     async def process_document(self, content: bytes, filename: str) -> Dict[str, Any]:
         """Process the PPA document and extract structured information."""
-        text = self._extract_text_from_pdf(content)
-        
-        structured_text = None
-        if not text or len(text.strip()) < 100:
-            text, bounding_boxes = self._ocr_pdf_with_bounding_boxes(content)
-            if bounding_boxes:
-                structured_text = self._structure_text_by_spatial_layout(bounding_boxes)
+        # Use the text layer where it is usable and OCR only the remaining pages
+        text, structured_text, bounding_boxes = await extract_document_text(
+            content, self._structure_text_by_spatial_layout, get_ocr_profiles().for_doc_type("ppa")
+        )
         
         processing_text = structured_text if structured_text else text
         
-        extracted_data = {
-            "parties": self._extract_parties(processing_text),
-            "key_terms": self._extract_key_terms(processing_text),
-            "pricing": self._extract_pricing(processing_text),
-            "sustainability_compliance": self._extract_sustainability_compliance(processing_text),
-            "commencement": self._extract_commencement(processing_text),
-            "raw_text": text,
-            "structured_text": structured_text
-        }
+        with stage("regex"):
+            extracted_data = self._extract_fields(processing_text)
+        extracted_data["raw_text"] = text
+        extracted_data["structured_text"] = structured_text
         
-        if self.use_llm_refinement and self.llm_api_key:
-            try:
-                refined_data = await self._refine_with_llm(extracted_data, processing_text)
-                refined_data["raw_text"] = text
-                refined_data["structured_text"] = structured_text
-                refined_data["llm_refined"] = True
-                return refined_data
-            except Exception as e:
-                print(f"LLM refinement failed: {e}")
-                extracted_data["llm_refined"] = False
-                return extracted_data
-        else:
-            extracted_data["llm_refined"] = False
-            return extracted_data
-    
-    def _extract_text_from_pdf(self, content: bytes) -> str:
-        """Extract text directly from PDF"""
-        try:
-            pdf_file = io.BytesIO(content)
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            return text
-        except Exception as e:
-            print(f"Error extracting text from PDF: {e}")
-            return ""
+        return await refine_extraction(self, "Power Purchase Agreement (PPA)", extracted_data, processing_text, bounding_boxes)
     
-    def _ocr_pdf_with_bounding_boxes(self, content: bytes) -> tuple[str, List[Dict[str, Any]]]:
-        """Perform OCR with bounding box data"""
-        try:
-            images = convert_from_bytes(content)
-            all_text = ""
-            all_boxes = []
-            
-            for page_num, image in enumerate(images):
-                data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
-                n_boxes = len(data['text'])
-                for i in range(n_boxes):
-                    text = data['text'][i].strip()
-                    if text:
-                        box_info = {
-                            'text': text,
-                            'left': data['left'][i],
-                            'top': data['top'][i],
-                            'width': data['width'][i],
-                            'height': data['height'][i],
-                            'confidence': data['conf'][i],
-                            'page': page_num
-                        }
-                        all_boxes.append(box_info)
-                        all_text += text + " "
-                all_text += "\n"
-            return all_text.strip(), all_boxes
-        except Exception as e:
-            print(f"Error performing bounding box OCR: {e}")
-            return "", []
-    
-    def _structure_text_by_spatial_layout(self, boxes: List[Dict[str, Any]]) -> str:
+    @timed("layout")
+    def _structure_text_by_spatial_layout(self, boxes: WordBoxes) -> str:
         """Structure text based on spatial layout"""
-        if not boxes:
-            return ""
-        
-        lines = []
-        current_line = []
-        current_y = None
-        y_tolerance = 10
-        
-        sorted_boxes = sorted(boxes, key=lambda b: (b['top'], b['left']))
-        
-        for box in sorted_boxes:
-            if current_y is None:
-                current_y = box['top']
-                current_line = [box]
-            elif abs(box['top'] - current_y) <= y_tolerance:
-                current_line.append(box)
-            else:
-                if current_line:
-                    lines.append(current_line)
-                current_line = [box]
-                current_y = box['top']
-        
-        if current_line:
-            lines.append(current_line)
-        
-        structured_text = ""
-        for line in lines:
-            line.sort(key=lambda b: b['left'])
-            prev_right = None
-            for box in line:
-                if prev_right is not None:
-                    gap = box['left'] - prev_right
-                    if gap > 50:
-                        structured_text += "  |  "
-                    elif gap > 20:
-                        structured_text += "  "
-                    else:
-                        structured_text += " "
-                structured_text += box['text']
-                prev_right = box['left'] + box['width']
-            structured_text += "\n"
-        
-        return structured_text
+        return structure_text_by_spatial_layout(boxes)
+    
+    def _extract_fields(self, text: str) -> Dict[str, Any]:
+        """Run the regex extractors over the document text"""
+        fields = self.field_specs.scan(text)
+        extracted = {
+            "parties": self._extract_parties(fields),
+            "key_terms": self._extract_key_terms(fields),
+            "pricing": self._extract_pricing(fields),
+            "sustainability_compliance": self._extract_sustainability_compliance(fields),
+            "commencement": self._extract_commencement(fields)
+        }
+        if fields.skipped:
+            extracted["extraction_skipped"] = list(fields.skipped)
+        return extracted
     
-    def _extract_parties(self, text: str) -> Dict[str, Any]:
+    def _extract_parties(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract party information"""
         parties = {
             "seller": {
@@ -168,16 +146,14 @@ class PPAOCRService:
         }
         
         # Extract seller
-        seller_pattern = r'Seller[\s:]+([^\n(]+)(?:\s*\(([^)]+)\))?'
-        match = re.search(seller_pattern, text, re.IGNORECASE)
+        match = fields.search("parties.seller")
         if match:
             parties["seller"]["name"] = match.group(1).strip()
             if match.group(2):
                 parties["seller"]["registration"] = match.group(2).strip()
         
         # Extract buyer
-        buyer_pattern = r'Buyer[\s:]+([^\n(]+)(?:\s*\(([^)]+)\))?'
-        match = re.search(buyer_pattern, text, re.IGNORECASE)
+        match = fields.search("parties.buyer")
         if match:
             parties["buyer"]["name"] = match.group(1).strip()
             if match.group(2):
@@ -185,7 +161,7 @@ class PPAOCRService:
         
         return parties
     
-    def _extract_key_terms(self, text: str) -> Dict[str, Any]:
+    def _extract_key_terms(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract key terms"""
         key_terms = {
             "project_id": None,
@@ -201,58 +177,50 @@ class PPAOCRService:
         }
         
         # Project ID
-        project_pattern = r'Project ID[\s:]+([^\n]+)'
-        match = re.search(project_pattern, text, re.IGNORECASE)
+        match = fields.search("key_terms.project")
         if match:
             key_terms["project_id"] = match.group(1).strip()
         
         # Commodity
-        commodity_pattern = r'Commodity[\s:]+([^\n]+)'
-        match = re.search(commodity_pattern, text, re.IGNORECASE)
+        match = fields.search("key_terms.commodity")
         if match:
             key_terms["commodity"] = match.group(1).strip()
         
         # Effective date
-        effective_pattern = r'Effective Date[\s:]+(\d{4}[■\-]\d{2}[■\-]\d{2})'
-        match = re.search(effective_pattern, text, re.IGNORECASE)
+        match = fields.search("key_terms.effective")
         if match:
             key_terms["effective_date"] = match.group(1).replace('■', '-')
         
         # Duration
-        duration_pattern = r'Duration[\s:]+(\d+)\s*years?'
-        match = re.search(duration_pattern, text, re.IGNORECASE)
+        match = fields.search("key_terms.duration")
         if match:
             key_terms["duration"] = match.group(1).strip() + " years"
         
         # ACQ
-        acq_pattern = r'ACQ[\s:]+([0-9,]+)\s*(t/yr|tonnes/year)'
-        match = re.search(acq_pattern, text, re.IGNORECASE)
+        match = fields.search("key_terms.acq")
         if match:
             key_terms["acq"] = match.group(1).replace(',', '')
             key_terms["acq_unit"] = match.group(2).strip()
         
         # Monthly plan
-        monthly_pattern = r'Monthly Plan[\s:]+([0-9\.]+)\s*t\s*\(([^)]+)\)'
-        match = re.search(monthly_pattern, text, re.IGNORECASE)
+        match = fields.search("key_terms.monthly")
         if match:
             key_terms["monthly_plan"] = match.group(1).strip()
             key_terms["monthly_tolerance"] = match.group(2).strip()
         
         # Delivery
-        delivery_pattern = r'Delivery[\s:]+([^\n;]+)'
-        match = re.search(delivery_pattern, text, re.IGNORECASE)
+        match = fields.search("key_terms.delivery")
         if match:
             key_terms["delivery"] = match.group(1).strip()
         
         # Customs
-        customs_pattern = r'Customs[\s:]+([^\n]+)'
-        match = re.search(customs_pattern, text, re.IGNORECASE)
+        match = fields.search("key_terms.customs")
         if match:
             key_terms["customs"] = match.group(1).strip()
         
         return key_terms
     
-    def _extract_pricing(self, text: str) -> Dict[str, Any]:
+    def _extract_pricing(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract pricing information"""
         pricing = {
             "price_y1_y5": None,
@@ -260,20 +228,18 @@ class PPAOCRService:
         }
         
         # Price
-        price_pattern = r'Price\s*\(Y1[■\-–]Y5\)[\s:]+[€$]([0-9,]+)/t'
-        match = re.search(price_pattern, text, re.IGNORECASE)
+        match = fields.search("pricing.price")
         if match:
             pricing["price_y1_y5"] = match.group(1).replace(',', '')
         
         # Currency
-        currency_pattern = r'Currency[\s:]+([A-Z]{3})'
-        match = re.search(currency_pattern, text, re.IGNORECASE)
+        match = fields.search("pricing.currency")
         if match:
             pricing["currency"] = match.group(1).strip()
         
         return pricing
     
-    def _extract_sustainability_compliance(self, text: str) -> Dict[str, Any]:
+    def _extract_sustainability_compliance(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract sustainability and compliance information"""
         sustainability = {
             "ci_limit": None,
@@ -283,28 +249,26 @@ class PPAOCRService:
         }
         
         # CI limit
-        ci_pattern = r'CI Limit[\s:]+([≤<]+\s*[-−]?\s*[\d\.]+\s*gCO[■₂2]?/MJ)'
-        match = re.search(ci_pattern, text, re.IGNORECASE)
+        match = fields.search("sustainability_compliance.ci")
         if match:
             sustainability["ci_limit"] = match.group(1).strip()
         
         # Certification
-        cert_pattern = r'Certification[\s:]+([^\n]+)'
-        match = re.search(cert_pattern, text, re.IGNORECASE)
+        match = fields.search("sustainability_compliance.cert")
         if match:
             sustainability["certification"] = match.group(1).strip()
         
         # Audit required
-        if re.search(r'Third[■\-\s]*party audit required', text, re.IGNORECASE):
+        if fields.search("sustainability_compliance.audit_required"):
             sustainability["audit_required"] = True
         
         # Auditor signature
-        if re.search(r'auditor signature.*?on[■\-\s]*chain', text, re.IGNORECASE):
+        if fields.search("sustainability_compliance.auditor_signature"):
             sustainability["auditor_signature"] = "anchored on-chain"
         
         return sustainability
     
-    def _extract_commencement(self, text: str) -> Dict[str, Any]:
+    def _extract_commencement(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract commencement information"""
         commencement = {
             "commencement_rule": None,
@@ -312,14 +276,12 @@ class PPAOCRService:
         }
         
         # Commencement rule
-        rule_pattern = r'Commencement Rule[\s:]+([^\n]+)'
-        match = re.search(rule_pattern, text, re.IGNORECASE)
+        match = fields.search("commencement.rule")
         if match:
             commencement["commencement_rule"] = match.group(1).strip()
         
         # Long-stop date
-        long_stop_pattern = r'Long[■\-\s]*Stop Date[\s:]+(\d{4}[■\-]\d{2}[■\-]\d{2})'
-        match = re.search(long_stop_pattern, text, re.IGNORECASE)
+        match = fields.search("commencement.long_stop")
         if match:
             commencement["long_stop_date"] = match.group(1).replace('■', '-')
         
@@ -357,35 +319,15 @@ INSTRUCTIONS:
 
 Return ONLY the corrected JSON, no explanations."""
 
+        generation_config = {
+            "maxOutputTokens": 4096,
+            "temperature": 0.1
+        }
+        
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                headers = {
-                    "X-goog-api-key": self.llm_api_key,
-                    "Content-Type": "application/json"
-                }
-                
-                payload = {
-                    "contents": [{
-                        "parts": [{"text": prompt}]
-                    }],
-                    "generationConfig": {
-                        "maxOutputTokens": 4096,
-                        "temperature": 0.1
-                    }
-                }
-                
-                response = await client.post(self.llm_api_url, headers=headers, json=payload)
-                response.raise_for_status()
-                result = response.json()
-                
-                llm_text = result['candidates'][0]['content']['parts'][0]['text'].strip()
-                if llm_text.startswith('```'):
-                    llm_text = re.sub(r'^```json\s*\n', '', llm_text)
-                    llm_text = re.sub(r'^```\s*\n', '', llm_text)
-                    llm_text = re.sub(r'\n```\s*$', '', llm_text)
-                
-                refined_data = json.loads(llm_text)
-                return refined_data
+            return await get_llm_client().generate_json(
+                self.llm_api_url, self.llm_api_key, self.llm_model, prompt, generation_config
+            )
         except Exception as e:
             print(f"Error in LLM refinement: {str(e)}")
             raise
\ No newline at end of file
@@ -0,0 +1,82 @@
+from typing import Dict, Any, Optional, List, Tuple
+
+from ocr_services.confidence import score_extraction
+from ocr_services.field_gap import find_missing_fields, refine_missing_fields
+from ocr_services.metrics import stage
+from ocr_services.word_boxes import WordBoxes
+
+
+def _field_section_spans(service, fields: List[str], text: str) -> Optional[Dict[str, List[Tuple[int, int]]]]:
+    """Section spans of each field for services that segment their documents (PPA, term sheet)"""
+    registry = getattr(service, 'field_specs', None)
+    if registry is None or registry.segmenter is None:
+        return None
+    sections = registry.segmenter.segment(text)
+    return {path: registry.section_spans(sections, path.split('.')[0]) for path in fields}
+
+
+async def refine_extraction(
+    service,
+    document_name: str,
+    extracted_data: Dict[str, Any],
+    processing_text: str,
+    bounding_boxes: Optional[WordBoxes] = None
+) -> Dict[str, Any]:
+    """
+    Decide whether a regex extraction needs the LLM and apply the configured refinement mode.
+
+    The result reports the path taken in "extraction_path":
+    - "regex": LLM refinement disabled
+    - "regex_bypass": the extraction cleared the completeness/confidence thresholds (never when the
+      extraction budget ran out: the fields in "extraction_skipped" were not searched, so they go to the LLM)
+    - "llm_field_gap" / "llm_full": refined by the LLM
+    - "regex_fallback": the LLM call failed, regex extraction returned
+    """
+    quality = score_extraction(extracted_data, service.field_anchors, bounding_boxes)
+    extracted_data["extraction_quality"] = quality
+    if bounding_boxes is not None:
+        # Memory held by the OCR word boxes of this document
+        extracted_data["ocr_memory_bytes"] = bounding_boxes.nbytes
+
+    if not (service.use_llm_refinement and service.llm_api_key):
+        extracted_data["llm_refined"] = False
+        extracted_data["extraction_path"] = "regex"
+        return extracted_data
+
+    if (not extracted_data.get("extraction_skipped")
+            and quality["completeness"] >= service.llm_bypass_min_completeness
+            and quality["confidence"] >= service.llm_bypass_min_confidence):
+        extracted_data["llm_refined"] = False
+        extracted_data["extraction_path"] = "regex_bypass"
+        return extracted_data
+
+    try:
+        if service.llm_refinement_mode == 'field_gap':
+            fields = find_missing_fields(
+                extracted_data, service.field_anchors, quality["fields"], service.llm_field_min_confidence
+            )
+            with stage("llm"):
+                refined_data, refined_fields = await refine_missing_fields(
+                    document_name, extracted_data, processing_text, service.field_anchors,
+                    service.llm_api_url, service.llm_api_key, service.llm_model, fields=fields,
+                    field_spans=_field_section_spans(service, fields, processing_text)
+                )
+            refined_data["llm_refined"] = bool(refined_fields)
+            refined_data["llm_refined_fields"] = refined_fields
+            refined_data["extraction_path"] = "llm_field_gap"
+            return refined_data
+
+        with stage("llm"):
+            refined_data = await service._refine_with_llm(extracted_data, processing_text)
+        refined_data["raw_text"] = extracted_data["raw_text"]
+        refined_data["structured_text"] = extracted_data["structured_text"]
+        refined_data["extraction_quality"] = quality
+        refined_data["llm_refined"] = True
+        refined_data["extraction_path"] = "llm_full"
+        return refined_data
+    except Exception as e:
+        print(f"LLM refinement failed: {e}")
+        extracted_data["llm_refined"] = False
+        extracted_data["llm_error"] = str(e)
+        extracted_data["extraction_path"] = "regex_fallback"
+        return extracted_data
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+_code_digest: Optional[str] = None
+
+
+def extraction_code_digest() -> str:
+    """
+    Digest of the ocr_services sources, computed once per process. Part of the cache key, so
+    results cached by a previous release are not served when an extractor changed without a
+    version bump.
+    """
+    global _code_digest
+    if _code_digest is None:
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(package_dir)):
+            if name.endswith('.py'):
+                with open(os.path.join(package_dir, name), 'rb') as f:
+                    digest.update(name.encode('utf-8') + b'\0' + f.read())
+        _code_digest = digest.hexdigest()[:12]
+    return _code_digest
+
+
+class ExtractionCache:
+    """
+    Content-addressed cache of extraction results.
+    Entries live in an in-memory LRU tier backed by an on-disk tier with size-based eviction.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        memory_entries: Optional[int] = None,
+        disk_max_bytes: Optional[int] = None,
+        enabled: Optional[bool] = None
+    ):
+        """Initialize the cache from OCR_CACHE_* environment settings"""
+        self.enabled = enabled if enabled is not None else os.getenv('OCR_CACHE_ENABLED', 'true').lower() == 'true'
+        self.cache_dir = cache_dir or os.getenv('OCR_CACHE_DIR', 'ocr_cache')
+        self.memory_entries = memory_entries or int(os.getenv('OCR_CACHE_MEMORY_ENTRIES', '128'))
+        self.disk_max_bytes = disk_max_bytes or int(os.getenv('OCR_CACHE_DISK_MAX_MB', '512')) * 1024 * 1024
+
+        # Values are stored as JSON strings so callers can never mutate a cached result
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        self._hits = {"memory": 0, "disk": 0}
+        self._misses = 0
+
+        if self.enabled:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._disk_bytes = sum(entry.stat().st_size for entry in self._disk_entries())
+
+    @staticmethod
+    def make_key(content: bytes, doc_type: str, extractor_version: str) -> str:
+        """Build the cache key from the document hash, document type and extractor version"""
+        digest = hashlib.sha256(content).hexdigest()
+        return f"{doc_type}-{extractor_version}-{digest}"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a cached result, promoting disk hits into the memory tier"""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            payload = self._memory.get(key)
+            if payload is not None:
+                self._memory.move_to_end(key)
+                self._hits["memory"] += 1
+                return json.loads(payload)
+
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                payload = f.read()
+            # Refresh mtime so disk eviction removes the least recently used entries first
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._misses += 1
+            return None
+
+        with self._lock:
+            self._hits["disk"] += 1
+            self._remember(key, payload)
+        return json.loads(payload)
+
+    def put(self, key: str, value: Dict[str, Any]):
+        """Store a result in both tiers"""
+        if not self.enabled:
+            return
+
+        payload = json.dumps(value)
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing extraction cache entry: {e}")
+            return
+
+        with self._lock:
+            self._remember(key, payload)
+            self._disk_bytes += len(payload.encode('utf-8')) - previous_size
+            if self._disk_bytes > self.disk_max_bytes:
+                self._evict_disk()
+
+    def stats(self) -> Dict[str, Any]:
+        """Report hit rates and tier sizes"""
+        return {
+            "enabled": self.enabled,
+            "memory_entries": len(self._memory),
+            "memory_max_entries": self.memory_entries,
+            "disk_bytes": self._disk_bytes,
+            "disk_max_bytes": self.disk_max_bytes,
+            "hits": dict(self._hits),
+            "misses": self._misses
+        }
+
+    def _remember(self, key: str, payload: str):
+        """Insert into the memory tier, dropping the least recently used entry when full"""
+        self._memory[key] = payload
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _disk_entries(self):
+        return [entry for entry in os.scandir(self.cache_dir) if entry.is_file() and entry.name.endswith('.json')]
+
+    def _evict_disk(self):
+        """Delete the oldest disk entries until the tier is back under its size limit"""
+        entries = sorted(self._disk_entries(), key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self._disk_bytes <= self.disk_max_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self._disk_bytes -= size
+            except OSError:
+                continue
+
+
+_extraction_cache: Optional[ExtractionCache] = None
+
+
+def get_extraction_cache() -> ExtractionCache:
+    """Return the process-wide extraction cache"""
+    global _extraction_cache
+    if _extraction_cache is None:
+        _extraction_cache = ExtractionCache()
+    return _extraction_cache
@@ -0,0 +1,174 @@
+import io
+import os
+import re
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+import PyPDF2
+
+from ocr_services.confidence import score_extraction
+from ocr_services.field_gap import get_field, set_field
+from ocr_services.ocr_executor import get_ocr_executor
+from ocr_services.ocr_profiles import get_ocr_profiles
+from ocr_services.page_router import pdf_page_sizes
+from ocr_services.spatial_index import KeyValueEngine, MAX_VALUE_GAP_RATIO, page_fractions
+from ocr_services.word_boxes import WordBoxes
+
+
+def roi_settings() -> Dict[str, Any]:
+    """Region re-OCR settings, from OCR_ROI_DPI and OCR_ROI_MIN_CONFIDENCE"""
+    return {
+        "dpi": int(os.getenv('OCR_ROI_DPI', '400')),
+        "min_confidence": float(os.getenv('OCR_ROI_MIN_CONFIDENCE', '0.8'))
+    }
+
+
+def _field_labels(service) -> Dict[str, str]:
+    """Spatial label of each field (the service's spatial_field_labels, else the label its field anchor matches)"""
+    labels = dict(getattr(service, "spatial_field_labels", {}))
+    for path, anchor in service.field_anchors.items():
+        if path in labels:
+            continue
+        for label in service.spatial_labels:
+            if re.match(anchor, label, re.IGNORECASE):
+                labels[path] = label
+                break
+    return labels
+
+
+def _value_region(
+    engine: KeyValueEngine,
+    label: str,
+    sizes: List[Tuple[float, float]]
+) -> Optional[Tuple[int, Tuple[float, float, float, float]]]:
+    """Page and pixel region of a label's value; the rest of the label's line when no value was read"""
+    index = engine.index
+    found = engine.value_run(label)
+    if found is not None:
+        run = found[1]
+        page = int(index.page[run[0]])
+        return (page, engine.value_region(run, *sizes[page])) if page < len(sizes) else None
+
+    occurrences = engine.find_label(label)
+    if not occurrences:
+        return None
+    last = occurrences[0][-1]
+    page = int(index.page[last])
+    if page >= len(sizes):
+        return None
+    height = index.word_height
+    page_width, page_height = sizes[page]
+    return page, (
+        index.right[last] + height / 4,
+        max(index.top[last] - height / 2, 0.0),
+        min(index.right[last] + MAX_VALUE_GAP_RATIO * height, page_width),
+        min(index.bottom[last] + height / 2, page_height)
+    )
+
+
+def _rescale(boxes: WordBoxes, scale: float) -> WordBoxes:
+    """Word boxes of one rendering resolution in the pixel coordinates of another"""
+    return WordBoxes.from_words(
+        boxes.words(),
+        boxes.left * scale,
+        boxes.top * scale,
+        boxes.width * scale,
+        boxes.height * scale,
+        boxes.confidence,
+        boxes.page
+    )
+
+
+def _inside(boxes: WordBoxes, page: int, region: Tuple[float, float, float, float]) -> np.ndarray:
+    """Mask of the words whose center lies in the region"""
+    x0, y0, x1, y1 = region
+    center_x = boxes.left + boxes.width / 2
+    center_y = boxes.top + boxes.height / 2
+    return (boxes.page == page) & (center_x >= x0) & (center_x <= x1) & (center_y >= y0) & (center_y <= y1)
+
+
+async def reocr_weak_fields(
+    service,
+    doc_type: str,
+    content: bytes,
+    extracted_data: Dict[str, Any],
+    boxes: WordBoxes
+) -> Tuple[List[str], WordBoxes]:
+    """
+    Re-read missing and low-confidence fields from their value regions at OCR_ROI_DPI.
+    Each region is OCR'd with the document type's region profile: by default a single line, with a
+    digit/unit whitelist for labels in service.numeric_labels.
+    A re-read value replaces the first-pass one when it is more confident (OCR_ROI_MIN_CONFIDENCE sets
+    which fields are re-read). Returns the replaced field paths and the word boxes with the re-read
+    regions swapped in, so confidence scoring sees the new words.
+    """
+    settings = roi_settings()
+    min_confidence, roi_dpi = settings["min_confidence"], settings["dpi"]
+
+    field_confidence = score_extraction(extracted_data, service.field_anchors, boxes)["fields"]
+    engine = KeyValueEngine(boxes, service.spatial_labels)
+    # A partly misread value (e.g. '1O0O t' read as 1) maps to no single word; the words next to its label tell
+    label_confidence = {}
+    for label in service.spatial_labels:
+        resolved = engine.resolve(label)
+        label_confidence[label] = resolved["confidence"] if resolved is not None else 0.0
+    weak = {
+        path: label for path, label in _field_labels(service).items()
+        if min(field_confidence[path], label_confidence[label]) < min_confidence
+    }
+    if not weak:
+        return [], boxes
+
+    executor = get_ocr_executor()
+    try:
+        sizes = [
+            (width * executor.dpi / 72, height * executor.dpi / 72)
+            for width, height in pdf_page_sizes(PyPDF2.PdfReader(io.BytesIO(content)))
+        ]
+    except Exception as e:
+        print(f"Error reading page sizes for region re-OCR: {e}")
+        return [], boxes
+
+    regions = {}
+    for label in dict.fromkeys(weak.values()):
+        region = _value_region(engine, label, sizes)
+        if region is not None:
+            regions[label] = region
+    if not regions:
+        return [], boxes
+
+    page_regions: Dict[int, Dict[str, List[float]]] = {}
+    for label, (page, region) in regions.items():
+        page_regions.setdefault(page, {})[label] = page_fractions(region, *sizes[page])
+    profiles = get_ocr_profiles()
+    region_profiles = {
+        label: profiles.region_profile(doc_type, label, label in service.numeric_labels) for label in regions
+    }
+    try:
+        results = await executor.ocr_pdf_regions(content, page_regions, roi_dpi, region_profiles)
+    except Exception as e:
+        print(f"Error re-OCR'ing field regions: {e}")
+        return [], boxes
+
+    region_boxes = {label: _rescale(result, executor.dpi / roi_dpi) for label, result in results.items()}
+    text = "".join(f"{label}: {' '.join(result.words())}\n" for label, result in region_boxes.items() if len(result))
+    roi_data = service._extract_fields(text)
+    roi_confidence = score_extraction(
+        roi_data, service.field_anchors, WordBoxes.concat(list(region_boxes.values()))
+    )["fields"]
+
+    replaced = []
+    for path, label in weak.items():
+        value = get_field(roi_data, path)
+        first_confidence = min(field_confidence[path], label_confidence[label])
+        if label in regions and value is not None and roi_confidence[path] > first_confidence:
+            set_field(extracted_data, path, value)
+            replaced.append(path)
+    if not replaced:
+        return [], boxes
+
+    used = list(dict.fromkeys(weak[path] for path in replaced))
+    keep = np.ones(len(boxes), dtype=bool)
+    for label in used:
+        keep &= ~_inside(boxes, *regions[label])
+    return replaced, WordBoxes.concat([boxes.select(keep)] + [region_boxes[label] for label in used])
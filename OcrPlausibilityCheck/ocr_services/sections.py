@@ -0,0 +1,65 @@
+import bisect
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def _heading_pattern(heading: str) -> str:
+    """Regex for a heading title; tolerates OCR'd separators (■, -) between words and '&' vs 'and'"""
+    words = []
+    for word in heading.split():
+        words.append(r'(?:&|and)' if word in ('&', 'and') else re.escape(word))
+    return r'[\s■\-]+'.join(words)
+
+
+class SectionIndex:
+    """Character spans of the headed sections of one document"""
+
+    def __init__(self, spans: Dict[str, List[Tuple[int, int]]]):
+        self.spans = spans
+
+    def spans_for(self, sections: Iterable[str]) -> List[Tuple[int, int]]:
+        """Spans of the given sections that occur in the document, in text order"""
+        return sorted(span for section in sections for span in self.spans.get(section, []))
+
+    def to_dict(self) -> Dict[str, List[List[int]]]:
+        return {section: [list(span) for span in spans] for section, spans in self.spans.items()}
+
+
+class SectionSegmenter:
+    """
+    Splits a document into sections at heading lines, in a single pass.
+    A heading is a line that consists only of one of the section's titles (optionally numbered,
+    optionally followed by a colon), so labels such as 'Pricing: Fixed' are not headings.
+    A section runs from the end of its heading line to the start of the next heading.
+    """
+
+    def __init__(self, headings: Dict[str, List[str]]):
+        self.sections = list(headings)
+        alternatives = []
+        for index, titles in enumerate(headings.values()):
+            alternatives.append(f"(?P<s{index}>" + "|".join(_heading_pattern(title) for title in titles) + ")")
+        self._pattern = re.compile(
+            r'^[ \t]*(?:(?:section[ \t]+)?[0-9IVX]+[.)]?[ \t]+)?(?:' + "|".join(alternatives) + r')[ \t]*:?[ \t]*$',
+            re.IGNORECASE | re.MULTILINE
+        )
+
+    def segment(self, text: str) -> SectionIndex:
+        """Index the section spans of the text"""
+        headings = []
+        for match in self._pattern.finditer(text):
+            section = self.sections[int(match.lastgroup[1:])]
+            headings.append((match.start(), match.end(), section))
+
+        spans: Dict[str, List[Tuple[int, int]]] = {}
+        for i, (_, body_start, section) in enumerate(headings):
+            end = headings[i + 1][0] if i + 1 < len(headings) else len(text)
+            spans.setdefault(section, []).append((body_start, end))
+        return SectionIndex(spans)
+
+
+def span_containing(spans: List[Tuple[int, int]], position: int) -> Optional[Tuple[int, int]]:
+    """Return the span (sorted, non-overlapping) that contains the position, or None"""
+    index = bisect.bisect_right(spans, (position, float('inf'))) - 1
+    if index >= 0 and spans[index][0] <= position < spans[index][1]:
+        return spans[index]
+    return None
@@ -0,0 +1,95 @@
+import asyncio
+import copy
+import os
+from typing import Dict, Any, Optional, Callable, Awaitable
+
+
+class _Flight:
+    """One in-flight computation and the number of callers awaiting it"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one computation.
+    The first caller starts the computation as a task; callers arriving while it runs await the
+    same task. Every caller gets its own copy of the result (or the exception). A caller that is
+    cancelled only stops waiting; the computation is cancelled once no caller is left waiting for it.
+    """
+
+    def __init__(self, enabled: Optional[bool] = None):
+        """Initialize from the OCR_SINGLE_FLIGHT environment setting"""
+        self.enabled = enabled if enabled is not None else os.getenv('OCR_SINGLE_FLIGHT', 'true').lower() == 'true'
+        self._flights: Dict[str, _Flight] = {}
+        self._started = 0
+        self._coalesced = 0
+        self._cancelled = 0
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> tuple[Any, bool]:
+        """
+        Run func() for the key, or join the run already in flight.
+        Returns the result and whether it was shared from another caller's run.
+        """
+        if not self.enabled:
+            return await func(), False
+
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(func()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda task: self._finish(key, flight))
+            self._started += 1
+        else:
+            self._coalesced += 1
+
+        flight.waiters += 1
+        try:
+            # Shielded, so one caller's cancellation doesn't cancel the run the others await
+            result = await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if not flight.task.done() and flight.waiters == 1:
+                # Callers arriving while the run winds down start a fresh one instead of joining it
+                self._forget(key, flight)
+                flight.task.cancel()
+                self._cancelled += 1
+            raise
+        finally:
+            flight.waiters -= 1
+
+        # Callers must not see each other's changes to the result
+        return copy.deepcopy(result), shared
+
+    def _forget(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def _finish(self, key: str, flight: _Flight):
+        """Forget a finished run, so later calls start a fresh one"""
+        self._forget(key, flight)
+        # Retrieve the exception of a run nobody awaits any more, so asyncio doesn't log it as unhandled
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._flights),
+            "started": self._started,
+            "coalesced": self._coalesced,
+            "cancelled": self._cancelled
+        }
+
+
+_single_flight: Optional[SingleFlight] = None
+
+
+def get_single_flight() -> SingleFlight:
+    """Return the process-wide single-flight group for extractions"""
+    global _single_flight
+    if _single_flight is None:
+        _single_flight = SingleFlight()
+    return _single_flight
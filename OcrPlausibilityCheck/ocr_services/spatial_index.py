@@ -0,0 +1,271 @@
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from ocr_services.field_gap import get_field, set_field
+from ocr_services.layout import COLUMN_GAP_RATIO
+from ocr_services.word_boxes import WordBoxes
+
+
+# Grid cell size relative to the median word height
+CELL_RATIO = 4.0
+# How far right of a label (in word heights) its value may start, e.g. across a table gutter
+MAX_VALUE_GAP_RATIO = 15.0
+# How far below a label (in word heights) a value line is looked for
+MAX_BELOW_RATIO = 2.5
+# A value region reaches this many word heights right of the value, so longer values still fit
+REGION_PAD_RATIO = 12.0
+
+# The spatial layout separates columns with '  |  '; a regex value containing it ran into the next column
+COLUMN_MARKER = "|"
+
+
+def _normalize(word: str) -> str:
+    return word.lower().strip(':.').replace('■', '-')
+
+
+# Bits per grid coordinate in the packed (page, column, row) cell key
+_CELL_BITS = 20
+
+
+class SpatialIndex:
+    """
+    Uniform grid over OCR word boxes, per page.
+    Words are sorted by packed cell key; a rectangle query binary-searches the cells it overlaps,
+    so a lookup costs O(cells * log n) plus the nearby words instead of a scan over the document.
+    """
+
+    def __init__(self, boxes: WordBoxes, cell_ratio: float = CELL_RATIO):
+        self.boxes = boxes
+        self.left = boxes.left.astype(np.float64)
+        self.top = boxes.top.astype(np.float64)
+        self.right = self.left + boxes.width
+        self.bottom = self.top + boxes.height
+        self.page = boxes.page
+        self.word_height = float(max(np.median(boxes.height), 1.0)) if len(boxes) else 1.0
+        self.cell_size = self.word_height * cell_ratio
+
+        # Each word is registered in the cell of its top-left corner; queries widen their
+        # rectangle by the largest box so words reaching in from neighbouring cells are found
+        self.max_width = float(boxes.width.max()) if len(boxes) else 0.0
+        self.max_height = float(boxes.height.max()) if len(boxes) else 0.0
+        keys = self._cell_key(
+            self.page.astype(np.int64),
+            (self.left // self.cell_size).astype(np.int64),
+            (self.top // self.cell_size).astype(np.int64)
+        )
+        self.order = np.argsort(keys, kind='stable')
+        self.sorted_keys = keys[self.order]
+
+    @staticmethod
+    def _cell_key(page, column, row):
+        limit = (1 << _CELL_BITS) - 1
+        return (page << (2 * _CELL_BITS)) | (np.clip(column, 0, limit) << _CELL_BITS) | np.clip(row, 0, limit)
+
+    def query(self, page: int, x0: float, y0: float, x1: float, y1: float) -> np.ndarray:
+        """Indices of the words on the page whose boxes intersect the rectangle"""
+        first_column = max(int((x0 - self.max_width) // self.cell_size), 0)
+        last_column = max(int(x1 // self.cell_size), 0)
+        first_row = max(int((y0 - self.max_height) // self.cell_size), 0)
+        last_row = max(int(y1 // self.cell_size), 0)
+        parts = []
+        for column in range(first_column, last_column + 1):
+            # Rows of one column are contiguous in key order
+            low = self._cell_key(int(page), column, first_row)
+            high = self._cell_key(int(page), column, last_row)
+            start = np.searchsorted(self.sorted_keys, low, side='left')
+            end = np.searchsorted(self.sorted_keys, high, side='right')
+            if end > start:
+                parts.append(self.order[start:end])
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        indices = np.concatenate(parts)
+        inside = (
+            (self.left[indices] <= x1) & (self.right[indices] >= x0)
+            & (self.top[indices] <= y1) & (self.bottom[indices] >= y0)
+        )
+        return np.sort(indices[inside])
+
+
+class KeyValueEngine:
+    """
+    Resolves label values from word geometry: the nearest token run to the right of a label on
+    the same line, or else the run on the next line below it. Runs end at column gaps, so
+    two-column tables and header-above-value tables resolve like plain 'Label: value' lines.
+    Runs also end where another of the labels starts (e.g. the next header of a table row).
+    """
+
+    def __init__(self, boxes: WordBoxes, labels: List[str]):
+        self.index = SpatialIndex(boxes)
+        self.words = boxes.words()
+        self.confidence = boxes.confidence
+        self.labels = labels
+        # Same as _normalize per word, but lowercased in one pass
+        self.normalized = [
+            word.strip(':.') for word in "\n".join(self.words).lower().replace('■', '-').split("\n")
+        ]
+        # Only the first words of the labels are ever looked up
+        first_tokens = {_normalize(label.split()[0]) for label in labels}
+        self._by_word: Dict[str, List[int]] = {}
+        for i, word in enumerate(self.normalized):
+            if word in first_tokens:
+                self._by_word.setdefault(word, []).append(i)
+        self._occurrences = {label: self.find_label(label) for label in labels}
+        self._label_starts = {words[0] for occurrences in self._occurrences.values() for words in occurrences}
+
+    def find_label(self, label: str) -> List[List[int]]:
+        """Word indices of each occurrence of a (multi-word) label, in reading order"""
+        tokens = [_normalize(token) for token in label.split()]
+        index = self.index
+        occurrences = []
+        for first in self._by_word.get(tokens[0], []):
+            # OCR emits the words of a line in reading order, so the rest of the label follows directly
+            words = list(range(first, first + len(tokens)))
+            if words[-1] >= len(self.words):
+                continue
+            if all(
+                self.normalized[i] == token
+                and index.page[i] == index.page[first]
+                and index.left[i] > index.left[i - 1]
+                and index.top[i] < index.bottom[i - 1] and index.bottom[i] > index.top[i - 1]
+                for i, token in zip(words[1:], tokens[1:])
+            ):
+                occurrences.append(words)
+        return occurrences
+
+    def _run(self, candidates: List[int], start_x: float, max_first_gap: float) -> List[int]:
+        """Left-to-right token run from start_x that ends at the first column gap"""
+        index = self.index
+        candidates = sorted(candidates, key=lambda i: index.left[i])
+        run = []
+        edge = start_x
+        for i in candidates:
+            if i in self._label_starts:
+                break
+            gap = index.left[i] - edge
+            if gap > (max_first_gap if not run else COLUMN_GAP_RATIO * index.word_height):
+                break
+            run.append(i)
+            edge = max(edge, index.right[i])
+        # A lone ':' between label and value is not part of the value
+        while run and self.words[run[0]] == ':':
+            run.pop(0)
+        return run
+
+    def value_right_of(self, label_words: List[int]) -> List[int]:
+        index = self.index
+        last = label_words[-1]
+        page, top, bottom, right = index.page[last], index.top[last], index.bottom[last], index.right[last]
+        max_gap = MAX_VALUE_GAP_RATIO * index.word_height
+        center = (top + bottom) / 2
+        candidates = [
+            i for i in index.query(page, right + 1, top, right + max_gap + 50 * index.word_height, bottom).tolist()
+            if index.top[i] <= center <= index.bottom[i] and index.left[i] >= right
+        ]
+        return self._run(candidates, right, max_gap)
+
+    def value_below(self, label_words: List[int]) -> List[int]:
+        index = self.index
+        first, last = label_words[0], label_words[-1]
+        page, left, right = index.page[first], index.left[first], index.right[last]
+        bottom = max(index.bottom[i] for i in label_words)
+        height = index.word_height
+        candidates = index.query(page, left - height, bottom + 1, right + height, bottom + MAX_BELOW_RATIO * height)
+        candidates = [i for i in candidates.tolist() if index.top[i] > bottom - height / 4]
+        if not candidates:
+            return []
+
+        # Only the nearest line below, starting at the word under the label
+        line_top = min(index.top[i] for i in candidates)
+        start = min((i for i in candidates if index.top[i] - line_top <= height / 2), key=lambda i: index.left[i])
+        line = index.query(page, index.left[start], line_top, index.left[start] + 50 * height, line_top + height / 2)
+        return self._run(line.tolist(), index.left[start], 0.0)
+
+    def value_run(self, label: str) -> Optional[Tuple[str, List[int]]]:
+        """Direction and word indices of the value of the first occurrence of the label that has one"""
+        for label_words in self._occurrences.get(label) or self.find_label(label):
+            for direction, lookup in (("right", self.value_right_of), ("below", self.value_below)):
+                run = lookup(label_words)
+                if run:
+                    return direction, run
+        return None
+
+    def resolve(self, label: str) -> Optional[Dict[str, Any]]:
+        """Value of the first occurrence of the label that has one (right of it first, then below)"""
+        found = self.value_run(label)
+        if found is None:
+            return None
+        direction, run = found
+        return {
+            "label": label,
+            "value": " ".join(self.words[i] for i in run),
+            "direction": direction,
+            "confidence": round(max(float(self.confidence[run].min()), 0.0) / 100, 3)
+        }
+
+    def value_region(
+        self,
+        run: List[int],
+        page_width: float,
+        page_height: float
+    ) -> Tuple[float, float, float, float]:
+        """
+        Pixel region (x0, y0, x1, y1) around a value run, padded by half a word height and grown
+        to the right up to the next word on the line (the next column) or by REGION_PAD_RATIO.
+        """
+        index = self.index
+        height = index.word_height
+        page = index.page[run[0]]
+        x0 = min(index.left[i] for i in run)
+        x1 = max(index.right[i] for i in run)
+        y0 = min(index.top[i] for i in run)
+        y1 = max(index.bottom[i] for i in run)
+
+        reach = x1 + REGION_PAD_RATIO * height
+        following = [i for i in index.query(page, x1 + 1, y0, reach, y1).tolist() if i not in run]
+        if following:
+            reach = min(index.left[i] for i in following) - height / 4
+        return (
+            max(x0 - height / 2, 0.0),
+            max(y0 - height / 2, 0.0),
+            min(max(x1, reach), page_width),
+            min(y1 + height / 2, page_height)
+        )
+
+    def key_value_text(self) -> str:
+        """Render the resolved labels as 'Label: value' lines"""
+        lines = []
+        for label in self.labels:
+            resolved = self.resolve(label)
+            if resolved is not None:
+                lines.append(f"{label}: {resolved['value']}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+def page_fractions(region: Tuple[float, float, float, float], page_width: float, page_height: float) -> List[float]:
+    """Express a pixel region as fractions of the page size (independent of the rendering DPI)"""
+    x0, y0, x1, y1 = (float(value) for value in region)
+    return [round(x0 / page_width, 4), round(y0 / page_height, 4), round(x1 / page_width, 4), round(y1 / page_height, 4)]
+
+
+def fill_from_layout(service, extracted_data: Dict[str, Any], boxes: WordBoxes) -> List[str]:
+    """
+    Re-run the service's regex extractors over label/value pairs resolved from OCR geometry and
+    fill the fields the text pass missed or let run into a neighbouring column.
+    Returns the filled field paths.
+    """
+    kv_text = KeyValueEngine(boxes, service.spatial_labels).key_value_text()
+    if not kv_text:
+        return []
+
+    layout_data = service._extract_fields(kv_text)
+    filled = []
+    for path in service.field_anchors:
+        value = get_field(layout_data, path)
+        if value is None:
+            continue
+        current = get_field(extracted_data, path)
+        if current is None or (isinstance(current, str) and COLUMN_MARKER in current):
+            set_field(extracted_data, path, value)
+            filled.append(path)
+    return filled
@@ -0,0 +1,343 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+import PyPDF2
+
+from ocr_services.field_gap import get_field
+from ocr_services.metrics import stage
+from ocr_services.ocr_executor import get_ocr_executor
+from ocr_services.ocr_profiles import get_ocr_profiles
+from ocr_services.page_router import _page_has_fonts, _text_layer_is_usable, pdf_page_sizes
+from ocr_services.spatial_index import KeyValueEngine, page_fractions
+from ocr_services.word_boxes import WordBoxes
+
+
+# Part of the first page (from the top) whose static words make up the layout fingerprint
+HEADER_FRACTION = 0.35
+# Fingerprint word positions are quantized to a grid of this many cells per page side
+FINGERPRINT_GRID = 40
+
+
+def layout_fingerprint(boxes: WordBoxes, page_width: float, page_height: float) -> List[List[Any]]:
+    """
+    Fingerprint a document layout from the static header words of its first page.
+    Words with digits or punctuation (ids, dates, amounts) vary per document and are left out;
+    the rest are kept with their position quantized relative to the page size, so the
+    fingerprint does not depend on the rendering DPI.
+    Returns sorted [word, column, row] entries.
+    """
+    entries = set()
+    for word, left, top, page in zip(boxes.words(), boxes.left.tolist(), boxes.top.tolist(), boxes.page.tolist()):
+        if page != 0 or top > HEADER_FRACTION * page_height:
+            continue
+        word = word.lower()
+        if len(word) < 3 or not word.isalpha():
+            continue
+        entries.add((word, int(left / page_width * FINGERPRINT_GRID), int(top / page_height * FINGERPRINT_GRID)))
+    return [list(entry) for entry in sorted(entries)]
+
+
+def fingerprint_similarity(a: List[List[Any]], b: List[List[Any]]) -> float:
+    """Share of fingerprint words found at (about) the same position in both fingerprints"""
+    if not a or not b:
+        return 0.0
+    cells = {tuple(entry) for entry in b}
+    matched = 0
+    for word, column, row in a:
+        # OCR jitter can move a word into a neighbouring cell
+        if any((word, column + dx, row + dy) in cells for dx in (-1, 0, 1) for dy in (-1, 0, 1)):
+            matched += 1
+    return matched / max(len(a), len(b))
+
+
+class TemplateStore:
+    """
+    Learned layouts of known issuers, as one JSON file per template.
+    A template holds the layout fingerprint and, per spatial label, the page region its value was
+    found in (as fractions of the page size).
+    """
+
+    def __init__(
+        self,
+        template_dir: Optional[str] = None,
+        min_similarity: Optional[float] = None,
+        enabled: Optional[bool] = None
+    ):
+        """Initialize the store from OCR_TEMPLATE* environment settings"""
+        self.enabled = enabled if enabled is not None else os.getenv('OCR_TEMPLATES_ENABLED', 'true').lower() == 'true'
+        self.template_dir = template_dir or os.getenv('OCR_TEMPLATE_DIR', 'ocr_templates')
+        self.min_similarity = min_similarity or float(os.getenv('OCR_TEMPLATE_MIN_SIMILARITY', '0.8'))
+        self.fingerprint_dpi = int(os.getenv('OCR_TEMPLATE_FINGERPRINT_DPI', '100'))
+        self.region_dpi = int(os.getenv('OCR_TEMPLATE_REGION_DPI', '300'))
+
+        self._templates: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+        if self.enabled:
+            os.makedirs(self.template_dir, exist_ok=True)
+            self._load()
+
+    def _load(self):
+        for name in sorted(os.listdir(self.template_dir)):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.template_dir, name), 'r', encoding='utf-8') as f:
+                    template = json.load(f)
+                self._templates[template["id"]] = template
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Skipping unreadable template {name}: {e}")
+
+    def has_templates(self, doc_type: str) -> bool:
+        if not self.enabled:
+            return False
+        with self._lock:
+            return any(template["doc_type"] == doc_type for template in self._templates.values())
+
+    def find(self, doc_type: str, fingerprint: List[List[Any]]) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Return the most similar template of the document type and its similarity, if it clears the threshold"""
+        with self._lock:
+            candidates = [template for template in self._templates.values() if template["doc_type"] == doc_type]
+        best, best_score = None, 0.0
+        for template in candidates:
+            score = fingerprint_similarity(fingerprint, template["fingerprint"])
+            if score > best_score:
+                best, best_score = template, score
+        if best is None or best_score < self.min_similarity:
+            return None
+        return best, best_score
+
+    def match(self, doc_type: str, fingerprint: List[List[Any]]) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Like find(), counting hits and misses"""
+        matched = self.find(doc_type, fingerprint)
+        with self._lock:
+            if matched is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        return matched
+
+    def version(self, doc_type: str) -> Optional[str]:
+        """Digest of the document type's templates (None without any); changes whenever one is learned or relearned"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            templates = sorted(
+                (template for template in self._templates.values() if template["doc_type"] == doc_type),
+                key=lambda template: template["id"]
+            )
+        if not templates:
+            return None
+        return hashlib.sha256(json.dumps(templates, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+    def save(self, template: Dict[str, Any]):
+        """Store a template, replacing one with the same id"""
+        path = os.path.join(self.template_dir, f"{template['id']}.json")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(template, f, indent=2)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._templates[template["id"]] = template
+
+    def list(self, doc_type: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Template summaries (without fingerprints)"""
+        with self._lock:
+            templates = list(self._templates.values())
+        return [
+            {
+                "id": template["id"],
+                "doc_type": template["doc_type"],
+                "header": template.get("header"),
+                "fields": sorted(template["fields"]),
+                "learned_from": template.get("learned_from"),
+                "learned_at": template.get("learned_at")
+            }
+            for template in templates
+            if doc_type is None or template["doc_type"] == doc_type
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "templates": len(self._templates),
+                "hits": self._hits,
+                "misses": self._misses
+            }
+
+
+_template_store: Optional[TemplateStore] = None
+
+
+def get_template_store() -> TemplateStore:
+    """Return the process-wide template store"""
+    global _template_store
+    if _template_store is None:
+        _template_store = TemplateStore()
+    return _template_store
+
+
+def _same_value(a: Any, b: Any) -> bool:
+    return str(a).strip().lower() == str(b).strip().lower()
+
+
+async def learn_template(
+    service,
+    doc_type: str,
+    content: bytes,
+    verified: Dict[str, Any],
+    filename: Optional[str] = None,
+    dpi: int = 200
+) -> Dict[str, Any]:
+    """
+    Learn (or extend) the template of a document's layout from a verified extraction.
+    The document is OCR'd in full; a label's value region is kept only if the regex extractors
+    read the verified values from it. Raises ValueError if nothing could be learned.
+    """
+    store = get_template_store()
+    if not store.enabled:
+        raise ValueError("Layout templates are disabled (OCR_TEMPLATES_ENABLED=false)")
+    page_sizes = await asyncio.to_thread(lambda: pdf_page_sizes(PyPDF2.PdfReader(io.BytesIO(content))))
+    sizes = [(width * dpi / 72, height * dpi / 72) for width, height in page_sizes]
+    if not sizes:
+        raise ValueError("Document has no pages")
+
+    ocr_pages = await get_ocr_executor().ocr_pdf_pages(content, None, dpi, get_ocr_profiles().for_doc_type(doc_type))
+    boxes = WordBoxes.concat([page_boxes for _, page_boxes in ocr_pages.values()])
+    fingerprint = layout_fingerprint(boxes, *sizes[0])
+    if not fingerprint:
+        raise ValueError("No header words found to fingerprint the layout")
+
+    engine = KeyValueEngine(boxes, service.spatial_labels)
+    fields = {}
+    for label in service.spatial_labels:
+        found = engine.value_run(label)
+        if found is None:
+            continue
+        _, run = found
+        layout_data = service._extract_fields(f"{label}: {' '.join(engine.words[i] for i in run)}\n")
+        paths = [
+            path for path in service.field_anchors
+            if get_field(layout_data, path) is not None and get_field(verified, path) is not None
+        ]
+        if not paths or not all(_same_value(get_field(layout_data, path), get_field(verified, path)) for path in paths):
+            continue
+        page = int(engine.index.page[run[0]])
+        fields[label] = {"page": page, "region": page_fractions(engine.value_region(run, *sizes[page]), *sizes[page])}
+    if not fields:
+        raise ValueError("None of the verified fields could be located in the document")
+
+    # Relearning a known layout extends its template instead of adding a second one
+    matched = store.find(doc_type, fingerprint)
+    if matched is not None:
+        template = dict(matched[0])
+        template["fields"] = {**template["fields"], **fields}
+    else:
+        digest = hashlib.sha256(json.dumps([doc_type, fingerprint]).encode('utf-8')).hexdigest()
+        template = {
+            "id": f"{doc_type}-{digest[:12]}",
+            "doc_type": doc_type,
+            "header": " ".join(entry[0] for entry in sorted(fingerprint, key=lambda entry: (entry[2], entry[1]))[:12]),
+            "fingerprint": fingerprint,
+            "fields": fields
+        }
+    template["learned_from"] = filename
+    template["learned_at"] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    store.save(template)
+    return template
+
+
+def _scanned_page_sizes(content: bytes) -> Optional[List[Tuple[float, float]]]:
+    """
+    Page sizes of a PDF whose first page needs OCR; None when the first page has a usable text layer.
+    Parses the PDF synchronously; call it from async code through asyncio.to_thread.
+    """
+    reader = PyPDF2.PdfReader(io.BytesIO(content))
+    first_page = reader.pages[0]
+    if _page_has_fonts(first_page) and _text_layer_is_usable(
+        first_page.extract_text() or "", int(os.getenv('OCR_PAGE_MIN_CHARS', '50'))
+    ):
+        return None
+    return pdf_page_sizes(reader)
+
+
+async def extract_with_template(
+    service,
+    doc_type: str,
+    content: bytes
+) -> Optional[Tuple[Dict[str, Any], str, WordBoxes]]:
+    """
+    Extract a scanned document of a known layout by OCR'ing only its learned field regions.
+    The first page is OCR'd at a low DPI to fingerprint the layout; on a template hit the learned
+    regions are OCR'd at OCR_TEMPLATE_REGION_DPI and read as 'Label: value' lines.
+    Returns (extracted_data, text, bounding_boxes), or None to fall back to the general pipeline
+    (no templates, text-layer first page, no matching template, or a learned field came back empty).
+    """
+    store = get_template_store()
+    if not store.has_templates(doc_type):
+        return None
+
+    try:
+        sizes = await asyncio.to_thread(_scanned_page_sizes, content)
+    except Exception as e:
+        print(f"Error reading PDF for template matching: {e}")
+        return None
+    # Digital PDFs are read from their text layer, which is cheaper than any OCR
+    if sizes is None:
+        return None
+
+    executor = get_ocr_executor()
+    with stage("template"):
+        try:
+            _, first_boxes = (await executor.ocr_pdf_pages(
+                content, [0], store.fingerprint_dpi, get_ocr_profiles().for_doc_type(doc_type)
+            ))[0]
+        except Exception as e:
+            print(f"Error fingerprinting layout: {e}")
+            return None
+        scale = store.fingerprint_dpi / 72
+        fingerprint = layout_fingerprint(first_boxes, sizes[0][0] * scale, sizes[0][1] * scale)
+        matched = store.match(doc_type, fingerprint)
+    if matched is None:
+        return None
+    template, similarity = matched
+
+    page_regions: Dict[int, Dict[str, List[float]]] = {}
+    for label, field in template["fields"].items():
+        if field["page"] < len(sizes):
+            page_regions.setdefault(field["page"], {})[label] = field["region"]
+    profiles = get_ocr_profiles()
+    region_profiles = {
+        label: profiles.region_profile(doc_type, label, label in service.numeric_labels) for label in template["fields"]
+    }
+    try:
+        regions = await executor.ocr_pdf_regions(content, page_regions, store.region_dpi, region_profiles)
+    except Exception as e:
+        print(f"Error OCR'ing template regions of {template['id']}: {e}")
+        return None
+
+    lines = []
+    for label in template["fields"]:
+        region_boxes = regions.get(label)
+        value = " ".join(region_boxes.words()) if region_boxes is not None else ""
+        if not value:
+            print(f"Template {template['id']}: no text in the {label!r} region; using the full pipeline")
+            return None
+        lines.append(f"{label}: {value}")
+    text = "\n".join(lines) + "\n"
+
+    with stage("regex"):
+        extracted_data = service._extract_fields(text)
+    extracted_data["raw_text"] = text
+    extracted_data["structured_text"] = None
+    extracted_data["template"] = {"id": template["id"], "similarity": round(similarity, 3)}
+    return extracted_data, text, WordBoxes.concat(list(regions.values()))
@@ -1,15 +1,18 @@
-import re
 from typing import Dict, Any, Optional, List
-import io
-import PyPDF2
-from pdf2image import convert_from_bytes
-import pytesseract
-from PIL import Image
 import os
 import json
-import httpx
 from dotenv import load_dotenv
 
+from ocr_services.page_router import extract_document_text
+from ocr_services.ocr_profiles import get_ocr_profiles
+from ocr_services.layout import structure_text_by_spatial_layout
+from ocr_services.word_boxes import WordBoxes
+from ocr_services.llm_client import get_llm_client
+from ocr_services.refinement import refine_extraction
+from ocr_services.metrics import stage, timed
+from ocr_services.field_specs import FieldSpec, FieldSpecRegistry, FieldMatches
+from ocr_services.sections import SectionSegmenter
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -19,6 +22,51 @@ class TermSheetOCRService:
     Service for extracting structured data from Term Sheet documents.
     """
     
+    # Bump whenever extraction logic changes so cached results are invalidated
+    extractor_version = "1.1.0"
+    
+    # Label patterns used to locate each field for field-gap LLM refinement
+    field_anchors = {
+        "identifiers.ts_id": r"TS[■\-]|Term Sheet",
+        "identifiers.date": r"Date",
+        "identifiers.expiry": r"Expiry",
+        "parties.seller": r"Seller",
+        "parties.buyer": r"Buyer",
+        "commercial.acq": r"ACQ",
+        "commercial.acq_unit": r"ACQ",
+        "commercial.delivery": r"Delivery",
+        "commercial.pricing": r"Pricing",
+        "sustainability.ci_target": r"CI Target",
+        "sustainability.scheme": r"Scheme",
+        "timing.commencement": r"Commencement",
+        "timing.long_stop": r"Long[■\-\s]*Stop"
+    }
+    
+    # Headed sections of a term sheet; fields are only matched inside their own section
+    section_segmenter = SectionSegmenter({
+        "identifiers": ["Identifiers"],
+        "parties": ["Parties"],
+        "commercial": ["Commercial", "Commercial Terms"],
+        "sustainability": ["Sustainability"],
+        "timing": ["Timing"]
+    })
+    
+    # Regex fields, compiled once; each value pattern is matched only where its label occurs
+    field_specs = FieldSpecRegistry([
+        FieldSpec("identifiers.ts", r'TS[■\-][\w■\-]+'),
+        FieldSpec("identifiers.date", r'Date[\s:]+(\d{4}[■\-]\d{2}[■\-]\d{2})'),
+        FieldSpec("identifiers.expiry", r'Expiry[\s:]+(\d{4}[■\-]\d{2}[■\-]\d{2})'),
+        FieldSpec("parties.seller", r'Seller[\s:]+([^\n;]+)'),
+        FieldSpec("parties.buyer", r'Buyer[\s:]+([^\n;]+)'),
+        FieldSpec("commercial.acq", r'ACQ.*?(\d+[\s,]*\d*)\s*(t/yr|tonnes/year|MT/year)'),
+        FieldSpec("commercial.delivery", r'Delivery[\s:]+([^\n]+)'),
+        FieldSpec("commercial.pricing", r'Pricing[\s:]+([^\n]+)'),
+        FieldSpec("sustainability.ci", r'CI Target[\s:]+([≤<]+\s*[-−]?\s*[\d\.]+\s*gCO[■₂2]?/MJ)'),
+        FieldSpec("sustainability.scheme", r'Scheme[\s:]+([^\n]+)'),
+        FieldSpec("timing.commencement", r'Commencement[\s:]+([^\n;]+)'),
+        FieldSpec("timing.long_stop", r'Long[■\-\s]*Stop[\s:]+(\d{4}[■\-]\d{2}[■\-]\d{2})')
+    ], section_segmenter)
+    
     def __init__(self):
         """Initialize the Term Sheet OCR service"""
         # LLM Configuration
@@ -26,138 +74,52 @@ class TermSheetOCRService:
         self.llm_api_url = os.getenv('LLM_API_URL', 'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent')
         self.llm_api_key = os.getenv('LLM_API_KEY')
         self.llm_model = os.getenv('LLM_MODEL', 'gemini-2.0-flash')
+        # 'field_gap' asks the LLM only for missing fields; 'full' re-extracts the whole document
+        self.llm_refinement_mode = os.getenv('LLM_REFINEMENT_MODE', 'field_gap').lower()
+        # Skip the LLM when the regex pass is complete and confident enough
+        self.llm_bypass_min_completeness = float(os.getenv('LLM_BYPASS_MIN_COMPLETENESS', '1.0'))
+        self.llm_bypass_min_confidence = float(os.getenv('LLM_BYPASS_MIN_CONFIDENCE', '0.85'))
+        # Fields below this confidence are re-asked in field_gap mode
+        self.llm_field_min_confidence = float(os.getenv('LLM_FIELD_MIN_CONFIDENCE', '0.6'))
     
     async def process_document(self, content: bytes, filename: str) -> Dict[str, Any]:
         """Process the Term Sheet document and extract structured information."""
-        # Extract text from PDF
-        text = self._extract_text_from_pdf(content)
-        
-        # If text extraction fails, try OCR with bounding boxes
-        structured_text = None
-        if not text or len(text.strip()) < 100:
-            text, bounding_boxes = self._ocr_pdf_with_bounding_boxes(content)
-            if bounding_boxes:
-                structured_text = self._structure_text_by_spatial_layout(bounding_boxes)
+        # Use the text layer where it is usable and OCR only the remaining pages
+        text, structured_text, bounding_boxes = await extract_document_text(
+            content, self._structure_text_by_spatial_layout, get_ocr_profiles().for_doc_type("termsheet")
+        )
         
         processing_text = structured_text if structured_text else text
         
         # Extract structured data
-        extracted_data = {
-            "identifiers": self._extract_identifiers(processing_text),
-            "parties": self._extract_parties(processing_text),
-            "commercial": self._extract_commercial_terms(processing_text),
-            "sustainability": self._extract_sustainability(processing_text),
-            "timing": self._extract_timing(processing_text),
-            "raw_text": text,
-            "structured_text": structured_text
-        }
+        with stage("regex"):
+            extracted_data = self._extract_fields(processing_text)
+        extracted_data["raw_text"] = text
+        extracted_data["structured_text"] = structured_text
         
         # Refine with LLM if enabled
-        if self.use_llm_refinement and self.llm_api_key:
-            try:
-                refined_data = await self._refine_with_llm(extracted_data, processing_text)
-                refined_data["raw_text"] = text
-                refined_data["structured_text"] = structured_text
-                refined_data["llm_refined"] = True
-                return refined_data
-            except Exception as e:
-                print(f"LLM refinement failed: {e}")
-                extracted_data["llm_refined"] = False
-                return extracted_data
-        else:
-            extracted_data["llm_refined"] = False
-            return extracted_data
-    
-    def _extract_text_from_pdf(self, content: bytes) -> str:
-        """Extract text directly from PDF if it contains text layer"""
-        try:
-            pdf_file = io.BytesIO(content)
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            return text
-        except Exception as e:
-            print(f"Error extracting text from PDF: {e}")
-            return ""
+        return await refine_extraction(self, "Term Sheet", extracted_data, processing_text, bounding_boxes)
     
-    def _ocr_pdf_with_bounding_boxes(self, content: bytes) -> tuple[str, List[Dict[str, Any]]]:
-        """Perform OCR with bounding box data."""
-        try:
-            images = convert_from_bytes(content)
-            all_text = ""
-            all_boxes = []
-            
-            for page_num, image in enumerate(images):
-                data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
-                n_boxes = len(data['text'])
-                for i in range(n_boxes):
-                    text = data['text'][i].strip()
-                    if text:
-                        box_info = {
-                            'text': text,
-                            'left': data['left'][i],
-                            'top': data['top'][i],
-                            'width': data['width'][i],
-                            'height': data['height'][i],
-                            'confidence': data['conf'][i],
-                            'page': page_num
-                        }
-                        all_boxes.append(box_info)
-                        all_text += text + " "
-                all_text += "\n"
-            return all_text.strip(), all_boxes
-        except Exception as e:
-            print(f"Error performing bounding box OCR: {e}")
-            return "", []
-    
-    def _structure_text_by_spatial_layout(self, boxes: List[Dict[str, Any]]) -> str:
+    @timed("layout")
+    def _structure_text_by_spatial_layout(self, boxes: WordBoxes) -> str:
         """Structure text based on spatial layout."""
-        if not boxes:
-            return ""
-        
-        lines = []
-        current_line = []
-        current_y = None
-        y_tolerance = 10
-        
-        sorted_boxes = sorted(boxes, key=lambda b: (b['top'], b['left']))
-        
-        for box in sorted_boxes:
-            if current_y is None:
-                current_y = box['top']
-                current_line = [box]
-            elif abs(box['top'] - current_y) <= y_tolerance:
-                current_line.append(box)
-            else:
-                if current_line:
-                    lines.append(current_line)
-                current_line = [box]
-                current_y = box['top']
-        
-        if current_line:
-            lines.append(current_line)
-        
-        structured_text = ""
-        for line in lines:
-            line.sort(key=lambda b: b['left'])
-            prev_right = None
-            for box in line:
-                if prev_right is not None:
-                    gap = box['left'] - prev_right
-                    if gap > 50:
-                        structured_text += "  |  "
-                    elif gap > 20:
-                        structured_text += "  "
-                    else:
-                        structured_text += " "
-                structured_text += box['text']
-                prev_right = box['left'] + box['width']
-            structured_text += "\n"
-        
-        return structured_text
+        return structure_text_by_spatial_layout(boxes)
+    
+    def _extract_fields(self, text: str) -> Dict[str, Any]:
+        """Run the regex extractors over the document text"""
+        fields = self.field_specs.scan(text)
+        extracted = {
+            "identifiers": self._extract_identifiers(fields),
+            "parties": self._extract_parties(fields),
+            "commercial": self._extract_commercial_terms(fields),
+            "sustainability": self._extract_sustainability(fields),
+            "timing": self._extract_timing(fields)
+        }
+        if fields.skipped:
+            extracted["extraction_skipped"] = list(fields.skipped)
+        return extracted
     
-    def _extract_identifiers(self, text: str) -> Dict[str, Any]:
+    def _extract_identifiers(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract identifier information"""
         identifiers = {
             "ts_id": None,
@@ -166,44 +128,39 @@ class TermSheetOCRService:
         }
         
         # Extract TS ID
-        ts_pattern = r'TS[■\-][\w■\-]+'
-        match = re.search(ts_pattern, text, re.IGNORECASE)
+        match = fields.search("identifiers.ts")
         if match:
             identifiers["ts_id"] = match.group(0).strip()
         
         # Extract dates
-        date_pattern = r'Date[\s:]+(\d{4}[■\-]\d{2}[■\-]\d{2})'
-        match = re.search(date_pattern, text, re.IGNORECASE)
+        match = fields.search("identifiers.date")
         if match:
             identifiers["date"] = match.group(1).replace('■', '-')
         
-        expiry_pattern = r'Expiry[\s:]+(\d{4}[■\-]\d{2}[■\-]\d{2})'
-        match = re.search(expiry_pattern, text, re.IGNORECASE)
+        match = fields.search("identifiers.expiry")
         if match:
             identifiers["expiry"] = match.group(1).replace('■', '-')
         
         return identifiers
     
-    def _extract_parties(self, text: str) -> Dict[str, Any]:
+    def _extract_parties(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract party information"""
         parties = {
             "seller": None,
             "buyer": None
         }
         
-        seller_pattern = r'Seller[\s:]+([^\n;]+)'
-        match = re.search(seller_pattern, text, re.IGNORECASE)
+        match = fields.search("parties.seller")
         if match:
             parties["seller"] = match.group(1).strip()
         
-        buyer_pattern = r'Buyer[\s:]+([^\n;]+)'
-        match = re.search(buyer_pattern, text, re.IGNORECASE)
+        match = fields.search("parties.buyer")
         if match:
             parties["buyer"] = match.group(1).strip()
         
         return parties
     
-    def _extract_commercial_terms(self, text: str) -> Dict[str, Any]:
+    def _extract_commercial_terms(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract commercial terms"""
         commercial = {
             "acq": None,
@@ -213,27 +170,24 @@ class TermSheetOCRService:
         }
         
         # Extract ACQ
-        acq_pattern = r'ACQ.*?(\d+[\s,]*\d*)\s*(t/yr|tonnes/year|MT/year)'
-        match = re.search(acq_pattern, text, re.IGNORECASE)
+        match = fields.search("commercial.acq")
         if match:
             commercial["acq"] = match.group(1).replace(' ', '').replace(',', '')
             commercial["acq_unit"] = match.group(2).strip()
         
         # Extract delivery
-        delivery_pattern = r'Delivery[\s:]+([^\n]+)'
-        match = re.search(delivery_pattern, text, re.IGNORECASE)
+        match = fields.search("commercial.delivery")
         if match:
             commercial["delivery"] = match.group(1).strip()
         
         # Extract pricing
-        pricing_pattern = r'Pricing[\s:]+([^\n]+)'
-        match = re.search(pricing_pattern, text, re.IGNORECASE)
+        match = fields.search("commercial.pricing")
         if match:
             commercial["pricing"] = match.group(1).strip()
         
         return commercial
     
-    def _extract_sustainability(self, text: str) -> Dict[str, Any]:
+    def _extract_sustainability(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract sustainability information"""
         sustainability = {
             "ci_target": None,
@@ -241,33 +195,29 @@ class TermSheetOCRService:
         }
         
         # Extract CI target
-        ci_pattern = r'CI Target[\s:]+([≤<]+\s*[-−]?\s*[\d\.]+\s*gCO[■₂2]?/MJ)'
-        match = re.search(ci_pattern, text, re.IGNORECASE)
+        match = fields.search("sustainability.ci")
         if match:
             sustainability["ci_target"] = match.group(1).strip()
         
         # Extract scheme
-        scheme_pattern = r'Scheme[\s:]+([^\n]+)'
-        match = re.search(scheme_pattern, text, re.IGNORECASE)
+        match = fields.search("sustainability.scheme")
         if match:
             sustainability["scheme"] = match.group(1).strip()
         
         return sustainability
     
-    def _extract_timing(self, text: str) -> Dict[str, Any]:
+    def _extract_timing(self, fields: FieldMatches) -> Dict[str, Any]:
         """Extract timing information"""
         timing = {
             "commencement": None,
             "long_stop": None
         }
         
-        commencement_pattern = r'Commencement[\s:]+([^\n;]+)'
-        match = re.search(commencement_pattern, text, re.IGNORECASE)
+        match = fields.search("timing.commencement")
         if match:
             timing["commencement"] = match.group(1).strip()
         
-        long_stop_pattern = r'Long[■\-\s]*Stop[\s:]+(\d{4}[■\-]\d{2}[■\-]\d{2})'
-        match = re.search(long_stop_pattern, text, re.IGNORECASE)
+        match = fields.search("timing.long_stop")
         if match:
             timing["long_stop"] = match.group(1).replace('■', '-')
         
@@ -305,35 +255,15 @@ INSTRUCTIONS:
 
 Return ONLY the corrected JSON, no explanations."""
 
+        generation_config = {
+            "maxOutputTokens": 4096,
+            "temperature": 0.1
+        }
+        
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                headers = {
-                    "X-goog-api-key": self.llm_api_key,
-                    "Content-Type": "application/json"
-                }
-                
-                payload = {
-                    "contents": [{
-                        "parts": [{"text": prompt}]
-                    }],
-                    "generationConfig": {
-                        "maxOutputTokens": 4096,
-                        "temperature": 0.1
-                    }
-                }
-                
-                response = await client.post(self.llm_api_url, headers=headers, json=payload)
-                response.raise_for_status()
-                result = response.json()
-                
-                llm_text = result['candidates'][0]['content']['parts'][0]['text'].strip()
-                if llm_text.startswith('```'):
-                    llm_text = re.sub(r'^```json\s*\n', '', llm_text)
-                    llm_text = re.sub(r'^```\s*\n', '', llm_text)
-                    llm_text = re.sub(r'\n```\s*$', '', llm_text)
-                
-                refined_data = json.loads(llm_text)
-                return refined_data
+            return await get_llm_client().generate_json(
+                self.llm_api_url, self.llm_api_key, self.llm_model, prompt, generation_config
+            )
         except Exception as e:
             print(f"Error in LLM refinement: {str(e)}")
             raise
\ No newline at end of file
@@ -0,0 +1,171 @@
+from typing import Dict, Any, List
+
+import numpy as np
+
+
+class WordBoxes:
+    """
+    Compact struct-of-arrays container for OCR word boxes.
+    Geometry, confidence and page are typed NumPy columns; the words are stored in one string
+    with an offset table, instead of one dict per word.
+    """
+
+    __slots__ = ("text_data", "offsets", "left", "top", "width", "height", "confidence", "page")
+
+    def __init__(
+        self,
+        text_data: str,
+        offsets: np.ndarray,
+        left: np.ndarray,
+        top: np.ndarray,
+        width: np.ndarray,
+        height: np.ndarray,
+        confidence: np.ndarray,
+        page: np.ndarray
+    ):
+        self.text_data = text_data
+        self.offsets = offsets
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+        self.confidence = confidence
+        self.page = page
+
+    @classmethod
+    def from_words(
+        cls,
+        words: List[str],
+        left,
+        top,
+        width,
+        height,
+        confidence,
+        page
+    ) -> "WordBoxes":
+        """Build the container from per-word sequences; page may be a single page number"""
+        # Words are joined with one space so the page text is a single slice of text_data
+        lengths = np.fromiter((len(word) + 1 for word in words), dtype=np.int64, count=len(words))
+        offsets = np.zeros(len(words) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        if np.isscalar(page):
+            page = np.full(len(words), page, dtype=np.int32)
+        return cls(
+            " ".join(words),
+            offsets,
+            np.asarray(left, dtype=np.int32),
+            np.asarray(top, dtype=np.int32),
+            np.asarray(width, dtype=np.int32),
+            np.asarray(height, dtype=np.int32),
+            np.asarray(confidence, dtype=np.float32),
+            np.asarray(page, dtype=np.int32)
+        )
+
+    @classmethod
+    def from_tesseract(cls, data: Dict[str, List[Any]], page_num: int) -> "WordBoxes":
+        """Keep the non-empty words of pytesseract-style image_to_data output"""
+        words = []
+        keep = []
+        for i, text in enumerate(data['text']):
+            text = str(text).strip()
+            if text:
+                words.append(text)
+                keep.append(i)
+
+        def column(name: str) -> list:
+            values = data[name]
+            return [values[i] for i in keep]
+
+        return cls.from_words(
+            words,
+            column('left'),
+            column('top'),
+            column('width'),
+            column('height'),
+            [float(conf) for conf in column('conf')],
+            page_num
+        )
+
+    @classmethod
+    def empty(cls) -> "WordBoxes":
+        return cls.from_words([], [], [], [], [], [], [])
+
+    @classmethod
+    def concat(cls, parts: List["WordBoxes"]) -> "WordBoxes":
+        """Merge several containers (e.g. per-page results) in the given order"""
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return cls.empty()
+        if len(parts) == 1:
+            return parts[0]
+
+        offsets = [parts[0].offsets]
+        base = parts[0].offsets[-1]
+        for part in parts[1:]:
+            offsets.append(part.offsets[1:] + base)
+            base += part.offsets[-1]
+        return cls(
+            " ".join(part.text_data for part in parts),
+            np.concatenate(offsets),
+            *[
+                np.concatenate([getattr(part, name) for part in parts])
+                for name in ("left", "top", "width", "height", "confidence", "page")
+            ]
+        )
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def word(self, index: int) -> str:
+        return self.text_data[self.offsets[index]:self.offsets[index + 1] - 1]
+
+    def words(self) -> List[str]:
+        """All words in order"""
+        if not len(self):
+            return []
+        words = self.text_data.split(" ")
+        if len(words) != len(self):
+            # A word contained a space; fall back to the offset table
+            words = [self.word(i) for i in range(len(self))]
+        return words
+
+    def page_text(self) -> str:
+        """Words separated by spaces, in recognition order"""
+        return self.text_data + " " if len(self) else ""
+
+    def select(self, indices: np.ndarray) -> "WordBoxes":
+        """Return the boxes at the given indices or boolean mask"""
+        indices = np.arange(len(self))[indices]
+        words = self.words()
+        return WordBoxes.from_words(
+            [words[i] for i in indices.tolist()],
+            self.left[indices],
+            self.top[indices],
+            self.width[indices],
+            self.height[indices],
+            self.confidence[indices],
+            self.page[indices]
+        )
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory used by the container"""
+        arrays = (self.offsets, self.left, self.top, self.width, self.height, self.confidence, self.page)
+        return sum(array.nbytes for array in arrays) + len(self.text_data.encode('utf-8'))
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """Expand into the per-word dict layout (for debugging and JSON output)"""
+        return [
+            {
+                'text': word,
+                'left': int(left),
+                'top': int(top),
+                'width': int(width),
+                'height': int(height),
+                'confidence': float(confidence),
+                'page': int(page)
+            }
+            for word, left, top, width, height, confidence, page in zip(
+                self.words(), self.left, self.top, self.width, self.height, self.confidence, self.page
+            )
+        ]
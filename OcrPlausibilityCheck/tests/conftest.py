@@ -0,0 +1,9 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def offline_services(monkeypatch, tmp_path):
+    """Keep services offline and their on-disk state (cache, templates) inside the test's tmp dir"""
+    monkeypatch.setenv('USE_LLM_REFINEMENT', 'false')
+    monkeypatch.setenv('OCR_CACHE_DIR', str(tmp_path / 'ocr_cache'))
+    monkeypatch.setenv('OCR_TEMPLATE_DIR', str(tmp_path / 'ocr_templates'))
@@ -0,0 +1,122 @@
+import re
+from pathlib import Path
+
+import PyPDF2
+import pytest
+
+from ocr_services.field_specs import FieldSpec, FieldSpecRegistry, literal_prefix
+from ocr_services.invoice_ocr import InvoiceOCRService
+from ocr_services.pos_ocr import PoSOCRService
+from ocr_services.pos_ocr2 import PoSOCRServiceTwo
+from ocr_services.ppa_ocr import PPAOCRService
+from ocr_services.termsheet_ocr import TermSheetOCRService
+
+TEST_PDFS = Path(__file__).resolve().parent.parent / "test_pdfs"
+DOCUMENTS = ["PoS_A.pdf", "Invoice_test.pdf", "PPA_test.pdf", "Termsheet_test.pdf"]
+SERVICES = [PoSOCRService, PoSOCRServiceTwo, InvoiceOCRService, PPAOCRService, TermSheetOCRService]
+
+
+def _pdf_text(name: str) -> str:
+    reader = PyPDF2.PdfReader(str(TEST_PDFS / name))
+    return "".join((page.extract_text() or "") + "\n" for page in reader.pages)
+
+
+def _assert_same_match(anchored, plain, name):
+    assert (anchored is None) == (plain is None), name
+    if plain is not None:
+        assert anchored.span() == plain.span(), name
+        assert anchored.groups() == plain.groups(), name
+
+
+@pytest.mark.parametrize("service", SERVICES, ids=lambda service: service.__name__)
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_anchored_search_matches_plain_search_on_test_documents(service, document):
+    text = _pdf_text(document)
+    fields = service.field_specs.scan(text, budget_seconds=0)
+    for name, spec in service.field_specs.specs.items():
+        _assert_same_match(fields.search(name), spec.pattern.search(text), name)
+    assert fields.skipped == []
+
+
+def test_test_documents_exercise_their_extractors():
+    """Guards the comparison above against passing only because nothing matched"""
+    for service, document in [
+        (PoSOCRService, "PoS_A.pdf"),
+        (InvoiceOCRService, "Invoice_test.pdf"),
+        (PPAOCRService, "PPA_test.pdf"),
+        (TermSheetOCRService, "Termsheet_test.pdf"),
+    ]:
+        text = _pdf_text(document)
+        fields = service.field_specs.scan(text, budget_seconds=0)
+        missing = [name for name in service.field_specs.specs if fields.search(name) is None]
+        assert len(missing) <= 2, (service.__name__, missing)
+
+
+@pytest.mark.parametrize("text", [
+    "Life cycle GHG emissions\nE = eec + el + ep = 12.3 gCO2eq/MJ\n",
+    "Total: E=12.3 gCO2eq/MJ\n",
+    "Total GHG emissions e = 12.3 gCO2eq/MJ\n",
+])
+def test_pos2_ghg_total_alternative_anchors(text):
+    spec = PoSOCRServiceTwo.field_specs.specs["ghg_emissions.total"]
+    fields = PoSOCRServiceTwo.field_specs.scan(text, budget_seconds=0)
+    _assert_same_match(fields.search("ghg_emissions.total"), spec.pattern.search(text), text)
+    assert fields.search("ghg_emissions.total").group(1) == "12.3"
+
+
+def test_pos2_ghg_total_is_not_anchored_on_every_e():
+    registry = PoSOCRServiceTwo.field_specs
+    assert registry.specs["ghg_emissions.total"].anchors == ("E =", "E=")
+    assert all(len(anchor) >= 2 for anchor in registry.anchors)
+
+
+@pytest.mark.parametrize("pattern, prefix", [
+    (r'PoS ID[\s:]+([A-Z0-9\-]+)', "PoS ID"),
+    (r'Batch Volumes?[\s:]+', "Batch Volume"),
+    (r'waste|residue', ""),
+    (r'(?:Unique Number|PoS Number)[\s:]+', ""),
+    (r'CI\s*\(LCA\)', "CI"),
+])
+def test_literal_prefix(pattern, prefix):
+    assert literal_prefix(pattern) == prefix
+
+
+def test_short_prefixes_are_searched_unanchored():
+    assert FieldSpec("a", r'E\s*=\s*([0-9.]+)').anchors == ()
+    assert FieldSpec("b", r'Issuer[\s:]+([^\n]+)').anchors == ("Issuer",)
+    assert FieldSpec("c", r'x', anchor=("ab", "cd")).anchors == ("ab", "cd")
+
+
+def test_window_bounds_lazy_patterns():
+    registry = FieldSpecRegistry([
+        FieldSpec("near", r'Compliant.*?Yes', flags=re.IGNORECASE | re.DOTALL, window=40),
+    ])
+    text = "Compliant " + "x" * 100 + " Yes\nCompliant: Yes\n"
+    match = registry.scan(text, budget_seconds=0).search("near")
+    assert match is not None and match.start() == text.index("Compliant: Yes")
+
+
+def test_greedy_value_continues_past_the_window_edge():
+    registry = FieldSpecRegistry([FieldSpec("name", r'Supplier[\s:]+([^\n]+)', window=20)])
+    text = "Supplier: " + "A" * 30 + "\n"
+    match = registry.scan(text, budget_seconds=0).search("name")
+    assert match.group(1) == "A" * 30
+
+
+def test_case_insensitive_anchors_with_length_changing_lowercase():
+    registry = FieldSpecRegistry([FieldSpec("issuer", r'Issuer[\s:]+([^\n]+)')])
+    # 'İ' lowercases to two characters, so anchor offsets come from the regex instead
+    text = "İİ ISSUER: ACME\n"
+    assert registry.scan(text, budget_seconds=0).search("issuer").group(1) == "ACME"
+
+
+def test_spent_budget_skips_fields():
+    text = _pdf_text("PoS_A.pdf")
+    fields = PoSOCRService.field_specs.scan(text, budget_seconds=1e-9)
+    assert fields.search("certificate.pos_id") is None
+    assert fields.skipped == ["certificate.pos_id"]
+
+
+def test_duplicate_field_names_are_rejected():
+    with pytest.raises(ValueError):
+        FieldSpecRegistry([FieldSpec("a", r'Issuer'), FieldSpec("a", r'Scheme')])
@@ -0,0 +1,81 @@
+import random
+
+import numpy as np
+
+from ocr_services.layout import LINE_TOLERANCE_RATIO, assign_lines, structure_text_by_spatial_layout
+from ocr_services.word_boxes import WordBoxes
+
+
+def _boxes(words, page=0):
+    """WordBoxes from (text, left, top) entries with 12px per character and 25px high words"""
+    return WordBoxes.from_words(
+        [text for text, _, _ in words],
+        [left for _, left, _ in words],
+        [top for _, _, top in words],
+        [12 * len(text) for text, _, _ in words],
+        [25] * len(words),
+        [90] * len(words),
+        page
+    )
+
+
+def _reference_lines(page, top, height):
+    """The original per-word loop: a line is every word within tolerance of the top of its first word"""
+    order = np.lexsort((top, page))
+    line_ids = []
+    line, line_page, line_top = -1, None, None
+    for i in order.tolist():
+        median = max(float(np.median(height[page == page[i]])), 1.0)
+        if page[i] != line_page or top[i] - line_top > median * LINE_TOLERANCE_RATIO:
+            line, line_page, line_top = line + 1, page[i], top[i]
+        line_ids.append(line)
+    return order, line_ids
+
+
+def test_lines_match_the_per_word_reference():
+    rng = random.Random(0)
+    for _ in range(200):
+        count = rng.randint(1, 60)
+        page = np.array([rng.randint(0, 2) for _ in range(count)])
+        top = np.array([rng.uniform(0, 300) for _ in range(count)])
+        height = np.array([rng.choice([20.0, 25.0, 40.0]) for _ in range(count)])
+        order, line_ids = assign_lines(page, top, height)
+        expected_order, expected_ids = _reference_lines(page, top, height)
+        assert order.tolist() == expected_order.tolist()
+        assert line_ids.tolist() == expected_ids
+
+
+def test_gradually_stepping_words_do_not_chain_into_one_line():
+    # A skewed scan: every word sits 4px below the previous one (tolerance is 0.4 * 25 = 10px)
+    top = np.arange(0, 40, 4.0)
+    _, line_ids = assign_lines(np.zeros(len(top), dtype=int), top, np.full(len(top), 25.0))
+    assert line_ids.tolist() == [0, 0, 0, 1, 1, 1, 2, 2, 2, 3]
+
+
+def test_words_are_ordered_left_to_right_within_a_line():
+    boxes = _boxes([("Date:", 10, 100), ("Issuer:", 10, 60), ("2024-01-05", 90, 103), ("ACME", 110, 58)])
+    assert structure_text_by_spatial_layout(boxes) == "Issuer: ACME\nDate: 2024-01-05\n"
+
+
+def test_gaps_become_separators_relative_to_word_height():
+    # 25px words: gaps over 20px are wide, gaps over 50px separate columns
+    boxes = _boxes([("Batch", 0, 0), ("ID", 70, 0), ("B-1", 120, 0), ("Volume", 300, 0)])
+    assert structure_text_by_spatial_layout(boxes) == "Batch ID  B-1  |  Volume\n"
+
+
+def test_layout_does_not_depend_on_resolution():
+    words = [("Supplier:", 10, 100), ("ACME", 140, 104), ("Recipient:", 400, 98), ("Shipping", 550, 101)]
+    low = _boxes(words)
+    high = WordBoxes.from_words(
+        low.words(), low.left * 2, low.top * 2, low.width * 2, low.height * 2, low.confidence, 0
+    )
+    assert structure_text_by_spatial_layout(low) == structure_text_by_spatial_layout(high)
+
+
+def test_pages_are_laid_out_in_order():
+    boxes = WordBoxes.concat([_boxes([("second", 0, 0)], page=1), _boxes([("first", 0, 500)], page=0)])
+    assert structure_text_by_spatial_layout(boxes) == "first\nsecond\n"
+
+
+def test_empty_boxes():
+    assert structure_text_by_spatial_layout(WordBoxes.empty()) == ""
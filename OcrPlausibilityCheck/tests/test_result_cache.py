@@ -0,0 +1,158 @@
+import importlib.util
+import os
+
+import pytest
+
+import main
+from ocr_services import ocr_backends, ocr_executor
+from ocr_services.pos_ocr import PoSOCRService
+from ocr_services.ppa_ocr import PPAOCRService
+from ocr_services.preprocessing import PreprocessSettings
+from ocr_services.result_cache import ExtractionCache
+from ocr_services.templates import TemplateStore
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ExtractionCache(str(tmp_path / "cache"), memory_entries=2, disk_max_bytes=10_000, enabled=True)
+
+
+def test_round_trip_returns_a_copy(cache):
+    cache.put("k", {"a": [1]})
+    first = cache.get("k")
+    first["a"].append(2)
+    assert cache.get("k") == {"a": [1]}
+    assert cache.get("missing") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_memory_tier_evicts_least_recently_used(cache):
+    cache.put("a", {"v": "a"})
+    cache.put("b", {"v": "b"})
+    cache.get("a")
+    cache.put("c", {"v": "c"})
+
+    assert list(cache._memory) == ["a", "c"]
+    # Evicted from memory, still served from disk and promoted back
+    assert cache.get("b") == {"v": "b"}
+    assert cache.stats()["hits"] == {"memory": 1, "disk": 1}
+    assert list(cache._memory) == ["c", "b"]
+
+
+def test_disk_tier_evicts_oldest_entries_over_the_size_limit(tmp_path):
+    cache = ExtractionCache(str(tmp_path / "cache"), memory_entries=1, disk_max_bytes=250, enabled=True)
+    value = {"text": "x" * 80}
+    for age, key in enumerate(["old", "mid", "new"]):
+        cache.put(key, value)
+        os.utime(cache._path(key), (1_000_000 + age, 1_000_000 + age))
+
+    cache.put("latest", value)
+
+    assert not os.path.exists(cache._path("old"))
+    assert not os.path.exists(cache._path("mid"))
+    assert os.path.exists(cache._path("new"))
+    assert os.path.exists(cache._path("latest"))
+    assert cache.stats()["disk_bytes"] <= 250
+
+
+def test_disk_size_survives_restart(tmp_path, cache):
+    cache.put("a", {"v": 1})
+    reopened = ExtractionCache(cache.cache_dir, enabled=True)
+    assert reopened.stats()["disk_bytes"] == cache.stats()["disk_bytes"]
+    assert reopened.get("a") == {"v": 1}
+
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    cache = ExtractionCache(str(tmp_path / "cache"), enabled=False)
+    cache.put("a", {"v": 1})
+    assert cache.get("a") is None
+    assert not os.path.exists(tmp_path / "cache")
+
+
+def test_key_covers_content_doc_type_and_variant():
+    key = ExtractionCache.make_key(b"pdf", "pos", "v1")
+    assert key != ExtractionCache.make_key(b"pdf2", "pos", "v1")
+    assert key != ExtractionCache.make_key(b"pdf", "invoice", "v1")
+    assert key != ExtractionCache.make_key(b"pdf", "pos", "v2")
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    """A fresh OCR executor singleton, so settings changed by a test don't leak"""
+    monkeypatch.setattr(ocr_executor, "_ocr_executor", None)
+    return ocr_executor.get_ocr_executor()
+
+
+@pytest.fixture
+def templates(monkeypatch, tmp_path):
+    store = TemplateStore(str(tmp_path / "templates"), enabled=True)
+    monkeypatch.setattr(main, "get_template_store", lambda: store)
+    return store
+
+
+def test_variant_changes_with_ocr_settings(executor, templates):
+    service = PoSOCRService()
+    variant = main._extraction_variant(service, "pos")
+    assert main._extraction_variant(service, "pos") == variant
+
+    executor.dpi = 150
+    assert main._extraction_variant(service, "pos") != variant
+    executor.dpi = 200
+    executor.preprocess = PreprocessSettings(binarize=True)
+    assert main._extraction_variant(service, "pos") != variant
+    executor.preprocess = PreprocessSettings()
+    assert main._extraction_variant(service, "pos") == variant
+
+
+def test_variant_changes_with_ocr_engine(executor, templates, monkeypatch):
+    find_spec = importlib.util.find_spec
+    monkeypatch.setattr(
+        ocr_backends.importlib.util, "find_spec",
+        lambda name, *args: object() if name == "tesserocr" else find_spec(name, *args)
+    )
+    service = PoSOCRService()
+    executor.ocr_backend = "auto"
+    tesserocr_variant = main._extraction_variant(service, "pos")
+    executor.ocr_backend = "pytesseract"
+    assert main._extraction_variant(service, "pos") != tesserocr_variant
+
+
+def test_variant_changes_with_language(executor, templates, monkeypatch):
+    service = PoSOCRService()
+    variant = main._extraction_variant(service, "pos")
+    monkeypatch.setenv('OCR_TESSERACT_LANG', 'deu')
+    assert main._extraction_variant(service, "pos") != variant
+
+
+def test_variant_covers_roi_settings_only_when_enabled(executor, templates, monkeypatch):
+    service = PoSOCRService()
+    service.use_roi_ocr = False
+    without_roi = main._extraction_variant(service, "pos")
+    monkeypatch.setenv('OCR_ROI_DPI', '300')
+    assert main._extraction_variant(service, "pos") == without_roi
+
+    service.use_roi_ocr = True
+    with_roi = main._extraction_variant(service, "pos")
+    assert with_roi != without_roi
+    monkeypatch.setenv('OCR_ROI_MIN_CONFIDENCE', '0.5')
+    assert main._extraction_variant(service, "pos") != with_roi
+
+
+def test_variant_changes_when_a_template_is_learned(executor, templates):
+    pos, ppa = PoSOCRService(), PPAOCRService()
+    pos_variant, ppa_variant = main._extraction_variant(pos, "pos"), main._extraction_variant(ppa, "ppa")
+
+    template = {"id": "pos-1", "doc_type": "pos", "fingerprint": [["acme", 1, 1]], "fields": {"PoS ID": {}}}
+    templates.save(template)
+    learned = main._extraction_variant(pos, "pos")
+    assert learned != pos_variant
+    assert main._extraction_variant(ppa, "ppa") == ppa_variant
+
+    templates.save({**template, "fields": {"PoS ID": {}, "Scheme": {}}})
+    assert main._extraction_variant(pos, "pos") != learned
+
+
+def test_variant_marks_early_stop(executor, templates):
+    service = PoSOCRService()
+    service.use_early_stop = True
+    assert main._extraction_variant(service, "pos").endswith("-early_stop")
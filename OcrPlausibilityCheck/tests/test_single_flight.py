@@ -0,0 +1,195 @@
+import asyncio
+
+import pytest
+
+from ocr_services.single_flight import SingleFlight
+
+
+class Computation:
+    """A computation the test finishes (or fails) on demand, counting how often it was started"""
+
+    def __init__(self):
+        self.started = 0
+        self.cancelled = False
+        self.release = None
+
+    async def __call__(self):
+        self.started += 1
+        self.release = asyncio.get_running_loop().create_future()
+        try:
+            return await self.release
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_concurrent_calls_share_one_run_and_get_own_copies():
+    async def run():
+        flight = SingleFlight(enabled=True)
+        compute = Computation()
+        first = asyncio.ensure_future(flight.do("k", compute))
+        second = asyncio.ensure_future(flight.do("k", compute))
+        await _settle()
+        compute.release.set_result({"fields": ["a"]})
+        (first_result, first_shared), (second_result, second_shared) = await asyncio.gather(first, second)
+
+        assert compute.started == 1
+        assert (first_shared, second_shared) == (False, True)
+        first_result["fields"].append("b")
+        assert second_result == {"fields": ["a"]}
+        assert flight.stats()["started"] == 1 and flight.stats()["coalesced"] == 1
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+def test_different_keys_run_separately():
+    async def run():
+        flight = SingleFlight(enabled=True)
+        calls = []
+
+        async def compute(key):
+            calls.append(key)
+            return key
+
+        results = await asyncio.gather(flight.do("a", lambda: compute("a")), flight.do("b", lambda: compute("b")))
+        assert results == [("a", False), ("b", False)]
+        assert sorted(calls) == ["a", "b"]
+
+    asyncio.run(run())
+
+
+def test_finished_runs_are_not_reused():
+    async def run():
+        flight = SingleFlight(enabled=True)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            return len(calls)
+
+        assert await flight.do("k", compute) == (1, False)
+        assert await flight.do("k", compute) == (2, False)
+
+    asyncio.run(run())
+
+
+def test_exception_reaches_every_waiter():
+    async def run():
+        flight = SingleFlight(enabled=True)
+        compute = Computation()
+        waiters = [asyncio.ensure_future(flight.do("k", compute)) for _ in range(3)]
+        await _settle()
+        compute.release.set_exception(ValueError("broken pdf"))
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_does_not_cancel_the_shared_run():
+    async def run():
+        flight = SingleFlight(enabled=True)
+        compute = Computation()
+        first = asyncio.ensure_future(flight.do("k", compute))
+        second = asyncio.ensure_future(flight.do("k", compute))
+        await _settle()
+
+        first.cancel()
+        await _settle()
+        assert first.cancelled()
+        assert not compute.cancelled
+
+        compute.release.set_result("done")
+        assert await second == ("done", True)
+        assert flight.stats()["cancelled"] == 0
+
+    asyncio.run(run())
+
+
+def test_run_is_cancelled_when_its_last_waiter_leaves():
+    async def run():
+        flight = SingleFlight(enabled=True)
+        compute = Computation()
+        only = asyncio.ensure_future(flight.do("k", compute))
+        await _settle()
+
+        only.cancel()
+        await _settle()
+        assert compute.cancelled
+        assert flight.stats()["cancelled"] == 1
+        assert flight.stats()["in_flight"] == 0
+
+        # A later caller starts a fresh run instead of joining the cancelled one
+        later = Computation()
+        task = asyncio.ensure_future(flight.do("k", later))
+        await _settle()
+        later.release.set_result("fresh")
+        assert await task == ("fresh", False)
+
+    asyncio.run(run())
+
+
+def test_disabled_runs_every_call():
+    async def run():
+        flight = SingleFlight(enabled=False)
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0)
+            return "r"
+
+        results = await asyncio.gather(flight.do("k", compute), flight.do("k", compute))
+        assert results == [("r", False), ("r", False)]
+        assert len(calls) == 2
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("enabled", ["true", "false"])
+def test_enabled_from_environment(monkeypatch, enabled):
+    monkeypatch.setenv('OCR_SINGLE_FLIGHT', enabled)
+    assert SingleFlight().enabled is (enabled == "true")
+
+
+def test_identical_uploads_are_extracted_once(monkeypatch, tmp_path):
+    import main
+    from ocr_services import single_flight
+    from ocr_services.pos_ocr import PoSOCRService
+    from ocr_services.result_cache import ExtractionCache
+    from ocr_services.templates import TemplateStore
+
+    cache = ExtractionCache(str(tmp_path / "cache"), enabled=True)
+    templates = TemplateStore(str(tmp_path / "templates"), enabled=True)
+    monkeypatch.setattr(main, "get_extraction_cache", lambda: cache)
+    monkeypatch.setattr(main, "get_template_store", lambda: templates)
+    monkeypatch.setattr(single_flight, "_single_flight", SingleFlight(enabled=True))
+
+    service = PoSOCRService()
+    calls = []
+
+    async def process_document(content, filename):
+        calls.append(filename)
+        await asyncio.sleep(0.01)
+        return {"certificate": {"pos_id": "POS-1"}}
+
+    service.process_document = process_document
+
+    async def run():
+        return await asyncio.gather(*[
+            main._extract_with_cache(service, "pos", b"%PDF same bytes", f"upload-{i}.pdf") for i in range(3)
+        ])
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert [result for result, _ in results] == [{"certificate": {"pos_id": "POS-1"}}] * 3
+    # Later uploads are served from the cache the shared run filled
+    assert all(cached for _, cached in asyncio.run(run()))
+    assert len(calls) == 1
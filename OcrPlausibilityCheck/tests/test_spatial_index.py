@@ -0,0 +1,128 @@
+import random
+
+import numpy as np
+
+from ocr_services.pos_ocr import PoSOCRService
+from ocr_services.spatial_index import KeyValueEngine, SpatialIndex, fill_from_layout, page_fractions
+from ocr_services.word_boxes import WordBoxes
+
+
+def _boxes(lines, page=0, confidence=90):
+    """WordBoxes from (top, [(left, 'words of a cell'), ...]) lines; 12px per character, 25px high words"""
+    words, left, top, width = [], [], [], []
+    for line_top, cells in lines:
+        for x, cell in cells:
+            for word in cell.split(" "):
+                words.append(word)
+                left.append(x)
+                top.append(line_top)
+                width.append(12 * len(word))
+                x += 12 * len(word) + 10
+    return WordBoxes.from_words(words, left, top, width, [25] * len(words), [confidence] * len(words), page)
+
+
+def test_query_matches_a_brute_force_scan():
+    rng = random.Random(1)
+    count = 400
+    boxes = WordBoxes.from_words(
+        [f"w{i}" for i in range(count)],
+        [rng.uniform(0, 1600) for _ in range(count)],
+        [rng.uniform(0, 2200) for _ in range(count)],
+        [rng.uniform(10, 300) for _ in range(count)],
+        [rng.uniform(15, 40) for _ in range(count)],
+        [90] * count,
+        np.array([rng.randint(0, 2) for _ in range(count)])
+    )
+    index = SpatialIndex(boxes)
+    for _ in range(200):
+        page = rng.randint(0, 2)
+        x0, y0 = rng.uniform(-50, 1600), rng.uniform(-50, 2200)
+        x1, y1 = x0 + rng.uniform(0, 400), y0 + rng.uniform(0, 200)
+        expected = np.flatnonzero(
+            (index.page == page) & (index.left <= x1) & (index.right >= x0) & (index.top <= y1) & (index.bottom >= y0)
+        )
+        assert index.query(page, x0, y0, x1, y1).tolist() == expected.tolist()
+
+
+def test_value_right_of_label():
+    boxes = _boxes([(100, [(50, "PoS ID:"), (200, "POS-2024-001")]), (140, [(50, "Scheme: ISCC EU")])])
+    engine = KeyValueEngine(boxes, ["PoS ID", "Scheme"])
+    assert engine.resolve("PoS ID")["value"] == "POS-2024-001"
+    assert engine.resolve("PoS ID")["direction"] == "right"
+    assert engine.resolve("Scheme")["value"] == "ISCC EU"
+
+
+def test_two_column_table_stops_at_the_column_gap():
+    boxes = _boxes([(100, [(50, "Supplier:"), (180, "ACME Fuels GmbH"), (900, "Recipient:"), (1030, "Shipping Co")])])
+    engine = KeyValueEngine(boxes, ["Supplier", "Recipient"])
+    assert engine.resolve("Supplier")["value"] == "ACME Fuels GmbH"
+    assert engine.resolve("Recipient")["value"] == "Shipping Co"
+
+
+def test_value_below_a_table_header():
+    boxes = _boxes([
+        (100, [(50, "Batch ID"), (400, "Batch Volume")]),
+        (140, [(50, "B-77"), (400, "1200 t")]),
+    ])
+    engine = KeyValueEngine(boxes, ["Batch ID", "Batch Volume"])
+    assert engine.resolve("Batch ID") == {"label": "Batch ID", "value": "B-77", "direction": "below", "confidence": 0.9}
+    assert engine.resolve("Batch Volume")["value"] == "1200 t"
+
+
+def test_run_ends_where_the_next_label_starts():
+    boxes = _boxes([(100, [(50, "Issuer: ACME Validity: 5 Years")])])
+    engine = KeyValueEngine(boxes, ["Issuer", "Validity"])
+    assert engine.resolve("Issuer")["value"] == "ACME"
+    assert engine.resolve("Validity")["value"] == "5 Years"
+
+
+def test_lone_colon_is_not_part_of_the_value():
+    boxes = _boxes([(100, [(50, "Issuer"), (140, ":"), (170, "ACME")])])
+    assert KeyValueEngine(boxes, ["Issuer"]).resolve("Issuer")["value"] == "ACME"
+
+
+def test_multi_word_labels_need_their_words_on_one_line():
+    boxes = _boxes([(100, [(50, "Issue")]), (300, [(50, "Date: 2024-01-05")])])
+    engine = KeyValueEngine(boxes, ["Issue Date"])
+    assert engine.find_label("Issue Date") == []
+    assert engine.resolve("Issue Date") is None
+
+
+def test_labels_on_later_pages():
+    boxes = WordBoxes.concat([
+        _boxes([(100, [(50, "Annex")])], page=0),
+        _boxes([(100, [(50, "Issuer:"), (200, "ACME")])], page=1),
+    ])
+    engine = KeyValueEngine(boxes, ["Issuer"])
+    direction, run = engine.value_run("Issuer")
+    assert [engine.words[i] for i in run] == ["ACME"]
+    assert int(engine.index.page[run[0]]) == 1
+
+
+def test_value_region_stops_before_the_next_column():
+    boxes = _boxes([(100, [(50, "Supplier:"), (180, "ACME"), (900, "Recipient:")])])
+    engine = KeyValueEngine(boxes, ["Supplier", "Recipient"])
+    _, run = engine.value_run("Supplier")
+    x0, y0, x1, y1 = engine.value_region(run, 1700, 2200)
+    assert x0 < 180 and y0 < 100
+    assert 228 <= x1 < 900 and y1 > 125
+
+
+def test_page_fractions_are_independent_of_resolution():
+    assert page_fractions((170, 1100, 850, 2200), 1700, 2200) == [0.1, 0.5, 0.5, 1.0]
+    assert page_fractions((340, 2200, 1700, 4400), 3400, 4400) == [0.1, 0.5, 0.5, 1.0]
+
+
+def test_fill_from_layout_fixes_values_that_ran_into_the_next_column():
+    boxes = _boxes([
+        (100, [(50, "Supplier:"), (180, "ACME Fuels"), (900, "Recipient:"), (1030, "Shipping Co")]),
+        (140, [(50, "PoS ID:"), (200, "POS-1")]),
+    ])
+    service = PoSOCRService()
+    extracted = service._extract_fields("Supplier: ACME Fuels  |  Recipient: Shipping Co\n")
+    assert "|" in extracted["parties"]["supplier"]
+
+    filled = fill_from_layout(service, extracted, boxes)
+    assert extracted["parties"]["supplier"] == "ACME Fuels"
+    assert extracted["certificate"]["pos_id"] == "POS-1"
+    assert {"parties.supplier", "certificate.pos_id"} <= set(filled)